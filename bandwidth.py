@@ -0,0 +1,223 @@
+import threading
+import time
+from datetime import datetime
+
+# 不限速时下发给设备的速度（kbps）
+UNLIMITED_KBPS = 1024 * 1024
+# 调整幅度小于该比例时不重新下发速度，避免频繁调用 SDK
+MIN_ADJUST_RATIO = 0.1
+# 实测速率低于分配额度的该比例时，认为传输不受限速约束，多余的额度分给其他传输
+UNDERUSE_RATIO = 0.8
+# 传输开始后的测速预热时间（秒），预热期间不按实测速率回收额度
+WARMUP_SECONDS = 5
+# 按实测速率回收额度时保留的最低额度（kbps），保证传输能够重新提速
+MIN_SHARE_KBPS = 256
+
+
+class _Transfer:
+    """单个下载传输的速率统计"""
+
+    def __init__(self, device):
+        self.device = device
+        self.last_bytes = 0
+        self.started = time.monotonic()
+        self.last_time = self.started
+        self.rate_kbps = None  # 实测速率
+        self.applied_kbps = None  # 已下发给设备的速度
+
+
+def _water_fill(budget, demands):
+    """
+    最大最小公平分配
+
+    参数:
+    budget (float): 总额度
+    demands (dict): key -> 需求（None 表示无上限）
+
+    返回:
+    dict: key -> 分配额度
+    """
+    shares = {}
+    pending = dict(demands)
+    remaining = budget
+    while pending:
+        fair = remaining / len(pending)
+        satisfied = {k: d for k, d in pending.items() if d is not None and d <= fair}
+        if not satisfied:
+            for key in pending:
+                shares[key] = fair
+            break
+        for key, demand in satisfied.items():
+            shares[key] = demand
+            remaining -= demand
+            del pending[key]
+    return shares
+
+
+class BandwidthGovernor:
+    """
+    下载带宽控制器
+
+    根据下载文件的增长量测量各传输的实际速率，在全局与单设备带宽预算内
+    按最大最小公平原则分配额度，并通过 SDK 的回放控制接口限制下载速度。
+    预算可以按时段配置，例如夜间不限速、白天限速。
+    """
+
+    def __init__(self, global_kbps=0, device_kbps=0, schedule=None):
+        """
+        参数:
+        global_kbps (int): 默认全局带宽上限（kbps），0 表示不限制
+        device_kbps (int): 默认单设备带宽上限（kbps），0 表示不限制
+        schedule (list): 分时段上限，如
+            [{"start": "07:00", "end": "20:00", "global_kbps": 8000, "device_kbps": 6000}]
+            结束时间早于开始时间表示跨越午夜
+        """
+        self.global_kbps = global_kbps
+        self.device_kbps = device_kbps
+        self.schedule = [self._parse_period(p) for p in (schedule or [])]
+        self.transfers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """根据 settings['bandwidth'] 创建，未启用时返回 None"""
+        if not settings.get('enabled'):
+            return None
+        return cls(settings.get('global_kbps', 0), settings.get('device_kbps', 0),
+                   settings.get('schedule'))
+
+    @staticmethod
+    def _parse_period(period):
+        start = datetime.strptime(period['start'], '%H:%M').time()
+        end = datetime.strptime(period['end'], '%H:%M').time()
+        return start, end, period.get('global_kbps', 0), period.get('device_kbps', 0)
+
+    def budget(self, now=None):
+        """返回当前时段的 (全局上限, 单设备上限)，0 表示不限制"""
+        current = (now or datetime.now()).time()
+        for start, end, global_kbps, device_kbps in self.schedule:
+            if start <= end:
+                active = start <= current < end
+            else:
+                active = current >= start or current < end
+            if active:
+                return global_kbps, device_kbps
+        return self.global_kbps, self.device_kbps
+
+    def register(self, key, device):
+        """登记一个新的下载传输"""
+        with self._lock:
+            self.transfers[key] = _Transfer(device)
+
+    def unregister(self, key):
+        """移除下载传输，其额度在下次分配时分给其他传输"""
+        with self._lock:
+            self.transfers.pop(key, None)
+
+    def report(self, key, total_bytes):
+        """
+        上报传输当前已下载的字节数
+
+        返回:
+        int: 需要下发给设备的新速度（kbps）；无需调整时返回 None
+        """
+        with self._lock:
+            transfer = self.transfers.get(key)
+            if transfer is None:
+                return None
+
+            now = time.monotonic()
+            elapsed = now - transfer.last_time
+            if elapsed > 0 and total_bytes >= transfer.last_bytes:
+                transfer.rate_kbps = (total_bytes - transfer.last_bytes) * 8 / 1000 / elapsed
+            transfer.last_bytes = total_bytes
+            transfer.last_time = now
+
+            target = self._allocate().get(key)
+            if target is None:
+                target = UNLIMITED_KBPS
+            target = max(int(target), 1)
+
+            applied = transfer.applied_kbps
+            if applied is not None and abs(target - applied) <= applied * MIN_ADJUST_RATIO:
+                return None
+            if applied is None and target == UNLIMITED_KBPS:
+                # 从未限速且仍不需要限速，不调用 SDK
+                transfer.applied_kbps = target
+                return None
+            transfer.applied_kbps = target
+            return target
+
+    def _allocate(self):
+        """计算所有传输的额度（调用方持有锁），不限速的传输不出现在结果中"""
+        global_kbps, device_kbps = self.budget()
+        if not global_kbps and not device_kbps:
+            return {}
+
+        # 实测速率明显低于已分配额度的传输只按实际需求占用额度
+        now = time.monotonic()
+        demands = {}
+        for key, transfer in self.transfers.items():
+            demand = None
+            if (now - transfer.started >= WARMUP_SECONDS
+                    and transfer.rate_kbps is not None and transfer.applied_kbps is not None
+                    and transfer.rate_kbps < transfer.applied_kbps * UNDERUSE_RATIO):
+                demand = max(transfer.rate_kbps / UNDERUSE_RATIO, MIN_SHARE_KBPS)
+            demands[key] = demand
+
+        shares = {}
+        if device_kbps:
+            devices = {}
+            for key, transfer in self.transfers.items():
+                devices.setdefault(transfer.device, {})[key] = demands[key]
+            for device_demands in devices.values():
+                shares.update(_water_fill(device_kbps, device_demands))
+
+        if global_kbps:
+            # 先受单设备额度约束，再在全局预算内分配
+            capped = {}
+            for key, demand in demands.items():
+                limit = shares.get(key)
+                if limit is not None:
+                    demand = limit if demand is None else min(demand, limit)
+                capped[key] = demand
+            shares = _water_fill(global_kbps, capped)
+        return shares
+
+
+class RemoteGovernor:
+    """
+    工作进程中的带宽控制器代理
+
+    与 BandwidthGovernor 接口相同，但不自行分配额度：登记 / 上报 / 移除传输的消息经 send
+    发给协调进程，由协调进程中的 BandwidthGovernor 在所有工作进程的传输之间统一分配，
+    分配结果通过 set_rate 回传，在下一次 report 时返回给下载器下发给设备。
+    """
+
+    def __init__(self, send):
+        """
+        参数:
+        send (callable): send(*message)，把消息发给协调进程
+        """
+        self.send = send
+        self._rates = {}  # key -> 协调进程下发、尚未应用的速度（kbps）
+        self._lock = threading.Lock()
+
+    def register(self, key, device):
+        self.send('bw_register', key, device)
+
+    def unregister(self, key):
+        with self._lock:
+            self._rates.pop(key, None)
+        self.send('bw_unregister', key)
+
+    def report(self, key, total_bytes):
+        """上报已下载字节数，返回协调进程最近下发的新速度（没有时返回 None）"""
+        self.send('bw_report', key, total_bytes)
+        with self._lock:
+            return self._rates.pop(key, None)
+
+    def set_rate(self, key, kbps):
+        """接收协调进程下发的速度"""
+        with self._lock:
+            self._rates[key] = kbps
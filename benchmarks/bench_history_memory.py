@@ -0,0 +1,77 @@
+"""
+已完成任务记录的内存占用对比
+
+分别用旧版的字典列表和 history_store.CompletedHistory 保存 N 条记录，
+用 tracemalloc 统计内存占用，并比较按任务名判断是否已下载的耗时。
+
+用法:
+    python benchmarks/bench_history_memory.py [记录数，默认 1000000]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import TIME_FORMAT, CompletedHistory  # noqa: E402
+
+CHANNELS = [33, 34, 35, 36]
+
+
+def make_names(count):
+    start = datetime(2024, 1, 1)
+    return [(start + timedelta(seconds=i * 7)).strftime('%Y%m%d%H%M%S') + f"_{i}" for i in range(count)]
+
+
+def build_dicts(names, base):
+    return [{
+        'filename': name,
+        'channels': list(CHANNELS),
+        'completion_time': datetime.fromtimestamp(base + i).strftime(TIME_FORMAT),
+    } for i, name in enumerate(names)]
+
+
+def build_history(names, base):
+    history = CompletedHistory()
+    for i, name in enumerate(names):
+        history.add(name, CHANNELS, base + i)
+    return history
+
+
+def measure(label, builder, names, base):
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = builder(names, base)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label}: 当前 {current / 1024 / 1024:.1f} MB，峰值 {peak / 1024 / 1024:.1f} MB，"
+          f"构建 {elapsed:.2f} s")
+    return store
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    base = int(time.time())
+    # 任务名字符串两种方式共享，不计入对比
+    names = make_names(count)
+    print(f"记录数: {count}")
+
+    dicts = measure("list[dict]", build_dicts, names, base)
+    history = measure("CompletedHistory", build_history, names, base)
+
+    probes = names[::max(1, count // 100)]
+    start = time.perf_counter()
+    for name in probes:
+        any(info['filename'] == name for info in dicts)
+    print(f"list[dict] 查找 {len(probes)} 次: {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    for name in probes:
+        name in history
+    print(f"CompletedHistory 查找 {len(probes)} 次: {time.perf_counter() - start:.4f} s")
+
+
+if __name__ == '__main__':
+    main()
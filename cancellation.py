@@ -0,0 +1,61 @@
+import threading
+
+
+class CancelToken:
+    """
+    取消令牌
+
+    由下载线程持有并传入下载引擎；界面线程调用 cancel() 后，已注册的回调
+    （例如对正在进行的 SDK 下载句柄调用 NET_DVR_StopGetFile）会被立即执行，
+    等待中的 wait() 也会立即返回。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._next_id = 0
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """取消并执行所有已注册的回调，重复调用无效"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"执行取消回调出错: {e}")
+
+    def register(self, callback):
+        """
+        注册取消回调；若已取消则立即执行
+
+        返回:
+        callable: 调用后注销该回调
+        """
+        with self._lock:
+            if not self._event.is_set():
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._unregister(callback_id)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback_id):
+        with self._lock:
+            self._callbacks.pop(callback_id, None)
+
+    def wait(self, timeout):
+        """等待 timeout 秒或直到被取消，被取消时返回 True"""
+        return self._event.wait(timeout)
@@ -0,0 +1,402 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from history_store import TIME_FORMAT
+
+# 请求头 / 请求体大小上限
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 4 * 1024 * 1024
+# 单次批量提交的最大任务数
+MAX_BATCH_TASKS = 10000
+# 每个 SSE 客户端缓存的最大事件数，客户端读取过慢时丢弃新事件
+EVENT_QUEUE_SIZE = 1000
+# SSE 心跳间隔（秒）
+EVENT_HEARTBEAT_SECONDS = 15
+# 只给出触发时间时默认下载的时间段
+DEFAULT_PRE_ROLL = 360
+DEFAULT_POST_ROLL = 0
+
+HTTP_REASONS = {
+    200: 'OK', 204: 'No Content', 400: 'Bad Request', 401: 'Unauthorized',
+    404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+class ApiError(Exception):
+    """返回给客户端的错误"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_time(value, name):
+    """接受 '%Y-%m-%d %H:%M:%S' 字符串或 epoch 秒"""
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError(f"{name} 超出范围: {value!r}")
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value, TIME_FORMAT)
+        except ValueError:
+            pass
+    raise ValueError(f"{name} 格式无效，应为 'YYYY-MM-DD HH:MM:SS' 或 epoch 秒: {value!r}")
+
+
+def _format_time(value):
+    return value.strftime(TIME_FORMAT) if isinstance(value, datetime) else value
+
+
+def parse_task(data):
+    """
+    把请求中的任务转换为 DownloadManager.add_task 使用的 file_info
+
+    字段:
+    filename (str): 任务名（必填），即 record 下的文件夹名
+    start_time / end_time: 下载时间段
+    trigger_time: 触发时间；未给出 start_time / end_time 时按 pre_roll / post_roll 计算
+    pre_roll / post_roll (int): 触发时间前后的秒数，默认 360 / 0
+    channels (list): 通道号列表，不填时使用默认通道
+    """
+    if not isinstance(data, dict):
+        raise ValueError("任务必须是 JSON 对象")
+    filename = data.get('filename')
+    if not isinstance(filename, str) or not filename.strip() or any(c in filename for c in '\\/:*?"<>|'):
+        raise ValueError(f"filename 无效: {filename!r}")
+
+    trigger_time = _parse_time(data['trigger_time'], 'trigger_time') if 'trigger_time' in data else None
+    if 'start_time' in data and 'end_time' in data:
+        start_time = _parse_time(data['start_time'], 'start_time')
+        end_time = _parse_time(data['end_time'], 'end_time')
+    elif trigger_time is not None:
+        start_time = trigger_time - timedelta(seconds=data.get('pre_roll', DEFAULT_PRE_ROLL))
+        end_time = trigger_time + timedelta(seconds=data.get('post_roll', DEFAULT_POST_ROLL))
+    else:
+        raise ValueError("需要 start_time 与 end_time，或 trigger_time")
+    if end_time <= start_time:
+        raise ValueError("end_time 必须晚于 start_time")
+
+    channels = data.get('channels')
+    if channels is not None:
+        if (not isinstance(channels, list) or not channels or
+                not all(isinstance(ch, int) and ch > 0 for ch in channels)):
+            raise ValueError(f"channels 必须是正整数列表: {channels!r}")
+        channels = sorted(set(channels))
+
+    return {
+        'filename': filename.strip(),
+        'start_time': start_time,
+        'end_time': end_time,
+        'channels': channels,
+        'trigger_time': trigger_time or end_time,
+        'rule': 'api',
+    }
+
+
+class ControlServer:
+    """
+    本地 HTTP/JSON 控制接口
+
+    在独立线程中运行 asyncio 事件循环，上游系统可以不经过触发文件直接向 DownloadManager
+    提交任务，并查询队列、进度和已完成记录：
+
+    POST /tasks        提交单个任务（JSON 对象）或批量任务（JSON 数组或 {"tasks": [...]}）
+    GET  /queue        正在下载的任务与等待队列
+    GET  /progress     运行状态与最近的下载进度
+    GET  /completed    已完成记录（参数 prefix / time_field / start / end / order / desc / offset / limit）
+    GET  /events       Server-Sent Events 事件流（progress / completed / failed / queue / device）
+
+    DownloadManager 的信号可能在下载线程中发出，事件通过 loop.call_soon_threadsafe 交给事件循环。
+    """
+
+    def __init__(self, manager, host='127.0.0.1', port=8765, token=''):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.token = token
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._clients = set()  # 每个 SSE 客户端的 asyncio.Queue
+        self.progress = {}  # 最近一次进度：filename / channel / progress / time
+        self.start_error = None
+
+    @classmethod
+    def from_settings(cls, settings, manager):
+        """根据 settings['api'] 创建，未启用时返回 None"""
+        if not settings.get('enabled'):
+            return None
+        return cls(manager, settings.get('host', '127.0.0.1'), settings.get('port', 8765),
+                   settings.get('token', ''))
+
+    def start(self):
+        """启动服务线程并等待端口监听完成，失败时抛出异常"""
+        self._connect_signals()
+        self._thread = threading.Thread(target=self._run, name="ControlAPI", daemon=True)
+        self._thread.start()
+        self._started.wait(5)
+        if self.start_error:
+            raise self.start_error
+        print(f"控制接口已启动: http://{self.host}:{self.port}")
+
+    def stop(self):
+        """关闭服务并等待线程退出"""
+        if self.loop is None or not self._thread:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self.host, self.port))
+        except Exception as e:
+            self.start_error = e
+            self._started.set()
+            self.loop.close()
+            return
+        self._started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            # 停止监听并结束所有连接（包括 SSE 客户端与空闲的 keep-alive 连接）
+            self._server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    # ---------- 事件 ----------
+
+    def _connect_signals(self):
+        manager = self.manager
+        manager.progress_updated.connect(self._on_progress)
+        manager.download_completed.connect(
+            lambda filename, channel: self.publish('completed', {'filename': filename, 'channel': channel}))
+        manager.download_failed.connect(
+            lambda filename, channel, error: self.publish(
+                'failed', {'filename': filename, 'channel': channel, 'error': error}))
+        manager.queue_updated.connect(lambda: self.publish('queue', {'length': len(manager.queue)}))
+        manager.device_status_changed.connect(
+            lambda status, message: self.publish('device', {'status': status, 'message': message}))
+
+    def _on_progress(self, filename, channel, progress):
+        self.progress = {'filename': filename, 'channel': channel, 'progress': progress,
+                         'time': time.time()}
+        self.publish('progress', self.progress)
+
+    def publish(self, event, data):
+        """从任意线程发布事件"""
+        loop = self.loop
+        if loop is None or loop.is_closed() or not self._clients:
+            return
+        message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+        try:
+            loop.call_soon_threadsafe(self._broadcast, message)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _broadcast(self, message):
+        for queue in self._clients:
+            if not queue.full():
+                queue.put_nowait(message)
+
+    # ---------- HTTP ----------
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if path == '/events' and method == 'GET':
+                    if self._authorized(headers):
+                        await self._stream_events(writer)
+                    else:
+                        await self._send_json(writer, 401, {'error': '未授权'}, False)
+                    break
+                try:
+                    if not self._authorized(headers):
+                        raise ApiError(401, '未授权')
+                    # 添加任务会读写磁盘、等待队列锁，放到线程池中执行，不阻塞事件循环（SSE 推送等）
+                    status, payload = await asyncio.get_running_loop().run_in_executor(
+                        None, self._dispatch, method, path, query, body)
+                except ApiError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e:
+                    print(f"控制接口处理请求出错: {e}")
+                    status, payload = 500, {'error': str(e)}
+                await self._send_json(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ApiError as e:
+            await self._send_json(writer, e.status, {'error': str(e)}, False)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise ApiError(413, '请求头过大')
+        if len(head) > MAX_HEADER_BYTES:
+            raise ApiError(413, '请求头过大')
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise ApiError(400, '请求行无效')
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise ApiError(400, 'Content-Length 无效')
+        if length < 0:
+            raise ApiError(400, 'Content-Length 无效')
+        if length > MAX_BODY_BYTES:
+            raise ApiError(413, '请求体过大')
+        body = await reader.readexactly(length) if length else b''
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return method.upper(), url.path.rstrip('/') or '/', query, headers, body
+
+    def _authorized(self, headers):
+        if not self.token:
+            return True
+        return headers.get('authorization') == f"Bearer {self.token}"
+
+    async def _send_json(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _stream_events(self, writer):
+        queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self._clients.add(queue)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                         b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n")
+            writer.write(f"event: hello\ndata: {json.dumps(self._progress_state(), ensure_ascii=False)}\n\n"
+                         .encode('utf-8'))
+            await writer.drain()
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    message = b": ping\n\n"
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self._clients.discard(queue)
+
+    def _dispatch(self, method, path, query, body):
+        routes = {
+            '/tasks': {'POST': lambda: self._post_tasks(body), 'GET': self._get_queue},
+            '/queue': {'GET': self._get_queue},
+            '/progress': {'GET': self._progress_state},
+            '/completed': {'GET': lambda: self._get_completed(query)},
+        }
+        handlers = routes.get(path)
+        if handlers is None:
+            raise ApiError(404, f"未知路径: {path}")
+        handler = handlers.get(method)
+        if handler is None:
+            raise ApiError(405, f"{path} 不支持 {method}")
+        return 200, handler()
+
+    def _post_tasks(self, body):
+        if not self.manager.state_ready:
+            raise ApiError(503, '本地记录尚未加载完成，请稍后重试')
+        try:
+            data = json.loads(body or b'null')
+        except ValueError as e:
+            raise ApiError(400, f"JSON 无效: {e}")
+        if isinstance(data, dict) and 'tasks' in data:
+            data = data['tasks']
+        tasks = data if isinstance(data, list) else [data]
+        if len(tasks) > MAX_BATCH_TASKS:
+            raise ApiError(413, f"单次最多提交 {MAX_BATCH_TASKS} 个任务")
+
+        file_infos, errors = [], []
+        for index, item in enumerate(tasks):
+            try:
+                file_infos.append(parse_task(item))
+            except (ValueError, KeyError, TypeError, OverflowError, OSError) as e:
+                errors.append({'index': index, 'error': str(e)})
+        # 全部解析完成后再一次性加入队列，个别任务无效时不会只提交了一部分却没有报告
+        accepted, skipped = [], []
+        for file_info, added in zip(file_infos, self.manager.add_tasks(file_infos)):
+            (accepted if added else skipped).append(file_info['filename'])
+        return {'accepted': accepted, 'skipped': skipped, 'errors': errors}
+
+    def _get_queue(self):
+        active, queue = self.manager.queue_snapshot()
+        return {
+            'active': [_task_json(task) for task in active],
+            'queue': [_task_json(task) for task in queue],
+        }
+
+    def _progress_state(self):
+        manager = self.manager
+        return {
+            'running': manager.is_running,
+            'paused': manager.is_paused,
+            'device_status': manager.device_status,
+            'queue_length': len(manager.queue),
+            'current': self.progress or None,
+        }
+
+    def _get_completed(self, query):
+        try:
+            start = float(query['start']) if 'start' in query else None
+            end = float(query['end']) if 'end' in query else None
+            total, records = self.manager.completed_files.query(
+                prefix=query.get('prefix', ''),
+                time_field=query.get('time_field', 'completion_time'),
+                start=start, end=end,
+                order=query.get('order', 'completion_time'),
+                descending=query.get('desc', '1') not in ('0', 'false'),
+                offset=max(0, int(query.get('offset', 0))),
+                limit=min(1000, max(1, int(query.get('limit', 100)))),
+            )
+        except (ValueError, KeyError) as e:
+            raise ApiError(400, f"查询参数无效: {e}")
+        return {'total': total, 'records': records}
+
+
+def _task_json(task):
+    return {
+        'filename': task['filename'],
+        'channels': list(task['channels']),
+        'requested_channels': list(task.get('requested_channels', task['channels'])),
+        'start_time': _format_time(task['start_time']),
+        'end_time': _format_time(task['end_time']),
+        'status': task['status'],
+        'current_channel': task.get('current_channel'),
+    }
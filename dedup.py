@@ -0,0 +1,284 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from video_downloader import PARTIAL_SUFFIX
+
+# 小于该大小的文件直接分块读取，更大的文件使用 mmap
+MMAP_THRESHOLD = 16 * 1024 * 1024
+# 分块读取 / mmap 每次送入哈希的字节数
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def hash_file(path):
+    """流式计算文件的 SHA-256"""
+    sha256 = hashlib.sha256()
+    size = os.path.getsize(path)
+    with open(path, 'rb', buffering=0) as f:
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, size, HASH_CHUNK_SIZE):
+                        sha256.update(view[offset:offset + HASH_CHUNK_SIZE])
+                finally:
+                    view.release()
+        else:
+            buffer = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buffer)
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                sha256.update(view[:n])
+    return sha256.hexdigest()
+
+
+class FootageIndex:
+    """
+    已下载视频的内容索引
+
+    记录 record 下每个视频文件的大小、修改时间和 SHA-256，以及每个哈希对应的
+    规范文件。路径均相对于 record 根目录保存。
+    """
+
+    def __init__(self, index_path="data/footage_index.json"):
+        self.index_path = index_path
+        self.files = {}    # 相对路径 -> {'size', 'mtime_ns', 'sha256'}
+        self.by_hash = {}  # sha256 -> 规范文件相对路径
+        self.load()
+
+    def load(self):
+        """从磁盘加载索引"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.files = data.get('files', {})
+            self.by_hash = data.get('by_hash', {})
+            print(f"加载了 {len(self.files)} 条视频哈希记录")
+        except Exception as e:
+            print(f"加载视频哈希索引失败: {e}")
+            self.files = {}
+            self.by_hash = {}
+
+    def save(self):
+        """保存索引到磁盘"""
+        try:
+            index_dir = os.path.dirname(self.index_path)
+            if index_dir and not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'files': self.files, 'by_hash': self.by_hash}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"保存视频哈希索引失败: {e}")
+
+    def add(self, rel_path, size, mtime_ns, sha256):
+        """记录文件哈希，返回同内容的规范文件（即本文件时返回 None）"""
+        self.files[rel_path] = {'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256}
+        canonical = self.by_hash.get(sha256)
+        if canonical is None or canonical not in self.files or canonical == rel_path:
+            self.by_hash[sha256] = rel_path
+            return None
+        return canonical
+
+    def remove_prefix(self, prefix):
+        """移除某个任务文件夹下的全部记录，必要时为其哈希重新选择规范文件"""
+        removed = [path for path in self.files if path.startswith(prefix)]
+        for path in removed:
+            sha256 = self.files.pop(path)['sha256']
+            if self.by_hash.get(sha256) == path:
+                replacement = next((p for p, info in self.files.items() if info['sha256'] == sha256), None)
+                if replacement is None:
+                    del self.by_hash[sha256]
+                else:
+                    self.by_hash[sha256] = replacement
+        return len(removed)
+
+
+class Deduplicator:
+    """
+    下载视频的哈希与去重
+
+    所有哈希计算与索引修改都在单独的后台线程中串行执行，不占用下载线程。
+    内容相同的文件被替换为指向规范文件的硬链接，磁盘占用只随不重复的视频增长；
+    同一份哈希记录也用于校验 record 中已有视频的完整性。
+    """
+
+    def __init__(self, record_root="record", index_path="data/footage_index.json", link_duplicates=True):
+        self.record_root = record_root
+        self.link_duplicates = link_duplicates
+        self.index = FootageIndex(index_path)
+        self.corrupted = set()
+        self.saved_bytes = 0
+        self._stop = threading.Event()
+        self._pending = set()  # 已提交、尚未完成的 future
+        self._pending_lock = threading.Lock()
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Dedup")
+
+    @classmethod
+    def from_settings(cls, settings, record_root="record"):
+        """根据 settings['dedup'] 创建，未启用时返回 None"""
+        if not settings.get('enabled'):
+            return None
+        return cls(record_root, settings.get('index_path', "data/footage_index.json"),
+                   settings.get('link_duplicates', True))
+
+    def submit_channel(self, task_name, channel):
+        """某个通道下载完成后提交哈希计算"""
+        return self._submit(self._process_channel, task_name, channel)
+
+    def submit_verify(self, task_names, deep=False):
+        """提交对已有任务文件夹的完整性校验，deep 为 True 时重新计算全部文件的哈希"""
+        return self._submit(self._verify, list(task_names), deep)
+
+    def forget(self, task_names):
+        """任务文件夹删除后移除其哈希记录"""
+        return self._submit(self._forget, list(task_names))
+
+    def _submit(self, func, *args):
+        future = self._worker.submit(func, *args)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def shutdown(self, wait=True):
+        """
+        停止后台线程并保存索引
+
+        wait 为 False 时丢弃尚未开始的任务，正在执行的校验 / 哈希在当前文件处理完后停止。
+        两种情况下都等后台线程退出后再保存索引，避免与后台线程同时写入索引文件。
+        """
+        if not wait:
+            self._stop.set()
+            # 手动取消尚未开始的任务（cancel_futures 需要 Python 3.9）
+            with self._pending_lock:
+                pending = list(self._pending)
+            for future in pending:
+                future.cancel()
+        self._worker.shutdown(wait=True)
+        self.index.save()
+
+    def _rel(self, path):
+        return os.path.relpath(path, self.record_root).replace(os.sep, '/')
+
+    def _abs(self, rel_path):
+        return os.path.join(self.record_root, *rel_path.split('/'))
+
+    def _process_channel(self, task_name, channel):
+        folder_path = os.path.join(self.record_root, task_name)
+        prefix = f"{channel}_"
+        try:
+            names = [n for n in os.listdir(folder_path) if n.startswith(prefix) and n.endswith('.mp4')]
+        except OSError as e:
+            print(f"读取文件夹 {folder_path} 失败: {e}")
+            return
+        for name in names:
+            if self._stop.is_set():
+                return
+            self._hash_and_link(os.path.join(folder_path, name))
+        self.index.save()
+
+    def _hash_and_link(self, path):
+        """计算文件哈希并写入索引，若已有相同内容的文件则替换为硬链接"""
+        if self._stop.is_set():
+            return
+        if os.path.exists(path + PARTIAL_SUFFIX):
+            # 未下载完成（仍有未完成标记）的文件不计算哈希，也不替换为硬链接
+            return
+        try:
+            st = os.stat(path)
+            sha256 = hash_file(path)
+        except OSError as e:
+            print(f"计算文件哈希失败 {path}: {e}")
+            return
+        if self._stop.is_set():
+            # 哈希期间收到停止请求：不写入索引也不替换文件，下次启动校验时重新计算
+            return
+        rel_path = self._rel(path)
+        canonical = self.index.add(rel_path, st.st_size, st.st_mtime_ns, sha256)
+        if canonical is None or not self.link_duplicates:
+            return
+
+        canonical_path = self._abs(canonical)
+        try:
+            canonical_st = os.stat(canonical_path)
+            if os.path.samefile(canonical_path, path):
+                return
+            if canonical_st.st_size != st.st_size:
+                return
+            tmp_path = path + '.link'
+            os.link(canonical_path, tmp_path)
+            os.replace(tmp_path, path)
+            self.index.files[rel_path]['mtime_ns'] = canonical_st.st_mtime_ns
+            self.saved_bytes += st.st_size
+            print(f"发现重复视频，已替换为硬链接: {rel_path} -> {canonical}")
+        except OSError as e:
+            # 跨卷或文件系统不支持硬链接时保留原文件
+            print(f"创建硬链接失败，保留原文件 {rel_path}: {e}")
+
+    def _verify(self, task_names, deep=False):
+        """
+        校验任务文件夹中视频的完整性
+
+        大小和修改时间与索引一致的文件视为完好（deep 时仍重新计算）；否则重新计算哈希，
+        哈希变化的文件记为损坏。没有记录的视频补充计算哈希。
+        """
+        checked = 0
+        for task_name in task_names:
+            if self._stop.is_set():
+                print(f"视频完整性校验已停止，已重新计算 {checked} 个文件")
+                return sorted(self.corrupted)
+            folder_path = os.path.join(self.record_root, task_name)
+            try:
+                names = [n for n in os.listdir(folder_path) if n.endswith('.mp4')]
+            except OSError:
+                continue
+            for name in names:
+                if self._stop.is_set():
+                    break
+                path = os.path.join(folder_path, name)
+                if os.path.exists(path + PARTIAL_SUFFIX):
+                    continue
+                rel_path = self._rel(path)
+                info = self.index.files.get(rel_path)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if info is None:
+                    self._hash_and_link(path)
+                    continue
+                if not deep and info['size'] == st.st_size and info['mtime_ns'] == st.st_mtime_ns:
+                    continue
+                checked += 1
+                try:
+                    sha256 = hash_file(path)
+                except OSError as e:
+                    print(f"校验文件失败 {rel_path}: {e}")
+                    continue
+                if sha256 != info['sha256']:
+                    self.corrupted.add(rel_path)
+                    print(f"视频文件内容与记录不一致，可能已损坏: {rel_path}")
+                else:
+                    info['mtime_ns'] = st.st_mtime_ns
+        self.index.save()
+        print(f"视频完整性校验完成，重新计算了 {checked} 个文件，发现 {len(self.corrupted)} 个异常文件")
+        return sorted(self.corrupted)
+
+    def _forget(self, task_names):
+        removed = sum(self.index.remove_prefix(name + '/') for name in task_names)
+        self.corrupted = {p for p in self.corrupted if p.split('/', 1)[0] not in task_names}
+        if removed:
+            self.index.save()
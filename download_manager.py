@@ -1,11 +1,26 @@
-import json
+import contextlib
 import os
 import time
 import shutil
 import csv
+import threading
 from datetime import datetime
 from PySide6.QtCore import QObject, Signal, QThread
-from video_downloader import VideoDownloader
+from trigger_rules import DEFAULT_CHANNELS
+from record_index import RecordIndex
+from bandwidth import BandwidthGovernor
+from settings import load_settings
+from cancellation import CancelToken
+from history_store import CompletedHistory
+
+
+# 设备连接状态
+DEVICE_CONNECTING = 'connecting'
+DEVICE_CONNECTED = 'connected'
+DEVICE_FAILED = 'failed'
+
+# 每个通道下载完成后等待一小段时间再开始下一个（秒）
+CHANNEL_GAP_SECONDS = 2
 
 
 class DownloadManager(QObject):
@@ -14,23 +29,203 @@ class DownloadManager(QObject):
     download_failed = Signal(str, int, str)  # 文件名, 通道号, 错误信息
     queue_updated = Signal()
     completed_updated = Signal()
+    state_loaded = Signal()  # 本地记录加载完成
+    device_status_changed = Signal(str, str)  # 设备连接状态, 说明
 
-    def __init__(self):
+    def __init__(self, timer=None):
+        """
+        只做轻量初始化，耗时的 SDK 登录与本地记录加载由 start_background_init
+        在后台线程中执行，使主窗口可以立即显示。
+
+        参数:
+        timer (StartupTimer): 启动阶段计时，可为 None
+        """
         super().__init__()
+        self.timer = timer
+        self.settings = load_settings()
         self.queue = []
         self.current_task = None
-        self.completed_files = []
-        self.deleted_files = []  # 新增：记录已删除的文件列表
-        self.downloader = VideoDownloader()
+        # 已完成任务记录（紧凑存储，首次访问时才读取 completed_files.json）
+        self.completed_files = CompletedHistory('completed_files.json')
+        self.deleted_files = set()  # 已删除的任务名
+        self.state_ready = False
+        self.device_status = DEVICE_CONNECTING
+        # 设备录像分布索引，下载前跳过没有录像的时间段
+        self.record_index = RecordIndex("data/record_index.json")
+        # 带宽控制器（config/settings.json 中 bandwidth.enabled 为 true 时启用）
+        self.governor = BandwidthGovernor.from_settings(self.settings['bandwidth'])
+        # SDK 下载器，设备登录成功后创建
+        self.downloader = None
+        self.post_processor = None
+        self.deduplicator = None
+        # 分层存储（config/settings.json 中 tiering.enabled 为 true 时启用）
+        self.tiering = None
+        # 预录缓冲（config/settings.json 中 prerecord.enabled 为 true 时启用）
+        self.prerecord = None
+        # 多进程下载（config/settings.json 中 workers.enabled 为 true 时启用）
+        self.worker_pool = None
+        self.active_tasks = []  # 已分配给工作进程的任务
         self.is_running = False
         self.is_paused = False
         self.download_thread = None
+        # 当前任务的取消令牌，暂停 / 停止时立即中断正在进行的传输
+        self.cancel_token = CancelToken()
+        self._queue_lock = threading.Lock()
+        # 唤醒空闲中的下载线程（新任务、继续、停止）
+        self.wake_event = threading.Event()
+        # 停止下载时等待下载线程退出的最长时间（秒）
+        self.shutdown_deadline = self.settings['shutdown']['deadline_seconds']
         self.csv_file_path = "data/dropdata.csv"  # CSV文件路径
-        self._ensure_data_directory()  # 确保data目录存在
-        self.load_completed_files()
-        self.load_deleted_files_from_csv()  # 从CSV加载删除记录
-        # 扫描现有的视频文件夹
-        self.scan_existing_videos()
+        self._background_tasks = []
+
+    def _phase(self, name):
+        """启动阶段计时（未提供计时器时不计时）"""
+        if self.timer is None:
+            return contextlib.nullcontext()
+        return self.timer.phase(name)
+
+    def start_background_init(self):
+        """在后台线程中加载本地记录并连接设备"""
+        self._run_in_background(self.load_state)
+        if self.settings['workers'].get('enabled'):
+            # 多进程模式：由各工作进程自行登录设备
+            self._run_in_background(self.start_worker_pool)
+        else:
+            self._run_in_background(self.connect_device)
+        if self.settings['prerecord'].get('source') == 'simulated':
+            # 模拟码流不需要设备会话
+            self._run_in_background(self.start_prerecord)
+
+    def _run_in_background(self, func):
+        task = BackgroundTask(func)
+        self._background_tasks.append(task)
+        task.finished.connect(lambda: self._background_tasks.remove(task))
+        task.start()
+
+    def load_state(self):
+        """加载已完成 / 已删除记录并扫描 record 目录（在后台线程中执行）"""
+        try:
+            with self._phase("加载本地记录"):
+                self._ensure_data_directory()  # 确保data目录存在
+                with self._phase("读取 completed_files.json"):
+                    self.load_completed_files()
+                with self._phase("读取 dropdata.csv"):
+                    self.load_deleted_files_from_csv()  # 从CSV加载删除记录
+                with self._phase("初始化后台处理"):
+                    self._init_processors()
+                with self._phase("扫描 record 目录"):
+                    # 扫描现有的视频文件夹
+                    self.scan_existing_videos()
+        except Exception as e:
+            print(f"加载本地记录失败: {e}")
+        finally:
+            self.state_ready = True
+            self.state_loaded.emit()
+
+    def _init_processors(self):
+        """按配置创建后处理与去重组件（按需导入）"""
+        if self.settings['post_process'].get('enabled'):
+            from post_processor import PostProcessor
+            # 下载完成后的后处理；启用去重时 SHA-256 已由去重计算，元数据文件不再重复计算
+            settings = dict(self.settings['post_process'])
+            if self.settings['dedup'].get('enabled'):
+                settings['sidecar_sha256'] = False
+            self.post_processor = PostProcessor.from_settings(settings)
+            if self.is_running:
+                self.post_processor.start()
+        if self.settings['dedup'].get('enabled'):
+            from dedup import Deduplicator
+            # 下载视频的哈希校验与去重（后台线程执行）
+            self.deduplicator = Deduplicator.from_settings(self.settings['dedup'])
+        if self.settings['tiering'].get('enabled'):
+            from storage_tiering import StorageTiering
+            # 把较早的任务从 record 移到归档存储（后台线程执行）
+            self.tiering = StorageTiering.from_settings(self.settings['tiering'], self)
+            self.tiering.start()
+
+    def set_device_status(self, status, message):
+        """更新设备连接状态并通知界面"""
+        self.device_status = status
+        self.device_status_changed.emit(status, message)
+
+    def start_worker_pool(self):
+        """启动多进程下载的工作进程（在后台线程中执行）"""
+        self.set_device_status(DEVICE_CONNECTING, "正在启动工作进程")
+        try:
+            with self._phase("启动工作进程"):
+                from worker_pool import WorkerPool
+                self.worker_pool = WorkerPool.from_settings(self.settings['workers'], self)
+                self.worker_pool.start()
+        except Exception as e:
+            print(f"启动工作进程失败: {e}")
+            self.worker_pool = None
+            self.set_device_status(DEVICE_FAILED, str(e))
+
+    def connect_device(self):
+        """加载 SDK 并登录设备（在后台线程中执行），可在失败后再次调用重连"""
+        self.set_device_status(DEVICE_CONNECTING, "正在连接设备")
+        try:
+            with self._phase("连接设备"):
+                from video_downloader import VideoDownloader
+                from sdk_binding import CallTracer
+                self.downloader = VideoDownloader(
+                    record_index=self.record_index,
+                    governor=self.governor,
+                    tracer=CallTracer.from_settings(self.settings['sdk'])
+                )
+            self.set_device_status(DEVICE_CONNECTED, "设备已连接")
+        except Exception as e:
+            print(f"连接设备失败: {e}")
+            self.set_device_status(DEVICE_FAILED, str(e))
+            return
+        if self.settings['prerecord'].get('source', 'sdk') == 'sdk':
+            self.start_prerecord(self.downloader)
+
+    def start_prerecord(self, downloader=None):
+        """开始预录（使用设备码流时需要已登录的 downloader）"""
+        settings = self.settings['prerecord']
+        if not settings.get('enabled'):
+            return
+        if self.prerecord:
+            self.prerecord.stop()
+            self.prerecord = None
+        try:
+            with self._phase("启动预录缓冲"):
+                from prerecord_buffer import PrerecordBuffer
+                prerecord = PrerecordBuffer.from_settings(settings, downloader)
+                if prerecord is None:
+                    print("预录缓冲需要设备会话，多进程下载模式下不可用")
+                    return
+                prerecord.start()
+                self.prerecord = prerecord
+        except Exception as e:
+            print(f"启动预录缓冲失败: {e}")
+
+    def try_local_clip(self, task, channel):
+        """尝试从预录缓冲截取任务某个通道的视频，成功返回 True（失败时应回退到回放下载）"""
+        prerecord = self.prerecord
+        if prerecord is None or channel not in prerecord.channels:
+            return False
+        from video_downloader import clip_filename
+        folder_path = os.path.join("record", task['filename'])
+        os.makedirs(folder_path, exist_ok=True)
+        save_path = os.path.join(folder_path, clip_filename(channel, task['start_time'], task['end_time']))
+        try:
+            return prerecord.cut(channel, task['start_time'], task['end_time'], save_path)
+        except Exception as e:
+            print(f"从预录缓冲截取失败，回退到回放下载: {e}")
+            return False
+
+    def reconnect_device(self):
+        """在后台线程中重新连接设备"""
+        if self.device_status == DEVICE_CONNECTING:
+            return
+        if self.worker_pool:
+            self.worker_pool.respawn_failed()
+        elif self.settings['workers'].get('enabled'):
+            self._run_in_background(self.start_worker_pool)
+        else:
+            self._run_in_background(self.connect_device)
     
     def _ensure_data_directory(self):
         """确保data目录存在"""
@@ -45,11 +240,11 @@ class DownloadManager(QObject):
             try:
                 with open(self.csv_file_path, 'r', encoding='utf-8', newline='') as f:
                     reader = csv.DictReader(f)
-                    self.deleted_files = [row['filename'] for row in reader]
+                    self.deleted_files = {row['filename'] for row in reader}
                 print(f"从CSV加载了 {len(self.deleted_files)} 个已删除文件记录")
             except Exception as e:
                 print(f"从CSV加载已删除文件记录失败: {e}")
-                self.deleted_files = []
+                self.deleted_files = set()
         else:
             print(f"CSV文件不存在，创建新文件: {self.csv_file_path}")
             self._create_csv_header()
@@ -71,8 +266,8 @@ class DownloadManager(QObject):
             if filename in self.deleted_files:
                 return
             
-            # 添加到内存列表
-            self.deleted_files.append(filename)
+            # 添加到内存集合
+            self.deleted_files.add(filename)
             
             # 追加到CSV文件
             with open(self.csv_file_path, 'a', encoding='utf-8', newline='') as f:
@@ -87,54 +282,81 @@ class DownloadManager(QObject):
             print(f"保存删除记录到CSV失败: {e}")
 
     def load_completed_files(self):
-        """加载已下载文件记录"""
-        if os.path.exists('completed_files.json'):
-            try:
-                with open('completed_files.json', 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # 兼容旧版本数据格式
-                    if isinstance(data, list):
-                        self.completed_files = data
-                    else:
-                        self.completed_files = data.get('completed_files', [])
-                        # 不再从 JSON 加载 deleted_files，改为从 CSV 加载
-            except Exception as e:
-                print(f"加载已下载文件记录失败: {e}")
+        """加载已下载文件记录（在后台线程中提前加载，避免界面线程首次访问时读取磁盘）"""
+        self.completed_files.load()
 
     def save_completed_files(self):
         """保存已下载文件记录（只保存已完成文件，删除记录保存在CSV中）"""
         try:
-            with open('completed_files.json', 'w', encoding='utf-8') as f:
-                json.dump(self.completed_files, f, ensure_ascii=False, indent=2)
+            self.completed_files.save()
         except Exception as e:
             print(f"保存已下载文件记录失败: {e}")
 
     def add_task(self, file_info):
         """添加下载任务"""
+        return self.add_tasks([file_info])[0]
+
+    def add_tasks(self, file_infos):
+        """
+        批量添加下载任务，返回每个任务是否已加入队列
+
+        已在队列中的任务名只在锁内收集一次，批量提交时不必对每个任务重新扫描队列。
+        """
+        tasks = [self._new_task(file_info) for file_info in file_infos]
+        results = []
+        with self._queue_lock:
+            # 在锁内检查，避免监控线程与控制接口同时提交同一任务
+            queued = self._queued_names()
+            for task in tasks:
+                if task is None:
+                    results.append(False)
+                elif task['filename'] in queued:
+                    print(f"任务 {task['filename']} 已在下载队列中，跳过")
+                    results.append(False)
+                else:
+                    self.queue.append(task)
+                    queued.add(task['filename'])
+                    results.append(True)
+        if any(results):
+            self._wake()
+            for task, added in zip(tasks, results):
+                if added:
+                    print(f"任务 {task['filename']} 已添加到下载队列")
+            self.queue_updated.emit()
+        return results
+
+    def _new_task(self, file_info):
+        """根据 file_info 创建任务字典，已下载或已删除时返回 None"""
         filename = file_info['filename']
-        print(f"尝试添加任务: {filename}")
-        print(f"已删除列表: {self.deleted_files}")
+        channels = list(file_info.get('channels') or DEFAULT_CHANNELS)
+        print(f"尝试添加任务: {filename}，通道: {channels}")
         
         # 检查是否已下载
-        if self._is_downloaded(filename):
+        if self._is_downloaded(filename, channels):
             print(f"任务 {filename} 已被跳过（已下载或已删除）")
-            return False
+            return None
 
-        task = {
+        return {
             'filename': filename,
-            'channels': [33, 34, 35, 36],  # 四个通道
+            'channels': channels,
+            'requested_channels': list(channels),
             'start_time': file_info['start_time'],
             'end_time': file_info['end_time'],
+            'trigger_time': file_info.get('trigger_time'),
             'status': 'pending',
             'current_channel': None,
             'progress': 0
         }
-        self.queue.append(task)
-        print(f"任务 {filename} 已添加到下载队列")
-        self.queue_updated.emit()
-        return True
 
-    def _is_downloaded(self, filename):
+    def _queued_names(self):
+        """等待队列中和正在下载的任务名集合（调用方持有 _queue_lock）"""
+        names = {task['filename'] for task in self.queue}
+        names.update(task['filename'] for task in self.active_tasks)
+        if self.current_task is not None:
+            names.add(self.current_task['filename'])
+        return names
+
+    def _is_downloaded(self, filename, channels=None):
         """检查文件是否已下载或已删除"""
         # 检查是否在已删除列表中（首先检查）
         if filename in self.deleted_files:
@@ -142,76 +364,199 @@ class DownloadManager(QObject):
             return True
         
         # 检查是否在已完成列表中
-        for file_info in self.completed_files:
-            if file_info['filename'] == filename:
-                return True
+        if filename in self.completed_files:
+            return True
 
         # 检查文件是否实际存在
         file_save_path = os.path.join("record", filename)
         if os.path.exists(file_save_path):
-            # 检查四个通道的文件是否都存在
-            channels = [33, 34, 35, 36]
-            all_files_exist = True
-
-            for channel in channels:
-                # 这里需要根据实际的文件命名规则来检查
-                # 暂时简单检查文件夹是否存在
-                if not os.path.exists(file_save_path):
-                    all_files_exist = False
-                    break
-
-            if all_files_exist:
+            # 检查所需通道的文件是否都存在
+            channels = channels or DEFAULT_CHANNELS
+            if set(channels) <= self._channels_on_disk(file_save_path):
                 # 如果文件存在但不在记录中，添加到记录
-                self.completed_files.append({
-                    'filename': filename,
-                    'channels': [33, 34, 35, 36],
-                    'completion_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
+                self.completed_files.add(filename, channels, time.time())
                 self.save_completed_files()
                 return True
 
         return False
 
+    @staticmethod
+    def _channels_on_disk(folder_path):
+        """根据 <通道号>_*.mp4 文件名获取文件夹中已有视频的通道"""
+        channels = set()
+        try:
+            for name in os.listdir(folder_path):
+                prefix, sep, _ = name.partition('_')
+                if sep and prefix.isdigit() and name.endswith('.mp4'):
+                    channels.add(int(prefix))
+        except OSError:
+            pass
+        return channels
+
+    def _wake(self):
+        """唤醒下载线程或多进程协调线程"""
+        self.wake_event.set()
+        if self.worker_pool:
+            self.worker_pool.wake()
+
     def start(self):
-        """开始下载"""
+        """开始下载（暂停后再次调用时继续下载）"""
+        if self.is_running and self.is_paused:
+            self.is_paused = False
+            self._wake()
+            return
+        if self.download_thread and self.download_thread.isRunning():
+            print("上一次的下载线程尚未退出，请稍后再试")
+            return
         if not self.is_running:
             self.is_running = True
             self.is_paused = False
+            if self.device_status == DEVICE_FAILED:
+                self.reconnect_device()
+            if self.post_processor:
+                self.post_processor.start()
+            if self.settings['workers'].get('enabled'):
+                # 多进程模式：任务由 WorkerPool 的协调线程分发
+                self._wake()
+                return
             self.download_thread = DownloadThread(self)
             self.download_thread.start()
 
     def pause(self):
-        """暂停下载"""
+        """暂停下载，正在进行的传输立即停止，任务放回队列头部"""
         self.is_paused = True
+        self.cancel_token.cancel("pause")
+        if self.worker_pool:
+            self.worker_pool.cancel_all("pause")
+
+    def stop(self, deadline=None):
+        """
+        停止下载
+
+        立即取消正在进行的传输，并最多等待 deadline 秒让下载线程退出。
+
+        参数:
+        deadline (float): 等待下载线程退出的最长时间（秒），默认取配置 shutdown.deadline_seconds
 
-    def stop(self):
-        """停止下载"""
+        返回:
+        bool: 下载线程是否已在期限内退出
+        """
         self.is_running = False
+        self.cancel_token.cancel("stop")
+        self.wake_event.set()
+        if deadline is None:
+            deadline = self.shutdown_deadline
+        finished = True
         if self.download_thread:
-            self.download_thread.wait()
+            finished = self.download_thread.wait(int(deadline * 1000))
+            if not finished:
+                print(f"下载线程未能在 {deadline} 秒内退出")
+        if self.worker_pool:
+            self.worker_pool.cancel_all("stop")
+            if not self.worker_pool.wait_idle(deadline):
+                print(f"工作进程未能在 {deadline} 秒内停止当前任务")
+        if self.post_processor:
+            self.post_processor.stop(wait=False)
         self.save_completed_files()
+        return finished
+
+    def shutdown(self):
+        """程序退出时调用：在限定时间内停止下载并释放后台资源"""
+        finished = self.stop()
+        # 等待尚未结束的启动任务（设备登录最长受 SDK 连接超时限制）
+        for task in list(self._background_tasks):
+            task.wait(int(self.shutdown_deadline * 1000))
+        if self.worker_pool:
+            self.worker_pool.shutdown(self.shutdown_deadline)
+        if self.prerecord:
+            self.prerecord.stop()
+        if self.tiering:
+            self.tiering.stop()
+        if self.deduplicator:
+            self.deduplicator.shutdown(wait=False)
+        # 下载线程仍在 SDK 调用中时不释放 SDK，交由进程退出回收
+        if finished and self.downloader:
+            self.downloader.close()
+
+    def new_cancel_token(self):
+        """为新的下载任务创建取消令牌"""
+        self.cancel_token = CancelToken()
+        if not self.is_running or self.is_paused:
+            self.cancel_token.cancel("stop" if not self.is_running else "pause")
+        return self.cancel_token
 
     def get_next_task(self):
         """获取下一个下载任务"""
-        if self.current_task is None and self.queue:
-            self.current_task = self.queue.pop(0)
-            return self.current_task
+        with self._queue_lock:
+            if self.current_task is None and self.queue:
+                self.current_task = self.queue.pop(0)
+                return self.current_task
         return None
 
-    def mark_channel_completed(self, filename, channel):
-        """标记通道下载完成"""
-        # 更新当前任务状态
-        if self.current_task and self.current_task['filename'] == filename:
-            if channel in self.current_task['channels']:
-                self.current_task['channels'].remove(channel)
-                if not self.current_task['channels']:
+    def take_task(self):
+        """多进程模式：取出下一个任务交给工作进程"""
+        with self._queue_lock:
+            if not self.queue:
+                return None
+            task = self.queue.pop(0)
+            task['status'] = 'dispatched'
+            self.active_tasks.append(task)
+            return task
+
+    def queue_snapshot(self):
+        """返回 (正在下载的任务列表, 等待队列) 的副本，可在任意线程中调用"""
+        with self._queue_lock:
+            active = [self.current_task] if self.current_task else self.active_tasks
+            return [dict(task) for task in active], [dict(task) for task in self.queue]
+
+    def finish_task(self, task, cancelled):
+        """
+        下载线程处理完一个任务后调用
+
+        被取消（暂停 / 停止）且仍有未完成通道的任务放回队列头部，下次从剩余通道继续；
+        下载失败的通道不再重试，任务移出当前任务，避免阻塞队列。
+        """
+        with self._queue_lock:
+            if task is self.current_task:
+                self.current_task = None
+            elif task in self.active_tasks:
+                self.active_tasks.remove(task)
+            else:
+                return
+            if not task['channels']:
+                return
+            task['current_channel'] = None
+            if cancelled:
+                task['status'] = 'pending'
+                self.queue.insert(0, task)
+                print(f"任务 {task['filename']} 已中断，剩余通道 {task['channels']} 放回队列")
+            else:
+                task['status'] = 'failed'
+                print(f"任务 {task['filename']} 的通道 {task['channels']} 下载失败")
+        self.queue_updated.emit()
+
+    def mark_channel_completed(self, filename, channel, task=None):
+        """标记通道下载完成（task 为 None 时使用当前任务）"""
+        task = task or self.current_task
+        if task and task['filename'] == filename:
+            if channel in task['channels']:
+                task['channels'].remove(channel)
+                # 计算哈希并去重（后台线程执行）
+                if self.deduplicator:
+                    self.deduplicator.submit_channel(filename, channel)
+                # 提交后处理（队列满时丢弃，不阻塞下载线程）
+                if self.post_processor:
+                    self.post_processor.submit_channel(filename, channel)
+                if not task['channels']:
                     # 所有通道下载完成
-                    self.completed_files.append({
-                        'filename': filename,
-                        'channels': [33, 34, 35, 36],
-                        'completion_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    })
-                    self.current_task = None
+                    channels = task.get('requested_channels', DEFAULT_CHANNELS)
+                    trigger_time = task.get('trigger_time')
+                    self.completed_files.add(filename, channels, time.time(),
+                                             trigger_time.timestamp() if trigger_time else None)
+                    if self.post_processor:
+                        self.post_processor.submit_task(filename, channels)
+                    if task is self.current_task:
+                        self.current_task = None
                     self.completed_updated.emit()
                     self.save_completed_files()
 
@@ -226,6 +571,8 @@ class DownloadManager(QObject):
             int: 成功删除的文件夹数量
         """
         success_count = 0
+        # 已删除或本来就不存在的任务，删除出错的任务保留记录以便重试
+        removed = []
         
         for filename in filenames:
             try:
@@ -237,29 +584,53 @@ class DownloadManager(QObject):
                     shutil.rmtree(folder_path)
                     print(f"已删除文件夹: {folder_path}")
                     success_count += 1
+                elif self.tiering and self._delete_archived(filename):
+                    success_count += 1
                 else:
                     print(f"文件夹不存在: {folder_path}")
                 
-                # 从已完成记录中移除
-                self.completed_files = [
-                    file_info for file_info in self.completed_files 
-                    if file_info['filename'] != filename
-                ]
-                
                 # 保存到CSV文件中
                 self.save_deleted_file_to_csv(filename)
+                removed.append(filename)
                 
             except Exception as e:
                 print(f"删除文件夹 {filename} 时出错: {str(e)}")
                 continue
         
+        # 从已完成记录中移除
+        self.completed_files.remove_names(removed)
+
+        if self.deduplicator and removed:
+            self.deduplicator.forget(removed)
+
         # 保存更新后的记录
-        if success_count > 0:
+        if removed:
             self.save_completed_files()
             self.completed_updated.emit()
             
         return success_count
 
+    def _delete_archived(self, filename):
+        """删除已归档任务的视频，任务未归档时返回 False"""
+        with self.tiering.lock:
+            path, _ = self.tiering.resolve(filename)
+            if not self.tiering.delete(filename):
+                return False
+        print(f"已删除归档: {filename}（{path}）")
+        return True
+
+    def delete_completed_range(self, prefix='', time_field='completion_time', start=None, end=None):
+        """
+        删除符合筛选条件的全部已完成任务（任务名前缀 / 时间范围，与列表筛选一致）
+
+        返回:
+        int: 成功删除的文件夹数量
+        """
+        filenames = self.completed_files.select_names(prefix, time_field, start, end)
+        if not filenames:
+            return 0
+        return self.delete_video_files(filenames)
+
     def scan_existing_videos(self):
         """
         扫描 record 文件夹中已存在的视频文件夹，并添加到已完成列表中
@@ -282,19 +653,19 @@ class DownloadManager(QObject):
             print(f"找到 {len(existing_folders)} 个子文件夹")
             
             # 检查哪些文件夹不在已完成列表中
-            existing_filenames = {file_info['filename'] for file_info in self.completed_files}
-            print(f"已记录的文件夹数量: {len(existing_filenames)}")
+            print(f"已记录的文件夹数量: {len(self.completed_files)}")
             
             new_videos_found = 0
             for folder_name in existing_folders:
                 # 检查是否在已完成列表中或已删除列表中
-                if (folder_name not in existing_filenames and 
+                if (folder_name not in self.completed_files and 
                     folder_name not in self.deleted_files):
-                    # 直接添加到已完成列表，不检查具体视频文件
+                    # 以文件夹中实际存在的通道视频为准，没有视频时使用默认通道
                     folder_path = os.path.join(record_path, folder_name)
+                    channels = sorted(self._channels_on_disk(folder_path)) or DEFAULT_CHANNELS
                     self.completed_files.append({
                         'filename': folder_name,
-                        'channels': [33, 34, 35, 36],  # 默认四个通道
+                        'channels': channels,
                         'completion_time': self._get_folder_creation_time(folder_path)
                     })
                     new_videos_found += 1
@@ -302,6 +673,12 @@ class DownloadManager(QObject):
                 elif folder_name in self.deleted_files:
                     print(f"跳过已删除的文件夹: {folder_name}")
             
+            # 在后台校验已有视频的完整性（只重新计算大小或修改时间变化的文件）
+            if self.deduplicator:
+                self.deduplicator.submit_verify(
+                    name for name in existing_folders if name not in self.deleted_files
+                )
+
             if new_videos_found > 0:
                 print(f"扫描到 {new_videos_found} 个新的视频文件夹")
                 self.save_completed_files()
@@ -321,27 +698,45 @@ class DownloadManager(QObject):
             return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 
+class BackgroundTask(QThread):
+    """在后台线程中执行一个函数"""
+
+    def __init__(self, func):
+        super().__init__()
+        self.func = func
+
+    def run(self):
+        self.func()
+
+
 class DownloadThread(QThread):
     def __init__(self, manager):
         super().__init__()
         self.manager = manager
 
+    def _idle(self):
+        """空闲等待，有新任务或停止时立即唤醒"""
+        self.manager.wake_event.wait(1)
+        self.manager.wake_event.clear()
+
     def run(self):
         while self.manager.is_running:
-            if self.manager.is_paused:
-                self.msleep(1000)
+            # 暂停中、记录未加载完或设备未连接时等待
+            if self.manager.is_paused or not self.manager.state_ready or self.manager.downloader is None:
+                self._idle()
                 continue
 
             task = self.manager.get_next_task()
             if task is None:
-                self.msleep(1000)
+                self._idle()
                 continue
 
             filename = task['filename']
             channels = task['channels'].copy()  # 创建副本避免迭代时修改
+            cancel_token = self.manager.new_cancel_token()
 
             for channel in channels:
-                if not self.manager.is_running or self.manager.is_paused:
+                if cancel_token.cancelled:
                     break
 
                 try:
@@ -353,13 +748,14 @@ class DownloadThread(QThread):
                     # 更新界面进度
                     self.manager.progress_updated.emit(filename, channel, 0)
 
-                    # 开始下载
-                    success = self.manager.downloader.download_video(
+                    # 优先从本地预录缓冲截取，时间段不在缓冲范围内时从设备回放下载
+                    success = self.manager.try_local_clip(task, channel) or self.manager.downloader.download_video(
                         channel,
                         task['start_time'],
                         task['end_time'],
                         "record",  # base_save_path
-                        task['filename']  # filename参数
+                        task['filename'],  # filename参数
+                        cancel_token=cancel_token
                     )
 
                     if success:
@@ -367,12 +763,15 @@ class DownloadThread(QThread):
                         self.manager.download_completed.emit(filename, channel)
                         # 更新完成进度
                         self.manager.progress_updated.emit(filename, channel, 100)
-                    else:
+                    elif not cancel_token.cancelled:
                         self.manager.download_failed.emit(filename, channel, "下载失败")
 
                 except Exception as e:
                     print(f"下载出错: {str(e)}")
                     self.manager.download_failed.emit(filename, channel, str(e))
 
-                # 下载完成后等待一小段时间再开始下一个
-                self.msleep(2000) 
\ No newline at end of file
+                # 下载完成后等待一小段时间再开始下一个（取消时立即返回）
+                if cancel_token.wait(CHANNEL_GAP_SECONDS):
+                    break
+
+            self.manager.finish_task(task, cancel_token.cancelled)
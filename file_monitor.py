@@ -1,19 +1,33 @@
 import os
+import threading
 import time
-from datetime import datetime, timedelta
 from PySide6.QtCore import QThread, Signal
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from trigger_index import TriggerIndex
+from trigger_rules import TriggerRules
+
+# 新建的触发文件可能仍在写入：由监控线程每 STABLE_POLL_SECONDS 检查一次，
+# 大小不再变化（或等待超过 STABLE_TIMEOUT_SECONDS）后再处理
+STABLE_POLL_SECONDS = 0.2
+STABLE_TIMEOUT_SECONDS = 5
 
 class FileMonitor(QThread):
     new_file_detected = Signal(dict)  # 发送新文件信息
 
-    def __init__(self, folder_path="F:\\baowen"):
+    def __init__(self, folder_path="F:\\baowen", index_path="data/trigger_index.json",
+                 retention_days=30, archive_dir=None, rules_path="config/trigger_rules.json"):
         super().__init__()
         self.folder_path = folder_path
+        # 触发文件 → 下载时间段/通道 的规则
+        self.rules = TriggerRules.load(rules_path)
         self.observer = None
         self.is_running = False
-        self.processed_files = set()
+        # 已处理触发文件索引（持久化），重启后不再重复处理历史文件
+        self.processed_files = TriggerIndex(index_path, retention_days, archive_dir)
+        # 新建、等待写完的触发文件：文件名 -> [上次检查时的大小, 首次发现时间]
+        self._pending = {}
+        self._pending_lock = threading.Lock()
 
     def run(self):
         if not os.path.exists(self.folder_path):
@@ -31,7 +45,8 @@ class FileMonitor(QThread):
 
         try:
             while self.is_running:
-                time.sleep(1)
+                time.sleep(STABLE_POLL_SECONDS)
+                self._process_pending()
         except Exception as e:
             print(f"文件监控出错: {e}")
         finally:
@@ -40,35 +55,95 @@ class FileMonitor(QThread):
                 self.observer.join()
 
     def process_existing_files(self):
-        """处理文件夹中已存在的文件"""
-        for filename in os.listdir(self.folder_path):
-            if filename.endswith('.txt') and filename not in self.processed_files:
-                self.process_file(filename)
+        """处理文件夹中已存在的文件（只处理索引中没有记录的新文件）"""
+        present_names = set()
+        new_files = []
+        with os.scandir(self.folder_path) as it:
+            for entry in it:
+                if not entry.name.endswith('.txt') or not entry.is_file():
+                    continue
+                present_names.add(entry.name)
+                try:
+                    key = TriggerIndex.key_for_entry(entry)
+                except OSError:
+                    continue
+                if key not in self.processed_files:
+                    new_files.append((entry.name, key))
+
+        self.processed_files.prune(self.folder_path, present_names)
+        print(f"监控目录中共 {len(present_names)} 个触发文件，其中 {len(new_files)} 个待处理")
+
+        for filename, key in new_files:
+            self._emit_file(filename, key)
+        self.processed_files.save()
+
+    def queue_file(self, filename):
+        """
+        登记新建的触发文件（在 watchdog 线程中调用，不阻塞）
+
+        文件可能仍在写入，由监控线程在大小稳定后调用 process_file。
+        """
+        with self._pending_lock:
+            self._pending.setdefault(filename, [None, time.monotonic()])
+
+    def _process_pending(self):
+        """处理大小已稳定（或等待超时）的新建触发文件"""
+        with self._pending_lock:
+            if not self._pending:
+                return
+            pending = list(self._pending.items())
+        now = time.monotonic()
+        ready = []
+        for filename, (size, first_seen) in pending:
+            try:
+                current = os.path.getsize(os.path.join(self.folder_path, filename))
+            except OSError:
+                current = None
+            with self._pending_lock:
+                if current is None:
+                    self._pending.pop(filename, None)
+                elif current == size or now - first_seen >= STABLE_TIMEOUT_SECONDS:
+                    self._pending.pop(filename, None)
+                    ready.append(filename)
+                else:
+                    self._pending[filename][0] = current
+        for filename in ready:
+            self.process_file(filename)
 
     def process_file(self, filename):
         """处理单个文件"""
-        if filename in self.processed_files:
+        try:
+            file_path = os.path.join(self.folder_path, filename)
+            st = os.stat(file_path)
+        except OSError as e:
+            print(f"处理文件出错: {e}")
             return
 
+        key = TriggerIndex.make_key(filename, st.st_ctime)
+        if key in self.processed_files:
+            return
+
+        if self._emit_file(filename, key, st.st_ctime):
+            self.processed_files.save()
+
+    def _emit_file(self, filename, key, ctime=None):
+        """根据触发规则计算下载时间段并发送任务信息，成功返回 True"""
         try:
             file_path = os.path.join(self.folder_path, filename)
-            # 获取文件创建时间
-            creation_time = datetime.fromtimestamp(os.path.getctime(file_path))
-            # 计算过期时间（创建时间+6分钟）
-            creation_time=creation_time-timedelta(minutes=6)
-            expiration_time = creation_time + timedelta(minutes=6)
+            file_info = self.rules.resolve(file_path, ctime)
+            if file_info is None:
+                print(f"没有适用于 {filename} 的触发规则，忽略")
+                self.processed_files.add(key)
+                return True
 
             # 发送文件信息
-            file_info = {
-                'filename': os.path.splitext(filename)[0],
-                'start_time': creation_time,
-                'end_time': expiration_time
-            }
             self.new_file_detected.emit(file_info)
-            self.processed_files.add(filename)
+            self.processed_files.add(key)
+            return True
 
         except Exception as e:
             print(f"处理文件出错: {e}")
+            return False
 
     def stop(self):
         """停止监控"""
@@ -76,6 +151,7 @@ class FileMonitor(QThread):
         if self.observer:
             self.observer.stop()
             self.observer.join()
+        self.processed_files.save()
 
 class FileEventHandler(FileSystemEventHandler):
     def __init__(self, monitor):
@@ -84,4 +160,4 @@ class FileEventHandler(FileSystemEventHandler):
     def on_created(self, event):
         if not event.is_directory and event.src_path.endswith('.txt'):
             filename = os.path.basename(event.src_path)
-            self.monitor.process_file(filename) 
\ No newline at end of file
+            self.monitor.queue_file(filename) 
\ No newline at end of file
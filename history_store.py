@@ -0,0 +1,477 @@
+import json
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 时间无法解析的记录在时间列中的取值：不进入时间索引，保存时写回原始字符串
+UNKNOWN_TIME = -1
+# 任务名中的 14 位时间（触发规则默认的 %Y%m%d%H%M%S）
+NAME_TIME_PATTERN = re.compile(r'(?<!\d)(\d{14})(?!\d)')
+# 可以放入位掩码的最大通道号
+MAX_MASK_CHANNEL = 64
+
+# 可排序 / 筛选的字段
+ORDER_FILENAME = 'filename'
+ORDER_TRIGGER_TIME = 'trigger_time'
+ORDER_COMPLETION_TIME = 'completion_time'
+TIME_FIELDS = (ORDER_TRIGGER_TIME, ORDER_COMPLETION_TIME)
+
+
+def channels_to_mask(channels):
+    """通道列表转换为位掩码（通道 n 对应第 n-1 位），有超出范围的通道时返回 None"""
+    mask = 0
+    for channel in channels:
+        if not 1 <= channel <= MAX_MASK_CHANNEL:
+            return None
+        mask |= 1 << (channel - 1)
+    return mask
+
+
+def mask_to_channels(mask):
+    """位掩码转换为通道列表"""
+    channels = []
+    channel = 1
+    while mask:
+        if mask & 1:
+            channels.append(channel)
+        mask >>= 1
+        channel += 1
+    return channels
+
+
+def _parse_time(value):
+    """'%Y-%m-%d %H:%M:%S' 字符串转换为 epoch 秒，缺失或无法解析时返回 None"""
+    try:
+        return int(datetime.strptime(value, TIME_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def _name_time(filename):
+    """从任务名中的 14 位时间解析触发时间（epoch 秒），没有时返回 None"""
+    match = NAME_TIME_PATTERN.search(filename or '')
+    if match is None:
+        return None
+    try:
+        return int(datetime.strptime(match.group(1), '%Y%m%d%H%M%S').timestamp())
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def _parse_record_times(record):
+    """
+    解析记录的 (完成时间, 触发时间, 原始时间字符串)
+
+    旧记录没有触发时间，依次取任务名中的 14 位时间、完成时间代替。无法解析的时间取 UNKNOWN_TIME，
+    其原始字符串放在返回的字典中（字段名 -> 原始值），没有时为 None。
+    """
+    completed_at = _parse_time(record.get('completion_time'))
+    triggered_at = _parse_time(record.get('trigger_time'))
+    if triggered_at is None:
+        triggered_at = _name_time(record.get('filename'))
+    if triggered_at is None:
+        triggered_at = completed_at
+    raw = {}
+    if completed_at is None:
+        completed_at = UNKNOWN_TIME
+        raw[ORDER_COMPLETION_TIME] = record.get('completion_time')
+    if triggered_at is None:
+        triggered_at = UNKNOWN_TIME
+        raw[ORDER_TRIGGER_TIME] = record.get('trigger_time')
+    return completed_at, triggered_at, raw or None
+
+
+def _format_time(value):
+    return datetime.fromtimestamp(value).strftime(TIME_FORMAT)
+
+
+def _prefix_bounds(names, prefix):
+    """有序任务名列表中以 prefix 开头的区间 [lo, hi)"""
+    lo = bisect_left(names, prefix)
+    hi = bisect_left(names, prefix + '\U0010ffff')
+    return lo, hi
+
+
+class TimeIndex:
+    """
+    按时间排序的任务名索引
+
+    keys 为 epoch 秒（array('q')），names 为对应的任务名，两者按 (时间, 插入顺序) 排列。
+    """
+
+    __slots__ = ('keys', 'names')
+
+    def __init__(self, keys, names):
+        self.keys = keys
+        self.names = names
+
+    @classmethod
+    def build(cls, names, column):
+        """按时间列建立索引，时间未知（UNKNOWN_TIME）的行不进入索引"""
+        order = sorted((row for row in range(len(names)) if column[row] != UNKNOWN_TIME),
+                       key=column.__getitem__)
+        return cls(array('q', (column[row] for row in order)), [names[row] for row in order])
+
+    def insert(self, key, name):
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.names.insert(i, name)
+
+    def bounds(self, start=None, end=None):
+        """时间在 [start, end) 内的区间 [lo, hi)"""
+        lo = 0 if start is None else bisect_left(self.keys, start)
+        hi = len(self.keys) if end is None else bisect_left(self.keys, end)
+        return lo, max(lo, hi)
+
+
+def _page(names, lo, hi, offset, limit, descending):
+    """从有序区间 [lo, hi) 中取一页任务名"""
+    if descending:
+        stop = max(lo, hi - offset)
+        start = max(lo, stop - limit) if limit is not None else lo
+        return names[start:stop][::-1]
+    start = min(hi, lo + offset)
+    stop = min(hi, start + limit) if limit is not None else hi
+    return names[start:stop]
+
+
+class CompletedHistory:
+    """
+    已完成任务记录的紧凑存储
+
+    按列保存：任务名列表、触发时间与完成时间（epoch 秒，array('q')）、通道位掩码（array('Q')），
+    并维护 任务名 -> 行号 的索引用于去重判断。与旧版 list[dict] 保持相同的用法：
+    迭代时按需生成 {'filename', 'channels', 'completion_time', 'trigger_time'} 字典，
+    append 接受同样的字典。磁盘格式仍为 completed_files.json，首次访问时才加载。
+
+    已移到归档存储的任务在字典中多一个 'archive' 字段（相对于归档根目录的位置），
+    仍在 record 下的任务没有该字段。
+
+    时间无法解析的记录仍然保留（保存时写回原始字符串），只是不进入时间索引：
+    不参与时间范围筛选和归档，按时间排序的完整列表中排在最前。
+
+    查询用的有序索引（任务名、触发时间、完成时间）在第一次查询时建立，之后随添加增量维护，
+    删除记录后重新建立。
+    """
+
+    __slots__ = ('path', '_names', '_completed', '_triggered', '_masks', '_extra_channels', '_rows',
+                 '_archived', '_raw_times', '_loaded', '_lock', '_channel_cache', '_by_name', '_by_time',
+                 '_unknown_time')
+
+    def __init__(self, path=None):
+        """
+        参数:
+        path (str): completed_files.json 路径；为 None 时不从磁盘加载
+        """
+        self.path = path
+        self._names = []
+        self._completed = array('q')
+        self._triggered = array('q')
+        self._masks = array('Q')
+        self._extra_channels = {}  # 行号 -> 通道元组（通道号超出位掩码范围时使用）
+        self._rows = {}  # 任务名 -> 行号
+        self._archived = {}  # 任务名 -> 归档位置（只记录已归档的任务）
+        self._raw_times = {}  # 任务名 -> {字段名: 原始字符串}（只记录时间无法解析的任务）
+        self._loaded = path is None
+        self._lock = threading.RLock()
+        self._channel_cache = {}  # 位掩码 -> 通道元组
+        self._by_name = None  # 有序任务名列表
+        self._by_time = None  # 字段名 -> TimeIndex
+        self._unknown_time = None  # 字段名 -> 该时间未知的有序任务名列表
+
+    def load(self):
+        """从磁盘加载记录（只加载一次，之后的调用直接返回）"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.exists(self.path):
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                # 兼容旧版本数据格式
+                if isinstance(data, dict):
+                    data = data.get('completed_files', [])
+                for record in data:
+                    self._append(record['filename'], record.get('channels', []), *_parse_record_times(record))
+                    if record.get('archive'):
+                        self._archived[record['filename']] = record['archive']
+                if self._raw_times:
+                    print(f"已下载文件记录中有 {len(self._raw_times)} 条时间无法解析，"
+                          f"保留原值，不参与按时间筛选和归档")
+            except Exception as e:
+                print(f"加载已下载文件记录失败: {e}")
+
+    def _append(self, filename, channels, completed_at, triggered_at, raw_times=None):
+        row = self._rows.get(filename)
+        mask = channels_to_mask(channels)
+        if row is None:
+            row = len(self._names)
+            self._names.append(filename)
+            self._completed.append(completed_at)
+            self._triggered.append(triggered_at)
+            self._masks.append(mask or 0)
+            self._rows[filename] = row
+            if self._by_name is not None:
+                insort(self._by_name, filename)
+                for field, value in ((ORDER_TRIGGER_TIME, triggered_at), (ORDER_COMPLETION_TIME, completed_at)):
+                    if value == UNKNOWN_TIME:
+                        insort(self._unknown_time[field], filename)
+                    else:
+                        self._by_time[field].insert(value, filename)
+        else:
+            # 同名记录以最后一次为准（重新下载的任务回到 record 下）
+            self._archived.pop(filename, None)
+            self._raw_times.pop(filename, None)
+            self._completed[row] = completed_at
+            self._triggered[row] = triggered_at
+            self._masks[row] = mask or 0
+            self._extra_channels.pop(row, None)
+            self._drop_indexes()
+        if mask is None:
+            self._extra_channels[row] = tuple(channels)
+        if raw_times:
+            self._raw_times[filename] = raw_times
+
+    def append(self, record):
+        """添加记录，record 为 {'filename', 'channels', 'completion_time'[, 'trigger_time']} 字典"""
+        self.load()
+        times = _parse_record_times(record)
+        with self._lock:
+            self._append(record['filename'], record.get('channels', []), *times)
+
+    def add(self, filename, channels, completed_at, triggered_at=None):
+        """添加记录（时间为 epoch 秒，未知触发时间时依次以任务名中的时间、完成时间代替）"""
+        self.load()
+        completed_at = int(completed_at)
+        if triggered_at is None:
+            triggered_at = _name_time(filename)
+        triggered_at = completed_at if triggered_at is None else int(triggered_at)
+        with self._lock:
+            self._append(filename, channels, completed_at, triggered_at)
+
+    def remove_names(self, names):
+        """删除指定任务名的记录，返回删除数量"""
+        self.load()
+        names = set(names)
+        with self._lock:
+            rows = {self._rows[name] for name in names if name in self._rows}
+            if not rows:
+                return 0
+            keep = [row for row in range(len(self._names)) if row not in rows]
+            extra = {}
+            for new_row, old_row in enumerate(keep):
+                if old_row in self._extra_channels:
+                    extra[new_row] = self._extra_channels[old_row]
+            self._names = [self._names[row] for row in keep]
+            self._completed = array('q', (self._completed[row] for row in keep))
+            self._triggered = array('q', (self._triggered[row] for row in keep))
+            self._masks = array('Q', (self._masks[row] for row in keep))
+            self._extra_channels = extra
+            for name in names:
+                self._archived.pop(name, None)
+                self._raw_times.pop(name, None)
+            self._rows = {name: row for row, name in enumerate(self._names)}
+            self._drop_indexes()
+            return len(rows)
+
+    def channels(self, row):
+        """返回某一行的通道元组"""
+        extra = self._extra_channels.get(row)
+        if extra is not None:
+            return extra
+        mask = self._masks[row]
+        channels = self._channel_cache.get(mask)
+        if channels is None:
+            channels = self._channel_cache[mask] = tuple(mask_to_channels(mask))
+        return channels
+
+    def record(self, row):
+        """按行号生成记录字典"""
+        name = self._names[row]
+        raw = self._raw_times.get(name, {})
+        record = {'filename': name, 'channels': list(self.channels(row))}
+        for field, column in ((ORDER_COMPLETION_TIME, self._completed), (ORDER_TRIGGER_TIME, self._triggered)):
+            value = column[row]
+            record[field] = raw.get(field) if value == UNKNOWN_TIME else _format_time(value)
+        archive = self._archived.get(self._names[row])
+        if archive is not None:
+            record['archive'] = archive
+        return record
+
+    def get(self, filename):
+        """按任务名获取记录字典，不存在时返回 None"""
+        self.load()
+        with self._lock:
+            row = self._rows.get(filename)
+            return None if row is None else self.record(row)
+
+    def archive_location(self, filename):
+        """任务的归档位置，仍在 record 下（或没有记录）时返回 None"""
+        self.load()
+        return self._archived.get(filename)
+
+    def set_archive(self, filename, location):
+        """记录任务已移到归档位置（location 为 None 时表示回到 record 下），任务不存在时返回 False"""
+        self.load()
+        with self._lock:
+            if filename not in self._rows:
+                return False
+            if location is None:
+                self._archived.pop(filename, None)
+            else:
+                self._archived[filename] = location
+            return True
+
+    def select_archivable(self, before, limit=None):
+        """返回完成时间早于 before（epoch 秒）且仍在 record 下的任务 [(任务名, 完成时间)]，按完成时间排序"""
+        self.load()
+        with self._lock:
+            self._ensure_indexes()
+            index = self._by_time[ORDER_COMPLETION_TIME]
+            lo, hi = index.bounds(None, before)
+            selected = []
+            for i in range(lo, hi):
+                name = index.names[i]
+                if name not in self._archived:
+                    selected.append((name, index.keys[i]))
+                    if limit is not None and len(selected) >= limit:
+                        break
+            return selected
+
+    def _drop_indexes(self):
+        self._by_name = None
+        self._by_time = None
+        self._unknown_time = None
+
+    def _ensure_indexes(self):
+        if self._by_name is not None:
+            return
+        self._by_name = sorted(self._names)
+        self._by_time = {
+            ORDER_TRIGGER_TIME: TimeIndex.build(self._names, self._triggered),
+            ORDER_COMPLETION_TIME: TimeIndex.build(self._names, self._completed),
+        }
+        self._unknown_time = {
+            ORDER_TRIGGER_TIME: sorted(n for n, v in zip(self._names, self._triggered) if v == UNKNOWN_TIME),
+            ORDER_COMPLETION_TIME: sorted(n for n, v in zip(self._names, self._completed) if v == UNKNOWN_TIME),
+        }
+
+    def _time_of(self, field, name):
+        column = self._triggered if field == ORDER_TRIGGER_TIME else self._completed
+        return column[self._rows[name]]
+
+    def _match_names(self, prefix, time_field, start, end, order):
+        """
+        返回 (有序任务名列表, lo, hi)，结果为列表中的区间 [lo, hi)
+
+        只有一个筛选条件（或没有）且排序字段与该条件所用索引一致时，结果就是索引中的连续区间。
+        """
+        self._ensure_indexes()
+        has_range = start is not None or end is not None
+        name_bounds = _prefix_bounds(self._by_name, prefix) if prefix else None
+        time_index = self._by_time[time_field]
+        time_bounds = time_index.bounds(start, end) if has_range else None
+
+        if name_bounds is None and time_bounds is None:
+            if order == ORDER_FILENAME:
+                return self._by_name, 0, len(self._by_name)
+            index = self._by_time[order]
+            unknown = self._unknown_time[order]
+            if unknown:
+                # 时间未知的记录排在最前（与按时间排序时的位置一致）
+                names = unknown + index.names
+                return names, 0, len(names)
+            return index.names, 0, len(index.names)
+        if time_bounds is None and order == ORDER_FILENAME:
+            return self._by_name, name_bounds[0], name_bounds[1]
+        if name_bounds is None and order == time_field:
+            return time_index.names, time_bounds[0], time_bounds[1]
+
+        # 多个条件或排序字段不同：取候选较少的区间逐个过滤，再按排序字段排序
+        if time_bounds is None or (name_bounds is not None and
+                                   name_bounds[1] - name_bounds[0] <= time_bounds[1] - time_bounds[0]):
+            candidates = self._by_name[name_bounds[0]:name_bounds[1]]
+        else:
+            candidates = time_index.names[time_bounds[0]:time_bounds[1]]
+        matched = []
+        for name in candidates:
+            if prefix and not name.startswith(prefix):
+                continue
+            if has_range:
+                value = self._time_of(time_field, name)
+                if value == UNKNOWN_TIME:
+                    continue
+                if (start is not None and value < start) or (end is not None and value >= end):
+                    continue
+            matched.append(name)
+        if order == ORDER_FILENAME:
+            matched.sort()
+        else:
+            matched.sort(key=lambda name: self._time_of(order, name))
+        return matched, 0, len(matched)
+
+    def query(self, prefix='', time_field=ORDER_COMPLETION_TIME, start=None, end=None,
+              order=ORDER_COMPLETION_TIME, descending=True, offset=0, limit=100):
+        """
+        分页查询已完成记录
+
+        参数:
+        prefix (str): 任务名前缀，为空时不筛选
+        time_field (str): 时间筛选字段，'trigger_time' 或 'completion_time'
+        start / end (float): 时间范围 [start, end)（epoch 秒），None 表示不限
+        order (str): 排序字段，'filename' / 'trigger_time' / 'completion_time'
+        descending (bool): 是否倒序
+        offset / limit (int): 分页
+
+        返回:
+        tuple: (符合条件的总数, 本页记录字典列表)
+        """
+        self.load()
+        with self._lock:
+            names, lo, hi = self._match_names(prefix, time_field, start, end, order)
+            page = _page(names, lo, hi, offset, limit, descending)
+            return hi - lo, [self.record(self._rows[name]) for name in page]
+
+    def select_names(self, prefix='', time_field=ORDER_COMPLETION_TIME, start=None, end=None):
+        """返回符合条件的全部任务名（用于按范围批量删除）"""
+        self.load()
+        with self._lock:
+            order = ORDER_FILENAME if prefix else time_field
+            names, lo, hi = self._match_names(prefix, time_field, start, end, order)
+            return names[lo:hi]
+
+    def to_list(self):
+        """转换为 completed_files.json 的列表格式"""
+        self.load()
+        with self._lock:
+            return [self.record(row) for row in range(len(self._names))]
+
+    def save(self, path=None):
+        """写入 completed_files.json（先写临时文件再替换；下载线程与归档线程共用同一个临时文件，整个过程持有锁）"""
+        path = path or self.path
+        with self._lock:
+            data = self.to_list()
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+
+    def __contains__(self, filename):
+        self.load()
+        return filename in self._rows
+
+    def __len__(self):
+        self.load()
+        return len(self._names)
+
+    def __iter__(self):
+        # 先在锁内生成快照，避免迭代过程中被后台线程删除记录
+        return iter(self.to_list())
@@ -1,14 +1,15 @@
 import sys
 import os
 import logging
+import multiprocessing
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QGroupBox, QPushButton, QLabel, 
                              QProgressBar, QTableWidget, QTableWidgetItem,
-                             QMessageBox, QCheckBox, QHeaderView)
-from PySide6.QtCore import Qt, QThread, Signal
-from download_manager import DownloadManager
-from file_monitor import FileMonitor
-from video_downloader import VideoDownloader
+                             QMessageBox, QCheckBox, QHeaderView, QLineEdit,
+                             QComboBox, QDateEdit)
+from PySide6.QtCore import Qt, QThread, Signal, QTimer, QDate, QDateTime, QTime
+from startup_timer import StartupTimer
+from download_manager import DownloadManager, DEVICE_CONNECTING, DEVICE_CONNECTED
 
 # 配置日志
 def setup_logging():
@@ -49,10 +50,25 @@ def check_hcnetsdk():
     logger.info("HCNetSDK检查通过")
     return True, "HCNetSDK检查通过"
 
+# 设备连接状态显示
+DEVICE_STATUS_STYLES = {
+    DEVICE_CONNECTING: ("设备: 连接中…", "color: #e6a23c;"),
+    DEVICE_CONNECTED: ("设备: 已连接", "color: #67c23a;"),
+}
+DEVICE_FAILED_STYLE = ("设备: 连接失败", "color: #f56c6c;")
+
+# 已下载列表每页显示的记录数
+COMPLETED_PAGE_SIZE = 100
+# 已下载列表的筛选 / 排序字段（显示名, 字段名）
+COMPLETED_TIME_FIELDS = [("完成时间", "completion_time"), ("触发时间", "trigger_time")]
+COMPLETED_ORDERS = COMPLETED_TIME_FIELDS + [("任务名", "filename")]
+
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, timer=None):
         super().__init__()
         logger.info("初始化主窗口")
+        self.timer = timer or StartupTimer()
+        self.completed_page = 0
         
         self.setWindowTitle("视频下载管理器")
         self.setMinimumSize(800, 600)
@@ -65,33 +81,72 @@ class MainWindow(QMainWindow):
             
         try:
             logger.info("初始化下载管理器")
-            # 初始化下载管理器
-            self.download_manager = DownloadManager()
+            # 初始化下载管理器（SDK 登录和本地记录加载在后台线程中进行）
+            with self.timer.phase("创建下载管理器"):
+                self.download_manager = DownloadManager(timer=self.timer)
             
-            logger.info("初始化文件监控器")
-            # 初始化文件监控器
-            self.file_monitor = FileMonitor()
-            self.file_monitor.new_file_detected.connect(self.on_new_file)
+            # 文件监控器在本地记录加载完成后创建，避免在记录就绪前重复添加任务
+            self.file_monitor = None
+            # 本地控制接口（config/settings.json 中 api.enabled 为 true 时启用）
+            self.control_server = None
             
             # 初始化界面
             logger.info("初始化界面")
-            self.init_ui()
+            with self.timer.phase("构建界面"):
+                self.init_ui()
             
             # 连接信号和槽
             self.connect_signals()
             
-            # 启动文件监控
-            logger.info("启动文件监控")
-            self.file_monitor.start()
-            
-            # 初始化已完成列表显示
-            self.update_completed_table()
+            # 窗口显示后再开始后台初始化
+            QTimer.singleShot(0, self.download_manager.start_background_init)
             
         except Exception as e:
             logger.exception(f"初始化失败: {str(e)}")
             QMessageBox.critical(self, "初始化错误", f"程序初始化失败:\n{str(e)}")
             raise
 
+    def on_state_loaded(self):
+        """本地记录加载完成：显示已完成列表并启动文件监控"""
+        with self.timer.phase("填充已下载列表"):
+            self.update_completed_table()
+        
+        try:
+            logger.info("初始化文件监控器")
+            with self.timer.phase("启动文件监控"):
+                from file_monitor import FileMonitor
+                self.file_monitor = FileMonitor()
+                self.file_monitor.new_file_detected.connect(self.on_new_file)
+                self.file_monitor.start()
+        except Exception as e:
+            logger.exception(f"启动文件监控失败: {str(e)}")
+            QMessageBox.warning(self, "文件监控", f"启动文件监控失败:\n{str(e)}")
+        
+        try:
+            from control_api import ControlServer
+            self.control_server = ControlServer.from_settings(
+                self.download_manager.settings['api'], self.download_manager)
+            if self.control_server:
+                self.control_server.start()
+        except Exception as e:
+            logger.exception(f"启动控制接口失败: {str(e)}")
+            self.control_server = None
+        
+        self.timer.mark("本地记录就绪")
+        logger.info(f"启动阶段耗时: {self.timer.summary()}")
+
+    def on_device_status_changed(self, status, message):
+        """更新设备连接状态指示"""
+        text, style = DEVICE_STATUS_STYLES.get(status, DEVICE_FAILED_STYLE)
+        self.device_status_label.setText(text)
+        self.device_status_label.setStyleSheet(style)
+        self.device_status_label.setToolTip(message)
+        self.reconnect_button.setVisible(status not in DEVICE_STATUS_STYLES)
+        if status == DEVICE_CONNECTED:
+            self.timer.mark("设备已连接")
+        elif status not in DEVICE_STATUS_STYLES:
+            logger.error(f"连接设备失败: {message}")
+
     def init_ui(self):
         # 创建主窗口部件
         central_widget = QWidget()
@@ -121,9 +176,49 @@ class MainWindow(QMainWindow):
         # 已下载列表组
         completed_group = QGroupBox("已下载列表")
         completed_layout = QVBoxLayout()
+        
+        # 搜索与筛选
+        filter_layout = QHBoxLayout()
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("按任务名前缀搜索")
+        self.time_field_combo = QComboBox()
+        for label, field in COMPLETED_TIME_FIELDS:
+            self.time_field_combo.addItem(label, field)
+        self.date_filter_checkbox = QCheckBox("日期")
+        today = QDate.currentDate()
+        self.date_from_edit = QDateEdit(today.addDays(-7))
+        self.date_to_edit = QDateEdit(today)
+        for date_edit in (self.date_from_edit, self.date_to_edit):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("yyyy-MM-dd")
+            date_edit.setEnabled(False)
+        self.order_combo = QComboBox()
+        for label, field in COMPLETED_ORDERS:
+            self.order_combo.addItem(f"按{label}排序", field)
+        self.descending_checkbox = QCheckBox("倒序")
+        self.descending_checkbox.setChecked(True)
+        filter_layout.addWidget(self.search_edit, 1)
+        filter_layout.addWidget(self.date_filter_checkbox)
+        filter_layout.addWidget(self.time_field_combo)
+        filter_layout.addWidget(self.date_from_edit)
+        filter_layout.addWidget(QLabel("至"))
+        filter_layout.addWidget(self.date_to_edit)
+        filter_layout.addWidget(self.order_combo)
+        filter_layout.addWidget(self.descending_checkbox)
+        
         self.completed_table = QTableWidget()
-        self.completed_table.setColumnCount(4)
-        self.completed_table.setHorizontalHeaderLabels(["选择", "文件名", "完成时间", "通道数"])
+        self.completed_table.setColumnCount(6)
+        self.completed_table.setHorizontalHeaderLabels(["选择", "文件名", "触发时间", "完成时间", "通道数", "存储位置"])
+        
+        # 分页
+        page_layout = QHBoxLayout()
+        self.prev_page_button = QPushButton("上一页")
+        self.next_page_button = QPushButton("下一页")
+        self.page_label = QLabel()
+        page_layout.addWidget(self.prev_page_button)
+        page_layout.addWidget(self.page_label)
+        page_layout.addWidget(self.next_page_button)
+        page_layout.addStretch()
         
         # 批量删除操作按钮
         delete_layout = QHBoxLayout()
@@ -131,13 +226,18 @@ class MainWindow(QMainWindow):
         self.select_none_button = QPushButton("取消全选")
         self.delete_selected_button = QPushButton("删除选中")
         self.delete_selected_button.setStyleSheet("QPushButton { background-color: #ff6b6b; color: white; }")
+        self.delete_filtered_button = QPushButton("删除全部筛选结果")
+        self.delete_filtered_button.setStyleSheet("QPushButton { background-color: #ff6b6b; color: white; }")
         
         delete_layout.addWidget(self.select_all_button)
         delete_layout.addWidget(self.select_none_button)
         delete_layout.addWidget(self.delete_selected_button)
+        delete_layout.addWidget(self.delete_filtered_button)
         delete_layout.addStretch()
         
+        completed_layout.addLayout(filter_layout)
         completed_layout.addWidget(self.completed_table)
+        completed_layout.addLayout(page_layout)
         completed_layout.addLayout(delete_layout)
         completed_group.setLayout(completed_layout)
         
@@ -155,6 +255,14 @@ class MainWindow(QMainWindow):
         main_layout.addWidget(queue_group)
         main_layout.addWidget(completed_group)
         main_layout.addLayout(control_layout)
+        
+        # 状态栏：设备连接状态
+        self.device_status_label = QLabel()
+        self.reconnect_button = QPushButton("重新连接")
+        self.reconnect_button.setVisible(False)
+        self.statusBar().addPermanentWidget(self.device_status_label)
+        self.statusBar().addPermanentWidget(self.reconnect_button)
+        self.on_device_status_changed(DEVICE_CONNECTING, "正在连接设备")
 
     def connect_signals(self):
         # 连接按钮信号
@@ -166,6 +274,18 @@ class MainWindow(QMainWindow):
         self.select_all_button.clicked.connect(self.select_all_completed)
         self.select_none_button.clicked.connect(self.select_none_completed)
         self.delete_selected_button.clicked.connect(self.delete_selected_videos)
+        self.delete_filtered_button.clicked.connect(self.delete_filtered_videos)
+        
+        # 搜索、筛选与分页（条件变化时回到第一页）
+        self.search_edit.textChanged.connect(self.on_completed_filter_changed)
+        self.time_field_combo.currentIndexChanged.connect(self.on_completed_filter_changed)
+        self.order_combo.currentIndexChanged.connect(self.on_completed_filter_changed)
+        self.descending_checkbox.toggled.connect(self.on_completed_filter_changed)
+        self.date_filter_checkbox.toggled.connect(self.on_date_filter_toggled)
+        self.date_from_edit.dateChanged.connect(self.on_completed_filter_changed)
+        self.date_to_edit.dateChanged.connect(self.on_completed_filter_changed)
+        self.prev_page_button.clicked.connect(lambda: self.change_completed_page(-1))
+        self.next_page_button.clicked.connect(lambda: self.change_completed_page(1))
         
         # 连接下载管理器信号
         self.download_manager.progress_updated.connect(self.update_progress)
@@ -173,6 +293,9 @@ class MainWindow(QMainWindow):
         self.download_manager.download_failed.connect(self.on_download_failed)
         self.download_manager.queue_updated.connect(self.update_queue_table)
         self.download_manager.completed_updated.connect(self.update_completed_table)
+        self.download_manager.state_loaded.connect(self.on_state_loaded)
+        self.download_manager.device_status_changed.connect(self.on_device_status_changed)
+        self.reconnect_button.clicked.connect(self.download_manager.reconnect_device)
 
     def on_new_file(self, file_info):
         self.download_manager.add_task(file_info)
@@ -264,6 +387,59 @@ class MainWindow(QMainWindow):
                 logger.exception(f"批量删除失败: {str(e)}")
                 QMessageBox.critical(self, "错误", f"删除过程中发生错误：\n{str(e)}")
 
+    def completed_filter(self):
+        """当前的筛选条件：(任务名前缀, 时间字段, 开始时间, 结束时间)，时间为 epoch 秒"""
+        prefix = self.search_edit.text().strip()
+        time_field = self.time_field_combo.currentData()
+        start = end = None
+        if self.date_filter_checkbox.isChecked():
+            start = QDateTime(self.date_from_edit.date(), QTime(0, 0)).toSecsSinceEpoch()
+            # 结束日期当天也包含在内
+            end = QDateTime(self.date_to_edit.date().addDays(1), QTime(0, 0)).toSecsSinceEpoch()
+        return prefix, time_field, start, end
+
+    def on_date_filter_toggled(self, checked):
+        self.date_from_edit.setEnabled(checked)
+        self.date_to_edit.setEnabled(checked)
+        self.on_completed_filter_changed()
+
+    def on_completed_filter_changed(self, *args):
+        self.completed_page = 0
+        self.update_completed_table()
+
+    def change_completed_page(self, step):
+        self.completed_page = max(0, self.completed_page + step)
+        self.update_completed_table()
+
+    def delete_filtered_videos(self):
+        """删除符合当前筛选条件的全部视频文件夹（包括其他页）"""
+        prefix, time_field, start, end = self.completed_filter()
+        if not prefix and start is None:
+            QMessageBox.information(self, "提示", "请先输入搜索条件或选择日期范围！")
+            return
+        total = len(self.download_manager.completed_files.select_names(prefix, time_field, start, end))
+        if not total:
+            QMessageBox.information(self, "提示", "没有符合条件的视频文件！")
+            return
+        
+        reply = QMessageBox.question(
+            self, 
+            "确认删除", 
+            f"您确定要删除符合筛选条件的 {total} 个视频文件吗？\n\n"
+            f"注意：这将删除文件夹及其所有内容，操作不可恢复！",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+        try:
+            success_count = self.download_manager.delete_completed_range(prefix, time_field, start, end)
+            QMessageBox.information(self, "删除完成", f"成功删除了 {success_count} 个视频文件夹！")
+            self.on_completed_filter_changed()
+        except Exception as e:
+            logger.exception(f"按筛选条件删除失败: {str(e)}")
+            QMessageBox.critical(self, "错误", f"删除过程中发生错误：\n{str(e)}")
+
     def update_queue_table(self):
         self.queue_table.setRowCount(0)
         for task in self.download_manager.queue:
@@ -274,8 +450,24 @@ class MainWindow(QMainWindow):
             self.queue_table.setItem(row, 2, QTableWidgetItem(task['status']))
 
     def update_completed_table(self):
+        """按当前筛选条件显示一页已完成记录"""
+        if not self.download_manager.state_ready:
+            # 本地记录尚未加载完，加载完成后 on_state_loaded 会再次刷新
+            return
+        prefix, time_field, start, end = self.completed_filter()
+        query = dict(prefix=prefix, time_field=time_field, start=start, end=end,
+                     order=self.order_combo.currentData(),
+                     descending=self.descending_checkbox.isChecked(), limit=COMPLETED_PAGE_SIZE)
+        history = self.download_manager.completed_files
+        total, records = history.query(offset=self.completed_page * COMPLETED_PAGE_SIZE, **query)
+        page_count = max(1, (total + COMPLETED_PAGE_SIZE - 1) // COMPLETED_PAGE_SIZE)
+        if self.completed_page >= page_count:
+            # 删除记录后当前页可能已超出范围
+            self.completed_page = page_count - 1
+            total, records = history.query(offset=self.completed_page * COMPLETED_PAGE_SIZE, **query)
+        
         self.completed_table.setRowCount(0)
-        for file_info in self.download_manager.completed_files:
+        for file_info in records:
             row = self.completed_table.rowCount()
             self.completed_table.insertRow(row)
             
@@ -285,8 +477,19 @@ class MainWindow(QMainWindow):
             
             # 添加文件信息
             self.completed_table.setItem(row, 1, QTableWidgetItem(file_info['filename']))
-            self.completed_table.setItem(row, 2, QTableWidgetItem(file_info['completion_time']))
-            self.completed_table.setItem(row, 3, QTableWidgetItem(str(len(file_info['channels']))))
+            # 时间无法解析的旧记录保留原值（可能为空）
+            self.completed_table.setItem(row, 2, QTableWidgetItem(str(file_info['trigger_time'] or '')))
+            self.completed_table.setItem(row, 3, QTableWidgetItem(str(file_info['completion_time'] or '')))
+            self.completed_table.setItem(row, 4, QTableWidgetItem(str(len(file_info['channels']))))
+            archive = file_info.get('archive')
+            location_item = QTableWidgetItem("归档" if archive else "本地")
+            if archive:
+                location_item.setToolTip(archive)
+            self.completed_table.setItem(row, 5, location_item)
+        
+        self.page_label.setText(f"第 {self.completed_page + 1} / {page_count} 页，共 {total} 条")
+        self.prev_page_button.setEnabled(self.completed_page > 0)
+        self.next_page_button.setEnabled(self.completed_page + 1 < page_count)
         
         # 调整列宽
         header = self.completed_table.horizontalHeader()
@@ -294,13 +497,19 @@ class MainWindow(QMainWindow):
         header.setSectionResizeMode(1, QHeaderView.Stretch)
         header.setSectionResizeMode(2, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(3, QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(4, QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(5, QHeaderView.ResizeToContents)
 
     def closeEvent(self, event):
-        self.download_manager.stop()
-        self.file_monitor.stop()
+        if self.control_server:
+            self.control_server.stop()
+        self.download_manager.shutdown()
+        if self.file_monitor:
+            self.file_monitor.stop()
         event.accept()
 
 def main():
+    timer = StartupTimer()
     logger.info("程序启动")
     
     # 创建 logs 目录（相对路径）
@@ -309,8 +518,8 @@ def main():
         os.makedirs(log_dir)
         logger.info(f"创建目录: {log_dir}")
 
-    # 创建 record 目录（绝对路径）
-    record_dir = r"E:\\积水识别项目\\视频下载模块\\record"
+    # 创建 record 目录（下载保存目录，较早的任务可由分层存储移到归档路径）
+    record_dir = "record"
     if not os.path.exists(record_dir):
         os.makedirs(record_dir)
         logger.info(f"创建目录: {record_dir}")
@@ -319,8 +528,9 @@ def main():
     
     try:
         logger.info("创建主窗口")
-        window = MainWindow()
+        window = MainWindow(timer)
         window.show()
+        timer.mark("主窗口显示")
         
         logger.info("进入应用主循环")
         exit_code = app.exec()
@@ -332,4 +542,6 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # 打包后的程序启动后处理 / 下载工作进程时需要
+    multiprocessing.freeze_support()
     main() 
\ No newline at end of file
@@ -5,7 +5,7 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[('completed_files.json', '.'), ('data\\dropdata.csv', 'data'), ('HCNetSDK', 'HCNetSDK')],
+    datas=[('completed_files.json', '.'), ('data\\dropdata.csv', 'data'), ('config', 'config'), ('HCNetSDK', 'HCNetSDK')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import math
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# 计算哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+# 后处理结果保存的子目录
+PROCESSED_DIR = "processed"
+# 分发线程等待队列和进程池空位时检查停止标志的间隔（秒）
+DISPATCH_POLL_SECONDS = 0.5
+
+
+def _lower_priority():
+    """进程池初始化：降低工作进程优先级，避免与 SDK 下载争抢 CPU"""
+    try:
+        if platform.system() == "Windows":
+            import ctypes
+            BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            ctypes.windll.kernel32.SetPriorityClass(handle, BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            os.nice(10)
+    except Exception:
+        pass
+
+
+def _channel_files(folder_path, channel):
+    """返回文件夹中指定通道的视频文件"""
+    prefix = f"{channel}_"
+    return sorted(
+        os.path.join(folder_path, name) for name in os.listdir(folder_path)
+        if name.startswith(prefix) and name.endswith('.mp4')
+    )
+
+
+def _probe_duration(ffprobe, video_path):
+    """使用 ffprobe 获取视频时长（秒），不可用时返回 None"""
+    if not ffprobe:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', video_path],
+            capture_output=True, text=True, timeout=60
+        )
+        return float(result.stdout.strip())
+    except Exception:
+        return None
+
+
+def _run_ffmpeg(ffmpeg, args):
+    """执行 ffmpeg 命令，失败时抛出异常"""
+    result = subprocess.run([ffmpeg, '-y', '-v', 'error'] + args,
+                            capture_output=True, text=True, timeout=600)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"ffmpeg 返回 {result.returncode}")
+
+
+def process_channel(folder_path, channel, options):
+    """
+    处理单个通道的视频文件（在工作进程中执行）
+
+    参数:
+    folder_path (str): 任务文件夹 record/<任务名>
+    channel (int): 通道号
+    options (dict): remux / thumbnail / sidecar / sidecar_sha256 开关及 ffmpeg / ffprobe 路径
+
+    返回:
+    list: 生成的文件路径
+    """
+    outputs = []
+    out_dir = os.path.join(folder_path, PROCESSED_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    ffmpeg = options.get('ffmpeg')
+
+    for video_path in _channel_files(folder_path, channel):
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+
+        if options.get('sidecar'):
+            digest = None
+            # 启用去重时哈希已记录在去重索引中，不再重复计算
+            if options.get('sidecar_sha256'):
+                sha256 = hashlib.sha256()
+                with open(video_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                        sha256.update(chunk)
+                digest = sha256.hexdigest()
+            metadata = {
+                'file': os.path.basename(video_path),
+                'channel': channel,
+                'size': os.path.getsize(video_path),
+                'sha256': digest,
+                'duration': _probe_duration(options.get('ffprobe'), video_path),
+            }
+            sidecar_path = video_path + '.json'
+            with open(sidecar_path, 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            outputs.append(sidecar_path)
+
+        if options.get('remux') and ffmpeg:
+            remux_path = os.path.join(out_dir, stem + '.mp4')
+            _run_ffmpeg(ffmpeg, ['-i', video_path, '-c', 'copy', '-movflags', '+faststart', remux_path])
+            outputs.append(remux_path)
+
+        if options.get('thumbnail') and ffmpeg:
+            thumb_path = os.path.join(out_dir, stem + '.jpg')
+            _run_ffmpeg(ffmpeg, ['-skip_frame', 'nokey', '-i', video_path,
+                                 '-frames:v', '1', '-vsync', 'vfr', thumb_path])
+            outputs.append(thumb_path)
+
+    return outputs
+
+
+def build_mosaic(folder_path, channels, options):
+    """
+    把多个通道拼接成网格画面（在工作进程中执行），4 个通道时为 2×2
+
+    返回:
+    list: 生成的文件路径
+    """
+    ffmpeg = options.get('ffmpeg')
+    if not ffmpeg:
+        return []
+
+    inputs = []
+    for channel in channels:
+        files = _channel_files(folder_path, channel)
+        if not files:
+            print(f"通道 {channel} 没有视频，跳过拼接: {folder_path}")
+            return []
+        inputs.append(files[0])
+
+    out_dir = os.path.join(folder_path, PROCESSED_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    mosaic_path = os.path.join(out_dir, 'mosaic.mp4')
+
+    args = []
+    for path in inputs:
+        args += ['-i', path]
+    width, height = options.get('mosaic_size', (960, 540))
+    count = len(inputs)
+    if count == 1:
+        filter_graph = f"[0:v]scale={width}:{height}[out]"
+    else:
+        # 按 cols 列排列，每个画面缩放到相同大小，位置直接用像素坐标
+        cols = math.ceil(math.sqrt(count))
+        scaled = ''.join(f"[{i}:v]scale={width}:{height}[v{i}];" for i in range(count))
+        labels = ''.join(f"[v{i}]" for i in range(count))
+        layout = '|'.join(f"{i % cols * width}_{i // cols * height}" for i in range(count))
+        # 网格有空位时用黑色填充
+        fill = ':fill=black' if count % cols else ''
+        filter_graph = scaled + f"{labels}xstack=inputs={count}:layout={layout}{fill}[out]"
+    args += ['-filter_complex', filter_graph, '-map', '[out]', '-an', mosaic_path]
+    _run_ffmpeg(ffmpeg, args)
+    return [mosaic_path]
+
+
+class PostProcessor:
+    """
+    下载完成后的后处理
+
+    任务放入有界队列，由分发线程提交到进程池执行，同时在途的任务数不超过
+    进程数的两倍。队列满时直接拒绝新任务而不阻塞调用方，保证 CPU 密集的
+    转封装、截图、拼接不会拖慢 SDK 下载。
+    """
+
+    def __init__(self, record_root="record", max_workers=2, queue_size=32, remux=True,
+                 thumbnail=True, mosaic=True, sidecar=True, mosaic_channels=(33, 34, 35, 36),
+                 mosaic_size=(960, 540), ffmpeg="ffmpeg", ffprobe="ffprobe", sidecar_sha256=True):
+        self.record_root = record_root
+        self.max_workers = max_workers
+        self.mosaic = mosaic
+        self.mosaic_channels = list(mosaic_channels)
+        self.mosaic_size = tuple(mosaic_size)
+        self.options = {
+            'remux': remux,
+            'thumbnail': thumbnail,
+            'sidecar': sidecar,
+            'sidecar_sha256': sidecar_sha256,
+            'ffmpeg': shutil.which(ffmpeg),
+            'ffprobe': shutil.which(ffprobe),
+        }
+        if not self.options['ffmpeg'] and (remux or thumbnail or mosaic):
+            print("未找到 ffmpeg，转封装、截图和拼接将被跳过")
+
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._slots = threading.Semaphore(max_workers * 2)
+        self._pending = set()  # 已提交到进程池、尚未完成的 future
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = None
+        self._dispatcher = None
+
+    @classmethod
+    def from_settings(cls, settings, record_root="record"):
+        """根据 settings['post_process'] 创建，未启用时返回 None"""
+        if not settings.get('enabled'):
+            return None
+        options = {k: v for k, v in settings.items() if k != 'enabled'}
+        return cls(record_root=record_root, **options)
+
+    def start(self):
+        """启动进程池和分发线程"""
+        if self._executor is not None:
+            return
+        self._stop.clear()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_lower_priority)
+        self._dispatcher = threading.Thread(target=self._dispatch, name="PostProcessDispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self, wait=True):
+        """停止后处理，wait 为 False 时丢弃队列中尚未开始的任务"""
+        if self._executor is None:
+            return
+        if wait:
+            self.jobs.put(None)
+        else:
+            # 分发线程可能正阻塞在等待进程池空位，设置停止标志后它会在下一次检查时退出
+            self._stop.set()
+            try:
+                while True:
+                    self.jobs.get_nowait()
+            except queue.Empty:
+                pass
+        self._dispatcher.join()
+        if not wait:
+            # 取消已提交但尚未开始的任务（cancel_futures 需要 Python 3.9）
+            with self._pending_lock:
+                pending = list(self._pending)
+            for future in pending:
+                future.cancel()
+        self._executor.shutdown(wait=wait)
+        self._executor = None
+        self._dispatcher = None
+
+    def submit_channel(self, task_name, channel):
+        """提交单个通道的后处理，队列已满时返回 False"""
+        return self._submit(process_channel, task_name, channel, self.options)
+
+    def submit_task(self, task_name, channels):
+        """任务全部通道下载完成后提交拼接，通道不完整时跳过"""
+        if not self.mosaic or not set(self.mosaic_channels) <= set(channels):
+            return False
+        options = dict(self.options, mosaic_size=self.mosaic_size)
+        return self._submit(build_mosaic, task_name, self.mosaic_channels, options)
+
+    def _submit(self, func, task_name, *args):
+        folder_path = os.path.join(self.record_root, task_name)
+        try:
+            self.jobs.put_nowait((func, folder_path) + args)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"后处理队列已满，丢弃任务: {task_name}（累计丢弃 {self.dropped} 个）")
+            return False
+
+    def _dispatch(self):
+        """从队列取任务提交到进程池"""
+        while not self._stop.is_set():
+            try:
+                job = self.jobs.get(timeout=DISPATCH_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if job is None:
+                break
+            while not self._slots.acquire(timeout=DISPATCH_POLL_SECONDS):
+                if self._stop.is_set():
+                    return
+            func, folder_path = job[0], job[1]
+            try:
+                future = self._executor.submit(*job)
+            except Exception as e:
+                self._slots.release()
+                print(f"提交后处理任务失败 {folder_path}: {e}")
+                continue
+            with self._pending_lock:
+                self._pending.add(future)
+            future.add_done_callback(lambda f, path=folder_path, name=func.__name__: self._on_done(f, path, name))
+
+    def _on_done(self, future, folder_path, name):
+        with self._pending_lock:
+            self._pending.discard(future)
+        self._slots.release()
+        if future.cancelled():
+            return
+        try:
+            outputs = future.result()
+            print(f"后处理 {name} 完成: {folder_path}，生成 {len(outputs)} 个文件")
+        except Exception as e:
+            print(f"后处理 {name} 失败 {folder_path}: {e}")
@@ -0,0 +1,329 @@
+import os
+import shutil
+import struct
+import threading
+import time
+
+# 片段文件名：<开始毫秒>_<结束毫秒>.seg；正在写入的片段：<开始毫秒>.part
+SEGMENT_SUFFIX = ".seg"
+PARTIAL_SUFFIX = ".part"
+# 相邻片段之间允许的最大间隙（秒），超过时视为缓冲中断，该时间段无法从缓冲截取
+MAX_GAP_SECONDS = 3
+# 海康码流文件头（"IMKH" 开头的 40 字节），拼接片段时只保留第一个片段的文件头
+HIK_HEADER = b"IMKH"
+HIK_HEADER_SIZE = 40
+# 拼接片段时的复制缓冲区大小
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class SimulatedStreamSource:
+    """
+    模拟码流
+
+    按固定码率向当前片段文件写入数据块，每个数据块以 b'SIMF' + 通道号 + 毫秒时间戳开头，
+    可用于在没有设备的环境中测试预录缓冲与截取结果。
+    """
+
+    FRAME_HEADER = struct.Struct('<4sIq')
+
+    def __init__(self, kbps=512, interval=0.2):
+        self.kbps = kbps
+        self.interval = interval
+
+    def open(self, channel):
+        handle = {'channel': channel, 'file': None, 'lock': threading.Lock(), 'stop': threading.Event()}
+        handle['thread'] = threading.Thread(target=self._produce, args=(handle,),
+                                            name=f"SimStream-{channel}", daemon=True)
+        handle['thread'].start()
+        return handle
+
+    def save(self, handle, path):
+        with handle['lock']:
+            handle['file'] = open(path, 'wb')
+
+    def stop_save(self, handle):
+        with handle['lock']:
+            if handle['file'] is not None:
+                handle['file'].close()
+                handle['file'] = None
+
+    def close(self, handle):
+        handle['stop'].set()
+        handle['thread'].join(2)
+        self.stop_save(handle)
+
+    def _produce(self, handle):
+        size = max(self.FRAME_HEADER.size, int(self.kbps * 1000 / 8 * self.interval))
+        padding = b'\0' * (size - self.FRAME_HEADER.size)
+        while not handle['stop'].wait(self.interval):
+            frame = self.FRAME_HEADER.pack(b'SIMF', handle['channel'], int(time.time() * 1000)) + padding
+            with handle['lock']:
+                if handle['file'] is not None:
+                    handle['file'].write(frame)
+                    handle['file'].flush()
+
+
+class SdkStreamSource:
+    """
+    设备实时码流
+
+    使用已登录的 VideoDownloader 会话对每个通道调用 NET_DVR_RealPlay_V40（不解码显示），
+    通过 NET_DVR_SaveRealData / NET_DVR_StopSaveRealData 把码流保存为片段文件；
+    切换片段前请求关键帧，使每个片段都能独立播放。
+    """
+
+    def __init__(self, downloader, stream_type=0):
+        from sdk_binding import NET_DVR_PREVIEWINFO
+        self.downloader = downloader
+        self.stream_type = stream_type
+        self._preview_info = NET_DVR_PREVIEWINFO
+
+    @property
+    def sdk(self):
+        return self.downloader.HCNetSDK
+
+    def open(self, channel):
+        from ctypes import byref
+        info = self._preview_info(lChannel=channel, dwStreamType=self.stream_type, dwLinkMode=0,
+                                  hPlayWnd=None, bBlocked=1)
+        handle = self.sdk.check_handle('NET_DVR_RealPlay_V40', self.downloader.lUserID, byref(info), None, None)
+        return {'channel': channel, 'handle': handle}
+
+    def save(self, handle, path):
+        self.sdk.NET_DVR_MakeKeyFrame(self.downloader.lUserID, handle['channel'])
+        self.sdk.check('NET_DVR_SaveRealData', handle['handle'], path.encode('utf-8'))
+
+    def stop_save(self, handle):
+        self.sdk.NET_DVR_StopSaveRealData(handle['handle'])
+
+    def close(self, handle):
+        self.stop_save(handle)
+        self.sdk.NET_DVR_StopRealPlay(handle['handle'])
+
+
+class ChannelBuffer:
+    """单个通道的片段环形缓冲"""
+
+    def __init__(self, channel, folder):
+        self.channel = channel
+        self.folder = folder
+        self.segments = []  # [(开始时间, 结束时间, 路径)]，按时间排序
+        self.handle = None
+        self.current_start = None
+        self.current_path = None
+        self.pinned = {}  # 路径 -> 正在读取该片段的截取数，清理时跳过
+        self.lock = threading.Lock()
+
+    def pin(self, segments):
+        for _, _, path in segments:
+            self.pinned[path] = self.pinned.get(path, 0) + 1
+
+    def unpin(self, segments):
+        for _, _, path in segments:
+            count = self.pinned.get(path, 0) - 1
+            if count > 0:
+                self.pinned[path] = count
+            else:
+                self.pinned.pop(path, None)
+
+    def load_existing(self):
+        """载入上次运行留下的片段，清理未完成的片段"""
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if name.endswith(PARTIAL_SUFFIX):
+                os.remove(path)
+                continue
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                start_ms, end_ms = name[:-len(SEGMENT_SUFFIX)].split('_')
+                self.segments.append((int(start_ms) / 1000, int(end_ms) / 1000, path))
+            except ValueError:
+                continue
+        self.segments.sort()
+
+
+class PrerecordBuffer:
+    """
+    预录缓冲
+
+    对每个通道持续保存实时码流，按 segment_seconds 切分为片段文件，只保留最近 minutes 分钟。
+    触发任务的时间段完全落在缓冲范围内时，直接在本地拼接片段生成视频，不需要向设备回放下载；
+    超出缓冲范围（或缓冲有中断）时返回 False，由调用方回退到回放下载。
+
+    截取以片段为单位，生成的视频会比请求的时间段多出不超过一个片段的长度。
+    """
+
+    def __init__(self, source, channels, buffer_dir="data/prerecord", minutes=10, segment_seconds=30):
+        self.source = source
+        self.buffer_dir = buffer_dir
+        self.retention = minutes * 60
+        self.segment_seconds = segment_seconds
+        self.channels = {ch: ChannelBuffer(ch, os.path.join(buffer_dir, str(ch))) for ch in channels}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls, settings, downloader=None):
+        """根据 settings['prerecord'] 创建，未启用或缺少设备会话时返回 None"""
+        if not settings.get('enabled'):
+            return None
+        if settings.get('source', 'sdk') == 'simulated':
+            source = SimulatedStreamSource(settings.get('simulated_kbps', 512))
+        elif downloader is None:
+            return None
+        else:
+            source = SdkStreamSource(downloader, settings.get('stream_type', 0))
+        return cls(source, settings.get('channels', [33, 34, 35, 36]), settings.get('buffer_dir', "data/prerecord"),
+                   settings.get('minutes', 10), settings.get('segment_seconds', 30))
+
+    def start(self):
+        """开始采集各通道码流"""
+        for buffer in self.channels.values():
+            os.makedirs(buffer.folder, exist_ok=True)
+            buffer.load_existing()
+            try:
+                buffer.handle = self.source.open(buffer.channel)
+                with buffer.lock:
+                    self._begin_segment(buffer)
+                print(f"通道 {buffer.channel} 开始预录")
+            except Exception as e:
+                buffer.handle = None
+                print(f"通道 {buffer.channel} 开始预录失败: {e}")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="PrerecordBuffer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止采集，正在写入的片段保存为完整片段"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+        for buffer in self.channels.values():
+            if buffer.handle is None:
+                continue
+            with buffer.lock:
+                self.source.stop_save(buffer.handle)
+                self._finish_segment(buffer)
+                try:
+                    self.source.close(buffer.handle)
+                except Exception as e:
+                    print(f"通道 {buffer.channel} 停止预录出错: {e}")
+                buffer.handle = None
+
+    def _run(self):
+        while not self._stop.wait(1):
+            now = time.time()
+            for buffer in self.channels.values():
+                if buffer.handle is None:
+                    continue
+                with buffer.lock:
+                    if buffer.current_start is not None and now - buffer.current_start >= self.segment_seconds:
+                        self._rotate(buffer)
+                    self._prune(buffer, now)
+
+    def _begin_segment(self, buffer):
+        buffer.current_start = time.time()
+        buffer.current_path = os.path.join(buffer.folder, f"{int(buffer.current_start * 1000)}{PARTIAL_SUFFIX}")
+        self.source.save(buffer.handle, buffer.current_path)
+
+    def _finish_segment(self, buffer):
+        """把正在写入的片段改名为完整片段并加入索引"""
+        path, start = buffer.current_path, buffer.current_start
+        buffer.current_path = buffer.current_start = None
+        if path is None or not os.path.exists(path):
+            return
+        if os.path.getsize(path) == 0:
+            os.remove(path)
+            return
+        end = time.time()
+        final_path = os.path.join(buffer.folder, f"{int(start * 1000)}_{int(end * 1000)}{SEGMENT_SUFFIX}")
+        os.replace(path, final_path)
+        buffer.segments.append((start, end, final_path))
+
+    def _rotate(self, buffer):
+        """结束当前片段并开始新片段（调用方持有 buffer.lock）"""
+        try:
+            self.source.stop_save(buffer.handle)
+            self._finish_segment(buffer)
+            self._begin_segment(buffer)
+        except Exception as e:
+            print(f"通道 {buffer.channel} 切换预录片段失败: {e}")
+
+    def _prune(self, buffer, now):
+        cutoff = now - self.retention
+        # 片段按时间排序，最早的片段正在被截取时本轮不再清理，下一轮再处理
+        while buffer.segments and buffer.segments[0][1] < cutoff and buffer.segments[0][2] not in buffer.pinned:
+            _, _, path = buffer.segments.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def covers(self, channel, start, end):
+        """缓冲中是否有完整覆盖 [start, end]（epoch 秒）的片段"""
+        buffer = self.channels.get(channel)
+        if buffer is None:
+            return False
+        with buffer.lock:
+            return self._select(buffer, start, end) is not None
+
+    @staticmethod
+    def _select(buffer, start, end):
+        """返回覆盖 [start, end] 的连续片段列表，无法完整覆盖时返回 None"""
+        selected = [seg for seg in buffer.segments if seg[1] > start and seg[0] < end]
+        if not selected or selected[0][0] > start + MAX_GAP_SECONDS or selected[-1][1] < end - MAX_GAP_SECONDS:
+            return None
+        for previous, segment in zip(selected, selected[1:]):
+            if segment[0] - previous[1] > MAX_GAP_SECONDS:
+                return None
+        return selected
+
+    def cut(self, channel, start_time, end_time, save_path):
+        """
+        从缓冲中截取视频
+
+        参数:
+        channel (int): 通道号
+        start_time / end_time (datetime): 时间段
+        save_path (str): 输出文件路径
+
+        返回:
+        bool: 是否截取成功；时间段不在缓冲范围内时返回 False
+        """
+        buffer = self.channels.get(channel)
+        if buffer is None or buffer.handle is None:
+            return False
+        start, end = start_time.timestamp(), end_time.timestamp()
+        with buffer.lock:
+            # 时间段延伸到正在写入的片段时先切换片段，使其中的数据可以读取
+            if buffer.current_start is not None and end > buffer.current_start:
+                if end > time.time():
+                    return False
+                self._rotate(buffer)
+            selected = self._select(buffer, start, end)
+            if selected is None:
+                return False
+            # 复制在锁外进行，期间固定所选片段，避免被清理线程删除
+            buffer.pin(selected)
+        tmp_path = save_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as out:
+                for index, (_, _, path) in enumerate(selected):
+                    with open(path, 'rb') as f:
+                        if index > 0 and f.read(len(HIK_HEADER)) == HIK_HEADER:
+                            f.seek(HIK_HEADER_SIZE)
+                        else:
+                            f.seek(0)
+                        shutil.copyfileobj(f, out, COPY_BUFFER_SIZE)
+            os.replace(tmp_path, save_path)
+        except OSError as e:
+            print(f"从预录缓冲截取通道 {channel} 视频失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        finally:
+            with buffer.lock:
+                buffer.unpin(selected)
+        print(f"通道 {channel} 从预录缓冲截取 {start_time} - {end_time}（{len(selected)} 个片段）: {save_path}")
+        return True
@@ -0,0 +1,183 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# NVR 按文件保存录像，相邻文件之间通常有 1 秒左右的间隔；不超过该秒数的间隔视为连续录像
+MAX_GAP_SECONDS = 5
+
+
+def _merge(intervals, tolerance=0):
+    """合并有序区间列表中重叠、相邻或间隔不超过 tolerance 秒的区间"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + tolerance:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _subtract(intervals, start, end):
+    """返回 [start, end) 中不被 intervals 覆盖的部分"""
+    gaps = []
+    cursor = start
+    i = bisect.bisect_right(intervals, [start, float('inf')]) - 1
+    i = max(i, 0)
+    for seg_start, seg_end in intervals[i:]:
+        if seg_start >= end:
+            break
+        if seg_end <= cursor:
+            continue
+        if seg_start > cursor:
+            gaps.append((cursor, seg_start))
+        cursor = max(cursor, seg_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def _clip(intervals, start, end):
+    """返回 intervals 与 [start, end) 的交集"""
+    result = []
+    i = bisect.bisect_right(intervals, [start, float('inf')]) - 1
+    i = max(i, 0)
+    for seg_start, seg_end in intervals[i:]:
+        if seg_start >= end:
+            break
+        lo, hi = max(seg_start, start), min(seg_end, end)
+        if lo < hi:
+            result.append((lo, hi))
+    return result
+
+
+class RecordIndex:
+    """
+    设备录像分布索引
+
+    按通道缓存 NVR 上已存在的录像段（epoch 秒区间），同时记录已经查询过的时间范围。
+    下载前只需查询尚未覆盖的范围，结果持久化到磁盘，重启后无需重新查询历史。
+    """
+
+    def __init__(self, index_path="data/record_index.json", retention_days=30,
+                 live_margin=600, query_align=3600, max_gap=MAX_GAP_SECONDS):
+        """
+        参数:
+        index_path (str): 索引文件路径
+        retention_days (int): 保留天数，更早的录像段和查询记录会被清理（NVR 会循环覆盖旧录像）
+        live_margin (int): 距当前时间多少秒以内的范围不视为已查询（设备可能仍在写入）
+        query_align (int): 查询范围对齐的秒数，使相邻触发共享一次查询
+        max_gap (float): footage 返回结果中，间隔不超过该秒数的录像段合并为一段
+        """
+        self.index_path = index_path
+        self.retention_days = retention_days
+        self.live_margin = live_margin
+        self.query_align = query_align
+        self.max_gap = max_gap
+        self.segments = {}  # 通道 -> [[start, end], ...]
+        self.covered = {}   # 通道 -> [[start, end], ...]
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """从磁盘加载索引"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.segments = {int(ch): v for ch, v in data.get('segments', {}).items()}
+            self.covered = {int(ch): v for ch, v in data.get('covered', {}).items()}
+            print(f"加载了 {len(self.segments)} 个通道的录像索引")
+        except Exception as e:
+            print(f"加载录像索引失败: {e}")
+            self.segments = {}
+            self.covered = {}
+
+    def save(self):
+        """保存索引到磁盘"""
+        with self._lock:
+            self._prune()
+            data = {'segments': self.segments, 'covered': self.covered}
+            try:
+                index_dir = os.path.dirname(self.index_path)
+                if index_dir and not os.path.exists(index_dir):
+                    os.makedirs(index_dir)
+                tmp_path = self.index_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.index_path)
+            except Exception as e:
+                print(f"保存录像索引失败: {e}")
+
+    def _prune(self):
+        """清理超过保留天数的记录"""
+        if self.retention_days is None:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for table in (self.segments, self.covered):
+            for channel, intervals in table.items():
+                table[channel] = [list(iv) for iv in _clip(intervals, cutoff, float('inf'))]
+
+    def missing(self, channel, start, end):
+        """
+        返回需要向设备查询的范围（已按 query_align 对齐，不超过当前时间）
+
+        参数:
+        channel (int): 通道号
+        start (float): 开始时间（epoch 秒）
+        end (float): 结束时间（epoch 秒）
+        """
+        align = self.query_align
+        start = int(start // align * align)
+        end = min(int(-(-end // align) * align), int(time.time()))
+        if start >= end:
+            return []
+        with self._lock:
+            return _subtract(self.covered.get(channel, []), start, end)
+
+    def update(self, channel, start, end, segments):
+        """
+        写入一次查询结果
+
+        参数:
+        channel (int): 通道号
+        start, end (float): 查询范围（epoch 秒）
+        segments (list): 查询到的录像段 [(start, end), ...]
+        """
+        with self._lock:
+            # 用新结果替换查询范围内的旧录像段
+            old = self.segments.get(channel, [])
+            kept = []
+            for seg_start, seg_end in old:
+                if seg_end <= start or seg_start >= end:
+                    kept.append([seg_start, seg_end])
+                else:
+                    if seg_start < start:
+                        kept.append([seg_start, start])
+                    if seg_end > end:
+                        kept.append([end, seg_end])
+            kept.extend([int(s), int(e)] for s, e in segments if e > s)
+            self.segments[channel] = _merge(kept)
+
+            # 靠近当前时间的部分设备可能仍在录像，不记为已查询
+            covered_end = min(end, time.time() - self.live_margin)
+            if covered_end > start:
+                covered = self.covered.get(channel, [])
+                covered.append([int(start), int(covered_end)])
+                self.covered[channel] = _merge(covered)
+
+    def footage(self, channel, start, end):
+        """返回 [start, end) 内已知存在的录像段（间隔不超过 max_gap 秒的录像段合并为一段）"""
+        with self._lock:
+            footage = _clip(self.segments.get(channel, []), start, end)
+        return [tuple(iv) for iv in _merge(footage, self.max_gap)]
+
+    def is_covered(self, channel, start, end):
+        """[start, end) 是否已经全部查询过"""
+        with self._lock:
+            return not _subtract(self.covered.get(channel, []), start, end)
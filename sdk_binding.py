@@ -0,0 +1,329 @@
+import logging
+import os
+import platform
+import threading
+import time
+from ctypes import POINTER, Structure, c_char, c_char_p, c_int, c_long, c_uint16, c_uint32, c_ubyte, c_void_p
+
+logger = logging.getLogger("VideoDownloader.sdk")
+
+# Windows 数据类型
+BOOL = c_int
+BYTE = c_ubyte
+WORD = c_uint16
+DWORD = c_uint32
+LONG = c_long
+
+SERIALNO_LEN = 48
+STREAM_ID_LEN = 32
+
+
+# 时间结构体
+class NET_DVR_TIME(Structure):
+    _fields_ = [
+        ("dwYear", DWORD),
+        ("dwMonth", DWORD),
+        ("dwDay", DWORD),
+        ("dwHour", DWORD),
+        ("dwMinute", DWORD),
+        ("dwSecond", DWORD),
+    ]
+
+
+# 设备信息结构体
+class NET_DVR_DEVICEINFO_V30(Structure):
+    _fields_ = [
+        ("sSerialNumber", BYTE * SERIALNO_LEN),
+        ("byAlarmInPortNum", BYTE),
+        ("byAlarmOutPortNum", BYTE),
+        ("byDiskNum", BYTE),
+        ("byDVRType", BYTE),
+        ("byChanNum", BYTE),
+        ("byStartChan", BYTE),
+        ("byAudioChanNum", BYTE),
+        ("byIPChanNum", BYTE),
+        ("byZeroChanNum", BYTE),
+        ("byMainProto", BYTE),
+        ("bySubProto", BYTE),
+        ("bySupport", BYTE),
+        ("bySupport1", BYTE),
+        ("bySupport2", BYTE),
+        ("wDevType", WORD),
+        ("bySupport3", BYTE),
+        ("byMultiStreamProto", BYTE),
+        ("byStartDChan", BYTE),
+        ("byStartDTalkChan", BYTE),
+        ("byHighDChanNum", BYTE),
+        ("bySupport4", BYTE),
+        ("byLanguageType", BYTE),
+        ("byVoiceInChanNum", BYTE),
+        ("byStartVoiceInChanNo", BYTE),
+        ("byRes3", BYTE * 2),
+        ("byMirrorChanNum", BYTE),
+        ("wStartMirrorChanNo", WORD),
+        ("byRes2", BYTE * 2),
+    ]
+
+
+# 录像文件查找条件
+class NET_DVR_FILECOND(Structure):
+    _fields_ = [
+        ("lChannel", LONG),
+        ("dwFileType", DWORD),
+        ("dwIsLocked", DWORD),
+        ("dwUseCardNo", DWORD),
+        ("sCardNumber", BYTE * 32),
+        ("struStartTime", NET_DVR_TIME),
+        ("struStopTime", NET_DVR_TIME),
+    ]
+
+
+# 录像文件查找结果
+class NET_DVR_FINDDATA_V30(Structure):
+    _fields_ = [
+        ("sFileName", c_char * 100),
+        ("struStartTime", NET_DVR_TIME),
+        ("struStopTime", NET_DVR_TIME),
+        ("dwFileSize", DWORD),
+        ("sCardNum", c_char * 32),
+        ("byLocked", BYTE),
+        ("byFileType", BYTE),
+        ("byRes", BYTE * 2),
+    ]
+
+
+# 实时预览参数
+class NET_DVR_PREVIEWINFO(Structure):
+    _fields_ = [
+        ("lChannel", LONG),
+        ("dwStreamType", DWORD),  # 0-主码流，1-子码流
+        ("dwLinkMode", DWORD),  # 0-TCP
+        ("hPlayWnd", c_void_p),  # 不解码显示时为 None
+        ("bBlocked", BOOL),
+        ("bPassbackRecord", BOOL),
+        ("byPreviewMode", BYTE),
+        ("byStreamID", BYTE * STREAM_ID_LEN),
+        ("byProtoType", BYTE),
+        ("byRes1", BYTE),
+        ("byVideoCodingType", BYTE),
+        ("dwDisplayBufNum", DWORD),
+        ("byNPQMode", BYTE),
+        ("byRecvMetaData", BYTE),
+        ("byDataType", BYTE),
+        ("byRes", BYTE * 213),
+    ]
+
+
+# NET_DVR_FindNextFile_V30 返回值
+NET_DVR_FILE_SUCCESS = 1000
+NET_DVR_FILE_NOFIND = 1001
+NET_DVR_ISFINDING = 1002
+NET_DVR_NOMOREFILE = 1003
+NET_DVR_FILE_EXCEPTION = 1004
+
+# NET_DVR_PlayBackControl 控制命令
+NET_DVR_PLAYSTART = 1
+NET_DVR_SETSPEED = 24  # 设置下载速度（kbps）
+
+# 函数原型：函数名 -> (argtypes, restype)
+PROTOTYPES = {
+    'NET_DVR_Init': ([], BOOL),
+    'NET_DVR_Cleanup': ([], BOOL),
+    'NET_DVR_GetLastError': ([], DWORD),
+    'NET_DVR_SetConnectTime': ([DWORD, DWORD], BOOL),
+    'NET_DVR_SetReconnect': ([DWORD, BOOL], BOOL),
+    'NET_DVR_Login_V30': ([c_char_p, WORD, c_char_p, c_char_p, POINTER(NET_DVR_DEVICEINFO_V30)], LONG),
+    'NET_DVR_Logout': ([LONG], BOOL),
+    'NET_DVR_GetFileByTime': ([LONG, LONG, POINTER(NET_DVR_TIME), POINTER(NET_DVR_TIME), c_char_p], LONG),
+    'NET_DVR_PlayBackControl': ([LONG, DWORD, DWORD, POINTER(DWORD)], BOOL),
+    'NET_DVR_GetDownloadPos': ([LONG], c_int),
+    'NET_DVR_StopGetFile': ([LONG], BOOL),
+    'NET_DVR_FindFile_V30': ([LONG, POINTER(NET_DVR_FILECOND)], LONG),
+    'NET_DVR_FindNextFile_V30': ([LONG, POINTER(NET_DVR_FINDDATA_V30)], LONG),
+    'NET_DVR_FindClose_V30': ([LONG], BOOL),
+    # 实时预览与本地录像（预录缓冲）；不使用数据回调，回调参数传 None
+    'NET_DVR_RealPlay_V40': ([LONG, POINTER(NET_DVR_PREVIEWINFO), c_void_p, c_void_p], LONG),
+    'NET_DVR_StopRealPlay': ([LONG], BOOL),
+    'NET_DVR_SaveRealData': ([LONG, c_char_p], BOOL),
+    'NET_DVR_StopSaveRealData': ([LONG], BOOL),
+    'NET_DVR_MakeKeyFrame': ([LONG, LONG], BOOL),
+}
+
+
+class HCNetSDKError(Exception):
+    """SDK 调用失败"""
+
+    def __init__(self, func_name, code, description=None):
+        self.func_name = func_name
+        self.code = code
+        self.description = description or ERROR_DESCRIPTIONS.get(code, "未知错误")
+        super().__init__(f"{func_name} 失败，错误码：{code}（{self.description}）")
+
+
+class SDKNotInitializedError(HCNetSDKError):
+    """SDK 未初始化"""
+
+
+class SDKAuthError(HCNetSDKError):
+    """用户名、密码错误或用户被锁定"""
+
+
+class SDKPermissionError(HCNetSDKError):
+    """权限不足"""
+
+
+class SDKNetworkError(HCNetSDKError):
+    """连接设备失败、网络收发错误或超时"""
+
+
+class SDKChannelError(HCNetSDKError):
+    """通道号错误"""
+
+
+class SDKResourceError(HCNetSDKError):
+    """连接数或资源达到上限"""
+
+
+class SDKParameterError(HCNetSDKError):
+    """参数错误或设备不支持"""
+
+
+class SDKFileError(HCNetSDKError):
+    """本地文件创建或打开失败"""
+
+
+# 错误码 -> (异常类型, 说明)
+ERROR_CODES = {
+    1: (SDKAuthError, "用户名密码错误"),
+    2: (SDKPermissionError, "权限不足"),
+    3: (SDKNotInitializedError, "SDK未初始化"),
+    4: (SDKChannelError, "通道号错误"),
+    5: (SDKResourceError, "设备连接数超过上限"),
+    7: (SDKNetworkError, "连接设备失败"),
+    8: (SDKNetworkError, "向设备发送失败"),
+    9: (SDKNetworkError, "从设备接收数据失败"),
+    10: (SDKNetworkError, "从设备接收数据超时"),
+    11: (SDKNetworkError, "传送的数据有误"),
+    17: (SDKParameterError, "参数错误"),
+    23: (SDKParameterError, "设备不支持"),
+    34: (SDKFileError, "创建文件出错"),
+    35: (SDKFileError, "打开文件出错"),
+    41: (SDKResourceError, "资源分配错误"),
+    47: (SDKAuthError, "用户不存在"),
+    153: (SDKAuthError, "用户被锁定"),
+}
+ERROR_DESCRIPTIONS = {code: description for code, (_, description) in ERROR_CODES.items()}
+
+
+def make_error(func_name, code):
+    """根据错误码创建对应类型的异常"""
+    error_class = ERROR_CODES.get(code, (HCNetSDKError, None))[0]
+    return error_class(func_name, code)
+
+
+class CallTracer:
+    """
+    SDK 调用跟踪
+
+    统计每个函数的调用次数、总耗时与最大耗时；log_args 为 True 时
+    以 DEBUG 级别记录每次调用的参数、返回值和耗时。
+    """
+
+    def __init__(self, log_args=False):
+        self.log_args = log_args
+        self.stats = {}  # 函数名 -> [次数, 总耗时, 最大耗时]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """根据 settings['sdk'] 创建，未启用跟踪时返回 None"""
+        if not settings.get('trace'):
+            return None
+        return cls(settings.get('trace_args', False))
+
+    def record(self, func_name, args, result, elapsed):
+        with self._lock:
+            stat = self.stats.setdefault(func_name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+        if self.log_args:
+            logger.debug(f"{func_name}{args!r} -> {result!r} ({elapsed * 1000:.2f} ms)")
+
+    def report(self):
+        """返回按总耗时排序的统计文本"""
+        with self._lock:
+            rows = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)
+        lines = ["SDK 调用统计（次数 / 总耗时 / 平均 / 最大）:"]
+        for func_name, (count, total, longest) in rows:
+            lines.append(f"  {func_name}: {count} / {total * 1000:.1f} ms / "
+                         f"{total / count * 1000:.2f} ms / {longest * 1000:.2f} ms")
+        return "\n".join(lines)
+
+
+class HCNetSDK:
+    """
+    已声明原型的 HCNetSDK.dll
+
+    函数以同名属性暴露，例如 sdk.NET_DVR_Init()。所有函数都声明了 argtypes / restype，
+    参数类型错误时立即抛出 ctypes.ArgumentError；设置 CallTracer 后统计每次调用的耗时。
+    """
+
+    def __init__(self, dll_path, tracer=None):
+        if platform.system() != "Windows":
+            raise OSError("此模块仅支持Windows系统")
+        from ctypes import WinDLL
+        self.dll_path = dll_path
+        self.dll = WinDLL(dll_path)
+        self.tracer = None
+        self._functions = {}
+        for func_name, (argtypes, restype) in PROTOTYPES.items():
+            func = getattr(self.dll, func_name)
+            func.argtypes = argtypes
+            func.restype = restype
+            self._functions[func_name] = func
+        self.set_tracer(tracer)
+
+    def set_tracer(self, tracer):
+        """设置或取消调用跟踪（未跟踪时直接调用 DLL 函数，没有额外开销）"""
+        self.tracer = tracer
+        for func_name, func in self._functions.items():
+            setattr(self, func_name, self._traced(func_name, func) if tracer else func)
+
+    def _traced(self, func_name, func):
+        tracer = self.tracer
+
+        def call(*args):
+            start = time.perf_counter()
+            result = func(*args)
+            tracer.record(func_name, args, result, time.perf_counter() - start)
+            return result
+
+        call.__name__ = func_name
+        return call
+
+    def error(self, func_name):
+        """根据 NET_DVR_GetLastError 创建异常"""
+        return make_error(func_name, self.NET_DVR_GetLastError())
+
+    def check(self, func_name, *args):
+        """调用返回 BOOL 的函数，失败时抛出对应的 HCNetSDKError"""
+        if not getattr(self, func_name)(*args):
+            raise self.error(func_name)
+
+    def check_handle(self, func_name, *args):
+        """调用返回句柄的函数（小于 0 表示失败），失败时抛出对应的 HCNetSDKError"""
+        handle = getattr(self, func_name)(*args)
+        if handle < 0:
+            raise self.error(func_name)
+        return handle
+
+
+def load_sdk(sdk_path, dll_name="HCNetSDK.dll", tracer=None):
+    """检查 SDK 目录并加载 DLL"""
+    if not os.path.exists(sdk_path):
+        raise FileNotFoundError(f"HCNetSDK文件夹不存在: {sdk_path}")
+    dll_path = os.path.join(sdk_path, dll_name)
+    if not os.path.exists(dll_path):
+        raise FileNotFoundError(f"HCNetSDK.dll文件不存在: {dll_path}")
+    return HCNetSDK(dll_path, tracer)
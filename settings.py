@@ -0,0 +1,100 @@
+import copy
+import json
+import os
+
+# 默认配置，config/settings.json 中的同名字段会覆盖这里的值
+DEFAULT_SETTINGS = {
+    # 带宽控制
+    'bandwidth': {
+        'enabled': False,
+        'global_kbps': 0,   # 全局带宽上限（kbps），0 表示不限制
+        'device_kbps': 0,   # 单台设备带宽上限（kbps），0 表示不限制
+        # 分时段上限，未命中任何时段时使用上面的默认值
+        'schedule': [],
+    },
+    # 下载完成后的后处理（转封装、关键帧截图、2×2 拼接、元数据文件）
+    'post_process': {
+        'enabled': False,
+        'max_workers': 2,
+        'queue_size': 32,
+        'remux': True,
+        'thumbnail': True,
+        'mosaic': True,
+        'sidecar': True,
+        'sidecar_sha256': True,  # 元数据中包含 SHA-256；启用 dedup 时改用去重计算的哈希，不再重复计算
+    },
+    # 下载视频的哈希校验与去重（重复内容替换为硬链接）
+    'dedup': {
+        'enabled': False,
+        'link_duplicates': True,
+        'index_path': 'data/footage_index.json',
+    },
+    # SDK 调用跟踪：统计每个 SDK 函数的调用次数与耗时，退出时写入日志
+    'sdk': {
+        'trace': False,
+        'trace_args': False,  # 以 DEBUG 级别记录每次调用的参数与返回值
+    },
+    # 分层存储：完成较早的任务文件夹从 record 移到归档路径
+    'tiering': {
+        'enabled': False,
+        'archive_root': 'archive',
+        'age_days': 7,              # 完成超过该天数的任务被归档
+        'pack_daily': False,        # 为 true 时同一天的任务打包为一个 zip 容器
+        'compression': 'stored',    # stored：不压缩（视频已压缩）；deflated：zip 压缩
+        'interval_seconds': 600,
+        'batch_size': 50,           # 每次最多归档的任务数
+        'copy_buffer_mb': 8,        # 跨卷复制时每次读写的大小
+    },
+    # 预录缓冲：持续保存各通道实时码流的最近若干分钟，触发时间段在缓冲内时直接本地截取
+    'prerecord': {
+        'enabled': False,
+        'source': 'sdk',            # sdk：设备实时码流（仅单进程模式）；simulated：模拟码流（测试用）
+        'channels': [33, 34, 35, 36],
+        'buffer_dir': 'data/prerecord',
+        'minutes': 10,              # 保留的分钟数，应大于触发规则的 pre_roll
+        'segment_seconds': 30,      # 片段长度，截取的视频最多比时间段多出一个片段
+        'stream_type': 0,           # 0：主码流，1：子码流
+        'simulated_kbps': 512,
+    },
+    # 多进程下载：任务按通道分片到多个工作进程，每个进程独立初始化 SDK 并登录设备
+    'workers': {
+        'enabled': False,
+        'count': 2,                # 工作进程数（每个进程占用设备的一个登录会话）
+        'heartbeat_seconds': 2,
+        'heartbeat_timeout': 20,   # 超过该时间没有心跳的进程被结束并重新启动
+        'max_crash_retries': 2,    # 同一任务导致进程异常退出超过该次数后按失败处理
+    },
+    # 本地 HTTP/JSON 控制接口（提交任务、查询状态、SSE 事件流）
+    'api': {
+        'enabled': False,
+        'host': '127.0.0.1',  # 只监听本机；对外开放时务必设置 token
+        'port': 8765,
+        'token': '',  # 非空时要求请求头 Authorization: Bearer <token>
+    },
+    # 停止 / 退出
+    'shutdown': {
+        'deadline_seconds': 5,  # 等待下载线程退出的最长时间
+    },
+}
+
+
+def _merge(base, override):
+    """递归合并配置字典"""
+    result = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def load_settings(path="config/settings.json"):
+    """加载配置文件，文件不存在或无效时使用默认配置"""
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return _merge(DEFAULT_SETTINGS, json.load(f))
+        except Exception as e:
+            print(f"加载配置文件 {path} 失败，使用默认配置: {e}")
+    return copy.deepcopy(DEFAULT_SETTINGS)
@@ -0,0 +1,47 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("VideoDownloader.startup")
+
+
+class StartupTimer:
+    """
+    启动阶段计时
+
+    记录各启动阶段的耗时以及关键时间点（相对程序启动），写入日志。
+    各阶段可能在不同线程中执行，记录时加锁。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}   # 阶段名 -> 耗时（秒）
+        self.marks = {}    # 时间点名 -> 距启动的秒数
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """统计一个阶段的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = elapsed
+            logger.info(f"启动阶段 [{name}] 耗时 {elapsed * 1000:.0f} ms "
+                        f"（{threading.current_thread().name}）")
+
+    def mark(self, name):
+        """记录一个时间点"""
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            self.marks[name] = elapsed
+        logger.info(f"启动时间点 [{name}] 距程序启动 {elapsed * 1000:.0f} ms")
+
+    def summary(self):
+        """返回各阶段耗时的文字摘要"""
+        with self._lock:
+            parts = [f"{name}={elapsed * 1000:.0f}ms" for name, elapsed in self.phases.items()]
+        return ", ".join(parts)
@@ -0,0 +1,308 @@
+import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+# 归档容器的扩展名（按天打包时使用）
+CONTAINER_SUFFIX = ".zip"
+# 正在写入的归档文件夹 / 容器的临时后缀，启动时清理
+TMP_SUFFIX = ".tmp"
+# 归档的日期目录名，以及按天打包的容器名 <日期>[_N].zip
+DAY_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+CONTAINER_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}(_\d+)?' + re.escape(CONTAINER_SUFFIX) + '$')
+# 打包时的压缩方式
+COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+}
+
+
+def copy_file(src, dst, buffer_size):
+    """以大块顺序读写复制文件（保留修改时间）"""
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb', buffering=0) as fdst:
+        while True:
+            n = fsrc.readinto(buffer)
+            if not n:
+                break
+            fdst.write(view[:n])
+    shutil.copystat(src, dst)
+
+
+def _walk_files(folder_path):
+    """遍历文件夹中的全部文件，返回 [(绝对路径, 相对路径)]，相对路径使用 '/' 分隔"""
+    files = []
+    for root, _, names in os.walk(folder_path):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            files.append((path, os.path.relpath(path, folder_path).replace(os.sep, '/')))
+    return files
+
+
+class StorageTiering:
+    """
+    record 目录的分层存储
+
+    后台线程定期把完成时间早于 age_days 天的任务文件夹从 record（下载盘）移到 archive_root（归档盘）：
+    - 默认按完成日期保存为 archive_root/<YYYY-MM-DD>/<任务名>/；
+    - pack_daily 为 true 时，同一天的任务打包为一个容器 archive_root/<YYYY-MM-DD>.zip
+      （同一天后续归档的任务写入 <YYYY-MM-DD>_2.zip 等新容器，已有容器不再修改）。
+
+    跨卷时以大块顺序读写复制，复制完成后才删除 record 下的文件夹；同一卷时直接改名。
+    每个任务的归档位置记录在已完成记录（completed_files.json 的 'archive' 字段）中，
+    每个任务（或容器）归档后立即保存；界面显示、重复下载判断和删除都据此找到任务。
+    """
+
+    def __init__(self, manager, record_root="record", archive_root="archive", age_days=7, pack_daily=False,
+                 compression='stored', interval_seconds=600, batch_size=50, copy_buffer_mb=8):
+        if compression not in COMPRESSION_METHODS:
+            raise ValueError(f"不支持的压缩方式: {compression}")
+        self.manager = manager
+        self.record_root = record_root
+        self.archive_root = archive_root
+        self.age = age_days * 86400
+        self.pack_daily = pack_daily
+        self.compression = COMPRESSION_METHODS[compression]
+        self.interval = interval_seconds
+        self.batch_size = batch_size
+        self.copy_buffer = int(copy_buffer_mb * 1024 * 1024)
+        self.archived_bytes = 0
+        self._missing = set()  # record 下找不到文件夹的任务，本次运行中不再尝试
+        # 移动任务与删除任务互斥，避免删除正在归档的任务后留下孤立的归档文件
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls, settings, manager, record_root="record"):
+        """根据 settings['tiering'] 创建，未启用时返回 None"""
+        if not settings.get('enabled'):
+            return None
+        return cls(manager, record_root, settings.get('archive_root', "archive"),
+                   settings.get('age_days', 7), settings.get('pack_daily', False),
+                   settings.get('compression', 'stored'), settings.get('interval_seconds', 600),
+                   settings.get('batch_size', 50), settings.get('copy_buffer_mb', 8))
+
+    @property
+    def history(self):
+        return self.manager.completed_files
+
+    def start(self):
+        """启动后台归档线程"""
+        os.makedirs(self.archive_root, exist_ok=True)
+        self._cleanup_tmp()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="StorageTiering", daemon=True)
+        self._thread.start()
+        print(f"分层存储已启动：完成超过 {self.age / 86400:g} 天的任务移到 {self.archive_root}")
+
+    def stop(self, timeout=5):
+        """停止后台线程（正在移动的任务会在当前文件复制完成后中止）"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"归档任务出错: {e}")
+            self._stop.wait(self.interval)
+
+    def _cleanup_tmp(self):
+        """
+        删除上次异常退出时留下的未完成归档
+
+        只处理本模块创建的临时名称：<日期>/<任务名>.tmp 文件夹和 <日期>[_N].zip.tmp 容器，
+        归档目录中的其他文件不做改动。
+        """
+        for entry in os.scandir(self.archive_root):
+            if entry.is_file() and entry.name.endswith(TMP_SUFFIX) \
+                    and CONTAINER_PATTERN.match(entry.name[:-len(TMP_SUFFIX)]):
+                print(f"删除未完成的归档: {entry.path}")
+                os.remove(entry.path)
+            elif entry.is_dir() and DAY_PATTERN.match(entry.name):
+                for task_entry in os.scandir(entry.path):
+                    if task_entry.is_dir() and task_entry.name.endswith(TMP_SUFFIX):
+                        print(f"删除未完成的归档: {task_entry.path}")
+                        shutil.rmtree(task_entry.path, ignore_errors=True)
+
+    def run_once(self, now=None):
+        """
+        归档一批到期的任务
+
+        返回:
+        int: 本次归档的任务数
+        """
+        now = time.time() if now is None else now
+        candidates = [(name, completed_at) for name, completed_at in self.history.select_archivable(now - self.age)
+                      if name not in self._missing][:self.batch_size]
+        by_day = {}
+        for name, completed_at in candidates:
+            by_day.setdefault(datetime.fromtimestamp(completed_at).strftime('%Y-%m-%d'), []).append(name)
+
+        archived = 0
+        for day, names in by_day.items():
+            if self._stop.is_set():
+                break
+            if self.pack_daily:
+                archived += self._pack_day(day, names)
+            else:
+                for name in names:
+                    if self._stop.is_set():
+                        break
+                    archived += self._archive_folder(day, name)
+        if archived:
+            self.manager.completed_updated.emit()
+            print(f"已归档 {archived} 个任务")
+        return archived
+
+    def _source(self, name):
+        """任务在 record 下的文件夹，不存在时记入 _missing 并返回 None"""
+        folder_path = os.path.join(self.record_root, name)
+        if os.path.isdir(folder_path):
+            return folder_path
+        print(f"归档跳过 {name}：{folder_path} 不存在")
+        self._missing.add(name)
+        return None
+
+    def _forget_hashes(self, names):
+        """已归档的任务从去重索引中移除，归档文件不再作为硬链接的来源"""
+        if self.manager.deduplicator:
+            self.manager.deduplicator.forget(names)
+
+    def _archive_folder(self, day, name):
+        """把单个任务文件夹移到 archive_root/<日期>/<任务名>，成功返回 1"""
+        with self.lock:
+            source = self._source(name)
+            if name not in self.history or source is None:
+                return 0
+            day_dir = os.path.join(self.archive_root, day)
+            os.makedirs(day_dir, exist_ok=True)
+            target = os.path.join(day_dir, name)
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            try:
+                if os.stat(source).st_dev == os.stat(day_dir).st_dev:
+                    os.replace(source, target)
+                else:
+                    tmp_target = target + TMP_SUFFIX
+                    os.makedirs(tmp_target, exist_ok=True)
+                    for path, rel_path in _walk_files(source):
+                        if self._stop.is_set():
+                            raise InterruptedError("归档已停止")
+                        dst = os.path.join(tmp_target, *rel_path.split('/'))
+                        os.makedirs(os.path.dirname(dst), exist_ok=True)
+                        copy_file(path, dst, self.copy_buffer)
+                        self.archived_bytes += os.path.getsize(dst)
+                    os.replace(tmp_target, target)
+                    shutil.rmtree(source)
+            except (OSError, InterruptedError) as e:
+                print(f"归档任务 {name} 失败: {e}")
+                shutil.rmtree(target + TMP_SUFFIX, ignore_errors=True)
+                return 0
+            self.history.set_archive(name, f"{day}/{name}")
+            # 每个任务移动后立即保存，避免中途退出时记录仍指向 record 下已不存在的文件夹
+            self.manager.save_completed_files()
+        self._forget_hashes([name])
+        return 1
+
+    def _container_name(self, day):
+        name = f"{day}{CONTAINER_SUFFIX}"
+        index = 1
+        while os.path.exists(os.path.join(self.archive_root, name)):
+            index += 1
+            name = f"{day}_{index}{CONTAINER_SUFFIX}"
+        return name
+
+    def _pack_day(self, day, names):
+        """把同一天的一批任务打包为一个新容器，返回归档的任务数"""
+        with self.lock:
+            sources = [(name, self._source(name)) for name in names if name in self.history]
+            sources = [(name, source) for name, source in sources if source is not None]
+            if not sources:
+                return 0
+            container = self._container_name(day)
+            path = os.path.join(self.archive_root, container)
+            tmp_path = path + TMP_SUFFIX
+            try:
+                with zipfile.ZipFile(tmp_path, 'w', self.compression, allowZip64=True) as zf:
+                    for name, source in sources:
+                        for file_path, rel_path in _walk_files(source):
+                            if self._stop.is_set():
+                                raise InterruptedError("归档已停止")
+                            info = zipfile.ZipInfo.from_file(file_path, f"{name}/{rel_path}")
+                            info.compress_type = self.compression
+                            with open(file_path, 'rb') as fsrc, zf.open(info, 'w', force_zip64=True) as fdst:
+                                shutil.copyfileobj(fsrc, fdst, self.copy_buffer)
+                            self.archived_bytes += info.file_size
+                os.replace(tmp_path, path)
+            except (OSError, InterruptedError, zipfile.BadZipFile) as e:
+                print(f"打包 {day} 的任务失败: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return 0
+            for name, _ in sources:
+                self.history.set_archive(name, container)
+            # 先保存记录再删除 record 下的文件夹，中途退出时任务仍能从其中一处找到
+            self.manager.save_completed_files()
+            for _, source in sources:
+                shutil.rmtree(source, ignore_errors=True)
+        self._forget_hashes([name for name, _ in sources])
+        print(f"已将 {len(sources)} 个任务打包到 {path}")
+        return len(sources)
+
+    def resolve(self, filename):
+        """
+        返回任务视频所在位置
+
+        返回:
+        tuple: (路径, 容器内前缀)；在 record 下或归档为文件夹时前缀为 None，
+               打包时路径为容器文件、前缀为 '<任务名>/'；没有记录时返回 (record 下的路径, None)
+        """
+        location = self.history.archive_location(filename)
+        if location is None:
+            return os.path.join(self.record_root, filename), None
+        path = os.path.join(self.archive_root, *location.split('/'))
+        if location.endswith(CONTAINER_SUFFIX):
+            return path, f"{filename}/"
+        return path, None
+
+    def delete(self, filename):
+        """
+        删除已归档任务的视频（调用方持有 lock），任务未归档或文件不存在时返回 False
+
+        打包保存的任务需要重写所在容器（不含该任务的文件），容器中没有其他任务时直接删除容器。
+        """
+        path, prefix = self.resolve(filename)
+        if self.history.archive_location(filename) is None or not os.path.exists(path):
+            return False
+        if prefix is None:
+            shutil.rmtree(path)
+            return True
+
+        tmp_path = path + TMP_SUFFIX
+        kept = 0
+        try:
+            with zipfile.ZipFile(path) as src, zipfile.ZipFile(tmp_path, 'w', allowZip64=True) as dst:
+                for info in src.infolist():
+                    if info.filename.startswith(prefix):
+                        continue
+                    with src.open(info) as fsrc, dst.open(info, 'w', force_zip64=True) as fdst:
+                        shutil.copyfileobj(fsrc, fdst, self.copy_buffer)
+                    kept += 1
+            if kept:
+                os.replace(tmp_path, path)
+            else:
+                os.remove(tmp_path)
+                os.remove(path)
+        except (OSError, zipfile.BadZipFile):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
@@ -0,0 +1,43 @@
+"""带宽分配：最大最小公平（water-fill）与全局 / 单设备预算"""
+import pytest
+
+import bandwidth
+from bandwidth import BandwidthGovernor, _water_fill
+
+
+def test_water_fill_equal_shares():
+    assert _water_fill(900, {'a': None, 'b': None, 'c': None}) == {'a': 300, 'b': 300, 'c': 300}
+
+
+def test_water_fill_redistributes_small_demands():
+    shares = _water_fill(1000, {'a': 100, 'b': None, 'c': None})
+    assert shares['a'] == 100
+    assert shares['b'] == pytest.approx(450)
+    assert shares['c'] == pytest.approx(450)
+
+
+def test_water_fill_all_satisfied():
+    assert _water_fill(1000, {'a': 100, 'b': 200}) == {'a': 100, 'b': 200}
+
+
+def test_water_fill_empty():
+    assert _water_fill(1000, {}) == {}
+
+
+def test_governor_device_then_global_budget(monkeypatch):
+    monkeypatch.setattr(bandwidth, 'WARMUP_SECONDS', 0)
+    governor = BandwidthGovernor(global_kbps=3000, device_kbps=1000)
+    for key, device in (('a1', 'A'), ('a2', 'A'), ('b1', 'B')):
+        governor.register(key, device)
+    with governor._lock:
+        shares = governor._allocate()
+    # 设备 A 的两个传输平分 1000，设备 B 受单设备上限 1000 约束
+    assert shares['a1'] == pytest.approx(500)
+    assert shares['a2'] == pytest.approx(500)
+    assert shares['b1'] == pytest.approx(1000)
+
+
+def test_governor_unlimited_returns_no_limit():
+    governor = BandwidthGovernor()
+    governor.register('a', 'A')
+    assert governor.report('a', 0) is None
@@ -0,0 +1,76 @@
+"""已完成任务记录：分页查询、可归档任务筛选与时间无效记录的保留"""
+import json
+from datetime import datetime
+
+from history_store import TIME_FORMAT, CompletedHistory
+
+T = 1_700_000_000
+
+
+def make_history():
+    history = CompletedHistory()
+    # 完成时间依次递增，触发时间倒序
+    for i in range(10):
+        history.add(f"task{i:02d}", [33, 34], T + i * 60, T - i * 60)
+    return history
+
+
+def names(records):
+    return [record['filename'] for record in records]
+
+
+def test_query_orders_and_pages():
+    history = make_history()
+    total, page = history.query(limit=3)
+    assert total == 10
+    assert names(page) == ['task09', 'task08', 'task07']
+
+    total, page = history.query(order='filename', descending=False, offset=8, limit=5)
+    assert names(page) == ['task08', 'task09']
+
+    total, page = history.query(order='trigger_time', descending=False, limit=2)
+    assert names(page) == ['task09', 'task08']
+
+
+def test_query_filters():
+    history = make_history()
+    total, page = history.query(start=T + 120, end=T + 300, descending=False)
+    assert total == 3
+    assert names(page) == ['task02', 'task03', 'task04']
+
+    history.add("other", [33], T + 150)
+    total, page = history.query(prefix='task0', start=T + 120, end=T + 300)
+    assert total == 3
+
+    total, page = history.query(prefix='task', time_field='trigger_time', start=T - 120, order='filename',
+                                descending=False)
+    assert names(page) == ['task00', 'task01', 'task02']
+
+
+def test_select_archivable_skips_archived():
+    history = make_history()
+    assert [name for name, _ in history.select_archivable(T + 180)] == ['task00', 'task01', 'task02']
+
+    history.set_archive('task01', '2023-11-14/task01')
+    selected = history.select_archivable(T + 180, limit=2)
+    assert selected == [('task00', T), ('task02', T + 120)]
+
+
+def test_records_with_invalid_time_are_kept(tmp_path):
+    path = tmp_path / "completed_files.json"
+    path.write_text(json.dumps([
+        {'filename': '20240101120000_a', 'channels': [33], 'completion_time': '2024-01-01 12:10:00'},
+        {'filename': 'b', 'channels': [33], 'completion_time': 'bad'},
+    ]), encoding='utf-8')
+
+    history = CompletedHistory(str(path))
+    assert len(history) == 2
+    # 旧记录没有触发时间时取任务名中的时间
+    assert history.get('20240101120000_a')['trigger_time'] == '2024-01-01 12:00:00'
+    # 时间无效的记录不参与时间筛选和归档，但保存时写回原值
+    assert history.query(start=0)[0] == 1
+    completed_at = int(datetime.strptime('2024-01-01 12:10:00', TIME_FORMAT).timestamp())
+    assert history.select_archivable(T * 2) == [('20240101120000_a', completed_at)]
+    history.save()
+    saved = json.loads(path.read_text(encoding='utf-8'))
+    assert saved[1]['completion_time'] == 'bad'
@@ -0,0 +1,101 @@
+"""用模拟码流驱动预录缓冲：缓冲范围内截取、超出范围、复制期间固定片段"""
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+import prerecord_buffer
+from prerecord_buffer import PrerecordBuffer, SimulatedStreamSource
+
+CHANNEL = 33
+
+
+@pytest.fixture
+def buffer(tmp_path):
+    buf = PrerecordBuffer(SimulatedStreamSource(kbps=64, interval=0.05), [CHANNEL], str(tmp_path / "prerecord"),
+                          minutes=10, segment_seconds=1)
+    buf.start()
+    # 等待至少 3 个完整片段
+    deadline = time.time() + 10
+    while len(buf.channels[CHANNEL].segments) < 3 and time.time() < deadline:
+        time.sleep(0.1)
+    yield buf
+    buf.stop()
+
+
+def _frames(path, source):
+    """读取截取结果中各数据块的 (通道号, 毫秒时间戳)"""
+    header = SimulatedStreamSource.FRAME_HEADER
+    size = max(header.size, int(source.kbps * 1000 / 8 * source.interval))
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert len(data) % size == 0
+    frames = []
+    for offset in range(0, len(data), size):
+        magic, channel, ts = header.unpack_from(data, offset)
+        assert magic == b'SIMF'
+        frames.append((channel, ts))
+    return frames
+
+
+def test_cut_inside_window(buffer, tmp_path):
+    segments = list(buffer.channels[CHANNEL].segments)
+    assert len(segments) >= 3
+    start, end = segments[0][0], segments[2][1]
+    save_path = str(tmp_path / "clip.mp4")
+
+    assert buffer.cut(CHANNEL, datetime.fromtimestamp(start), datetime.fromtimestamp(end), save_path)
+
+    frames = _frames(save_path, buffer.source)
+    assert frames
+    assert all(channel == CHANNEL for channel, _ in frames)
+    timestamps = [ts for _, ts in frames]
+    assert timestamps == sorted(timestamps)
+    assert timestamps[0] >= start * 1000 - 100 and timestamps[-1] <= end * 1000 + 100
+    assert not os.path.exists(save_path + '.tmp')
+
+
+def test_cut_older_than_window(buffer, tmp_path):
+    oldest = buffer.channels[CHANNEL].segments[0][0]
+    save_path = str(tmp_path / "old.mp4")
+
+    assert not buffer.covers(CHANNEL, oldest - 3600, oldest - 3000)
+    assert not buffer.cut(CHANNEL, datetime.fromtimestamp(oldest - 3600),
+                          datetime.fromtimestamp(oldest - 3000), save_path)
+    assert not os.path.exists(save_path)
+
+
+def test_cut_pins_segments_during_copy(buffer, tmp_path, monkeypatch):
+    channel_buffer = buffer.channels[CHANNEL]
+    segments = list(channel_buffer.segments[:2])
+    start, end = segments[0][0], segments[-1][1]
+    observed = {}
+    copy = prerecord_buffer.shutil.copyfileobj
+
+    def copy_and_prune(fsrc, fdst, length):
+        if not observed:
+            # 复制在锁外进行：清理线程此时可以拿到锁，但不能删除被固定的片段
+            observed['lock_free'] = channel_buffer.lock.acquire(blocking=False)
+            if observed['lock_free']:
+                try:
+                    buffer._prune(channel_buffer, time.time() + 86400)
+                finally:
+                    channel_buffer.lock.release()
+            observed['kept'] = all(os.path.exists(path) for _, _, path in segments)
+            observed['pinned'] = dict(channel_buffer.pinned)
+        copy(fsrc, fdst, length)
+
+    monkeypatch.setattr(prerecord_buffer.shutil, 'copyfileobj', copy_and_prune)
+
+    assert buffer.cut(CHANNEL, datetime.fromtimestamp(start), datetime.fromtimestamp(end),
+                      str(tmp_path / "pinned.mp4"))
+    assert observed['lock_free']
+    assert observed['kept']
+    assert segments[0][2] in observed['pinned']
+    assert channel_buffer.pinned == {}
+
+    # 截取结束后固定解除，过期片段可以正常清理
+    with channel_buffer.lock:
+        buffer._prune(channel_buffer, time.time() + 86400)
+    assert not os.path.exists(segments[0][2])
@@ -0,0 +1,70 @@
+"""录像分布索引：待查询范围、录像段合并与持久化"""
+import time
+
+from record_index import RecordIndex
+
+# 足够早的整点时间，不受 live_margin 与当前时间截断影响
+T = 1_700_000_000 // 3600 * 3600
+
+
+def make_index(tmp_path, **kwargs):
+    kwargs.setdefault('retention_days', None)
+    return RecordIndex(str(tmp_path / "record_index.json"), **kwargs)
+
+
+def test_missing_aligns_and_skips_covered(tmp_path):
+    index = make_index(tmp_path)
+    assert index.missing(1, T + 100, T + 200) == [(T, T + 3600)]
+
+    index.update(1, T, T + 3600, [(T, T + 3600)])
+    assert index.missing(1, T + 100, T + 200) == []
+    assert index.missing(1, T + 100, T + 3700) == [(T + 3600, T + 7200)]
+    # 其他通道互不影响
+    assert index.missing(2, T + 100, T + 200) == [(T, T + 3600)]
+
+
+def test_missing_clamps_to_now(tmp_path):
+    index = make_index(tmp_path)
+    now = time.time()
+    ranges = index.missing(1, now - 60, now + 7200)
+    assert ranges
+    assert ranges[-1][1] <= int(time.time())
+
+
+def test_live_margin_not_covered(tmp_path):
+    index = make_index(tmp_path, live_margin=600)
+    now = int(time.time())
+    index.update(1, now - 3600, now, [(now - 3600, now)])
+    assert not index.is_covered(1, now - 300, now)
+    assert index.is_covered(1, now - 3600, now - 700)
+
+
+def test_footage_merges_file_boundaries(tmp_path):
+    index = make_index(tmp_path)
+    # NVR 按文件保存录像，相邻文件之间约 1 秒间隔
+    index.update(1, T, T + 3600, [(T, T + 1800), (T + 1801, T + 3600)])
+    assert index.footage(1, T + 100, T + 3000) == [(T + 100, T + 3000)]
+
+
+def test_footage_keeps_real_gaps(tmp_path):
+    index = make_index(tmp_path)
+    index.update(1, T, T + 3600, [(T, T + 1200), (T + 1800, T + 3600)])
+    assert index.footage(1, T, T + 3600) == [(T, T + 1200), (T + 1800, T + 3600)]
+    assert index.footage(1, T + 1300, T + 1700) == []
+
+
+def test_update_replaces_previous_result(tmp_path):
+    index = make_index(tmp_path)
+    index.update(1, T, T + 3600, [(T, T + 3600)])
+    index.update(1, T + 1200, T + 2400, [])
+    assert index.footage(1, T, T + 3600) == [(T, T + 1200), (T + 2400, T + 3600)]
+
+
+def test_save_and_load(tmp_path):
+    index = make_index(tmp_path)
+    index.update(1, T, T + 3600, [(T, T + 1800)])
+    index.save()
+
+    loaded = make_index(tmp_path)
+    assert loaded.footage(1, T, T + 3600) == [(T, T + 1800)]
+    assert loaded.missing(1, T, T + 3600) == []
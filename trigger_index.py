@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+
+class TriggerIndex:
+    """
+    已处理触发文件的持久化索引
+
+    以 (文件名, 创建时间) 作为键，记录已经发出过下载任务的触发文件，
+    程序重启后只需处理新出现的文件，而不是整个监控目录的历史文件。
+    键中不含文件大小：监控事件触发时文件可能仍在写入（大小为 0），
+    写完后大小变化不应被当作新的触发文件。
+    """
+
+    def __init__(self, index_path="data/trigger_index.json", retention_days=30,
+                 archive_dir=None):
+        """
+        参数:
+        index_path (str): 索引文件路径
+        retention_days (int): 触发文件保留天数，配合 archive_dir 使用；为 None 时不归档
+        archive_dir (str): 归档目录，设置后会把超过保留天数的触发文件移出监控目录
+        """
+        self.index_path = index_path
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.entries = {}  # key -> 处理时间（epoch 秒）
+        self._dirty = False
+        # 监控线程与界面线程（停止监控时）都会保存索引，两者共用同一个临时文件
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def make_key(filename, ctime):
+        """生成索引键，ctime 取整到秒以避免不同文件系统的精度差异"""
+        return f"{filename}|{int(ctime)}"
+
+    @classmethod
+    def key_for_entry(cls, entry):
+        """根据 os.DirEntry 生成索引键（Windows 上 stat 结果已随目录项缓存）"""
+        return cls.make_key(entry.name, entry.stat().st_ctime)
+
+    def load(self):
+        """从磁盘加载索引"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = {}
+            for key, processed_at in data.get('entries', {}).items():
+                # 旧版本的键为 文件名|大小|创建时间，去掉大小后合并
+                parts = key.rsplit('|', 2)
+                if len(parts) == 3:
+                    key = f"{parts[0]}|{parts[2]}"
+                    self._dirty = True
+                self.entries[key] = max(processed_at, self.entries.get(key, 0))
+            print(f"加载了 {len(self.entries)} 条触发文件索引")
+        except Exception as e:
+            print(f"加载触发文件索引失败: {e}")
+            self.entries = {}
+
+    def save(self):
+        """保存索引到磁盘（先写临时文件再替换，避免中途退出导致索引损坏）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                index_dir = os.path.dirname(self.index_path)
+                if index_dir and not os.path.exists(index_dir):
+                    os.makedirs(index_dir)
+                tmp_path = self.index_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'entries': self.entries}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.index_path)
+                self._dirty = False
+            except Exception as e:
+                print(f"保存触发文件索引失败: {e}")
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key):
+        """记录一个已处理的触发文件"""
+        with self._lock:
+            self.entries[key] = int(time.time())
+            self._dirty = True
+
+    def prune(self, folder_path, present_names):
+        """
+        清理索引
+
+        - 对应文件已不在监控目录中的记录直接移除；
+        - 超过保留天数的记录，若配置了归档目录，把触发文件移动到
+          归档目录/<处理日期>/ 下并移除记录。未配置归档目录时保留记录，
+          以免仍在目录中的旧文件在下次启动时被重新处理。
+
+        参数:
+        folder_path (str): 监控目录
+        present_names (set): 监控目录中当前存在的文件名
+
+        返回:
+        int: 移除的记录数量
+        """
+        cutoff = None
+        if self.retention_days is not None:
+            cutoff = time.time() - self.retention_days * 86400
+
+        removed = 0
+        with self._lock:
+            for key, processed_at in list(self.entries.items()):
+                filename = key.rsplit('|', 1)[0]
+                if filename not in present_names:
+                    del self.entries[key]
+                    removed += 1
+                elif (cutoff is not None and processed_at < cutoff and self.archive_dir
+                        and self._archive_file(folder_path, filename, processed_at)):
+                    del self.entries[key]
+                    removed += 1
+            if removed:
+                self._dirty = True
+
+        if removed:
+            print(f"清理了 {removed} 条触发文件索引")
+        return removed
+
+    def _archive_file(self, folder_path, filename, processed_at):
+        """把触发文件移动到归档目录，返回是否成功"""
+        src = os.path.join(folder_path, filename)
+        if not os.path.exists(src):
+            return True
+        try:
+            day = datetime.fromtimestamp(processed_at).strftime('%Y%m%d')
+            dst_dir = os.path.join(self.archive_dir, day)
+            if not os.path.exists(dst_dir):
+                os.makedirs(dst_dir)
+            shutil.move(src, os.path.join(dst_dir, filename))
+            return True
+        except Exception as e:
+            print(f"归档触发文件 {filename} 失败: {e}")
+            return False
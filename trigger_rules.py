@@ -0,0 +1,183 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+# 未配置通道时使用的默认通道
+DEFAULT_CHANNELS = [33, 34, 35, 36]
+
+# 没有配置文件时的内置规则：与早期版本一致，取触发文件创建时间前 6 分钟
+DEFAULT_RULES = {
+    'default_channels': DEFAULT_CHANNELS,
+    'rules': [
+        {
+            'name': 'default',
+            'match': '.*',
+            'time_source': 'ctime',
+            'pre_roll': 360,
+            'post_roll': 0,
+        }
+    ]
+}
+
+# 读取触发文件内容时的最大字节数
+MAX_CONTENT_BYTES = 64 * 1024
+
+
+class TriggerRule:
+    """
+    单条触发规则
+
+    配置字段:
+    name (str): 规则名称
+    match (str): 匹配任务名（不含扩展名）的正则，可包含命名分组 ts / channels
+    content_pattern (str): 匹配触发文件内容的正则，可包含命名分组 ts / channels
+    time_source (str): 触发时间来源，name / content / ctime
+    time_format (str): ts 分组的时间格式，默认 %Y%m%d%H%M%S
+    pre_roll (int): 触发时间之前需要下载的秒数
+    post_roll (int): 触发时间之后需要下载的秒数
+    channels (list): 允许下载的通道；从文件名或内容解析出通道时取两者交集
+    """
+
+    def __init__(self, config, default_channels):
+        self.name = config.get('name', 'unnamed')
+        self.match = re.compile(config.get('match', '.*'))
+        content_pattern = config.get('content_pattern')
+        self.content_pattern = re.compile(content_pattern) if content_pattern else None
+        self.time_source = config.get('time_source', 'ctime')
+        self.time_format = config.get('time_format', '%Y%m%d%H%M%S')
+        self.pre_roll = timedelta(seconds=config.get('pre_roll', 360))
+        self.post_roll = timedelta(seconds=config.get('post_roll', 0))
+        self.channels = list(config.get('channels') or default_channels)
+
+        if self.time_source not in ('name', 'content', 'ctime'):
+            raise ValueError(f"规则 {self.name} 的 time_source 无效: {self.time_source}")
+        if self.time_source == 'content' and self.content_pattern is None:
+            raise ValueError(f"规则 {self.name} 使用 content 时间来源但未配置 content_pattern")
+
+    @property
+    def needs_content(self):
+        return self.content_pattern is not None
+
+    def apply(self, task_name, content, ctime):
+        """
+        按规则计算下载任务
+
+        返回:
+        dict: 包含 filename / start_time / end_time / channels / trigger_time；规则不适用时返回 None
+        """
+        name_match = self.match.search(task_name)
+        if name_match is None:
+            return None
+
+        content_match = None
+        if self.content_pattern is not None:
+            content_match = self.content_pattern.search(content or '')
+            if content_match is None:
+                return None
+
+        if self.time_source == 'ctime':
+            trigger_time = datetime.fromtimestamp(ctime)
+        else:
+            source = name_match if self.time_source == 'name' else content_match
+            ts = _group(source, 'ts')
+            if ts is None:
+                return None
+            try:
+                trigger_time = datetime.strptime(ts, self.time_format)
+            except ValueError:
+                return None
+
+        channels = self.channels
+        parsed = _group(content_match, 'channels') or _group(name_match, 'channels')
+        if parsed:
+            wanted = {int(ch) for ch in re.findall(r'\d+', parsed)}
+            channels = [ch for ch in self.channels if ch in wanted]
+            if not channels:
+                return None
+
+        return {
+            'filename': task_name,
+            'start_time': trigger_time - self.pre_roll,
+            'end_time': trigger_time + self.post_roll,
+            'channels': channels,
+            'trigger_time': trigger_time,
+            'rule': self.name,
+        }
+
+
+def _group(match, name):
+    """安全地获取命名分组"""
+    if match is None or name not in match.re.groupindex:
+        return None
+    return match.group(name)
+
+
+class TriggerRules:
+    """
+    触发文件 → 下载时间段 的规则引擎
+
+    规则按配置顺序依次尝试，第一条能够解析的规则生效。
+    """
+
+    def __init__(self, config=None):
+        config = config or DEFAULT_RULES
+        self.default_channels = list(config.get('default_channels', DEFAULT_CHANNELS))
+        self.rules = [TriggerRule(rule, self.default_channels) for rule in config.get('rules', [])]
+        if not self.rules:
+            raise ValueError("触发规则配置中没有任何规则")
+        self.needs_content = any(rule.needs_content for rule in self.rules)
+
+    @classmethod
+    def load(cls, path="config/trigger_rules.json"):
+        """从配置文件加载规则，文件不存在或无效时使用内置规则"""
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    rules = cls(json.load(f))
+                print(f"从 {path} 加载了 {len(rules.rules)} 条触发规则")
+                return rules
+            except Exception as e:
+                print(f"加载触发规则失败，使用内置规则: {e}")
+        return cls()
+
+    def resolve(self, file_path, ctime=None):
+        """
+        解析触发文件
+
+        参数:
+        file_path (str): 触发文件路径
+        ctime (float): 文件创建时间，未提供时从文件系统读取
+
+        返回:
+        dict: 任务信息；没有规则适用时返回 None
+        """
+        task_name = os.path.splitext(os.path.basename(file_path))[0]
+        if ctime is None:
+            ctime = os.path.getctime(file_path)
+
+        content = None
+        if self.needs_content:
+            content = _read_content(file_path)
+
+        for rule in self.rules:
+            file_info = rule.apply(task_name, content, ctime)
+            if file_info is not None:
+                return file_info
+        return None
+
+
+def _read_content(file_path):
+    """读取触发文件内容（兼容 UTF-8 与 GBK 编码）"""
+    try:
+        with open(file_path, 'rb') as f:
+            raw = f.read(MAX_CONTENT_BYTES)
+    except OSError as e:
+        print(f"读取触发文件 {file_path} 失败: {e}")
+        return ''
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode('utf-8', errors='ignore')
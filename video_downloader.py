@@ -1,36 +1,68 @@
 import os
 import time
-from ctypes import *
+from ctypes import byref
 from datetime import datetime
-import platform
-from HCNetSDK import *
+import json
+import threading
+from sdk_binding import (load_sdk, HCNetSDKError, NET_DVR_TIME, NET_DVR_DEVICEINFO_V30,
+                         NET_DVR_FILECOND, NET_DVR_FINDDATA_V30, NET_DVR_FILE_SUCCESS,
+                         NET_DVR_FILE_NOFIND, NET_DVR_ISFINDING, NET_DVR_NOMOREFILE,
+                         NET_DVR_PLAYSTART, NET_DVR_SETSPEED)
+
+# 未完成下载的标记文件后缀，存在标记时视频文件不完整，需要重新下载
+PARTIAL_SUFFIX = ".partial"
+
+
+def _to_dvr_time(value):
+    """datetime 转换为 NET_DVR_TIME"""
+    return NET_DVR_TIME(
+        dwYear=value.year,
+        dwMonth=value.month,
+        dwDay=value.day,
+        dwHour=value.hour,
+        dwMinute=value.minute,
+        dwSecond=value.second
+    )
+
+
+def clip_filename(lChannel, start_time, end_time):
+    """视频文件名：<通道号>_<日期>_<开始时分秒>_<结束时分秒>.mp4"""
+    return "{}_{}_{}.mp4".format(lChannel, start_time.strftime('%Y%m%d_%H%M%S'), end_time.strftime('%H%M%S'))
+
+
+def _from_dvr_time(value):
+    """NET_DVR_TIME 转换为 datetime"""
+    return datetime(value.dwYear, value.dwMonth, value.dwDay,
+                    value.dwHour, value.dwMinute, value.dwSecond)
 
 
 class VideoDownloader:
-    def __init__(self, device_ip='10.200.115.81', device_port=8000, username='admin', password='1234asdf'):
+    def __init__(self, device_ip='10.200.115.81', device_port=8000, username='admin', password='1234asdf',
+                 record_index=None, governor=None, tracer=None):
         # 配置海康威视SDK路径和DLL文件名称
         self.SDK_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), './HCNetSDK'))
         self.DLL_NAME = "HCNetSDK.dll"
 
-        # 检查SDK文件夹是否存在
-        if not os.path.exists(self.SDK_PATH):
-            raise FileNotFoundError(f"HCNetSDK文件夹不存在: {self.SDK_PATH}")
-
-        # 检查DLL文件是否存在
-        dll_path = os.path.join(self.SDK_PATH, self.DLL_NAME)
-        if not os.path.exists(dll_path):
-            raise FileNotFoundError(f"HCNetSDK.dll文件不存在: {dll_path}")
-
         # 设备登录信息
-        self.device_ip = create_string_buffer(device_ip.encode())
-        self.device_port = c_ushort(device_port)
-        self.username = create_string_buffer(username.encode())
-        self.password = create_string_buffer(password.encode())
+        self.device_ip = device_ip.encode()
+        self.device_port = device_port
+        self.username = username.encode()
+        self.password = password.encode()
+
+        # SDK 调用跟踪（sdk_binding.CallTracer），为 None 时不跟踪
+        self.tracer = tracer
 
         # 用户ID
         self.lUserID = -1
         self.HCNetSDK = None
 
+        # 设备录像分布索引（RecordIndex），为 None 时不查询录像分布直接下载
+        self.record_index = record_index
+
+        # 带宽控制器（BandwidthGovernor），为 None 时不限速
+        self.governor = governor
+        self.device_key = device_ip
+
         # 初始化SDK
         self._init_sdk()
 
@@ -40,84 +72,41 @@ class VideoDownloader:
     def _init_sdk(self):
         """初始化SDK"""
         try:
-            # 确保在Windows系统上运行
-            if platform.system() != "Windows":
-                raise OSError("此模块仅支持Windows系统")
-
-            self.HCNetSDK = windll.LoadLibrary(os.path.join(self.SDK_PATH, self.DLL_NAME))
+            self.HCNetSDK = load_sdk(self.SDK_PATH, self.DLL_NAME, self.tracer)
             print("成功加载DLL文件.")
-
-            # 初始化SDK
-            init_result = self.HCNetSDK.NET_DVR_Init()
-            if init_result == 0:
-                error_code = self.HCNetSDK.NET_DVR_GetLastError()
-                raise Exception(f"初始化SDK失败，错误码：{error_code}")
-
-            # 设置连接超时时间和重连功能
-            self.HCNetSDK.NET_DVR_SetConnectTime(2000, 1)
-            self.HCNetSDK.NET_DVR_SetReconnect(10000, 1)
-
         except OSError as e:
             print("加载DLL文件失败:", e)
             raise
 
+        # 初始化SDK
+        self.HCNetSDK.check('NET_DVR_Init')
+
+        # 设置连接超时时间和重连功能
+        self.HCNetSDK.NET_DVR_SetConnectTime(2000, 1)
+        self.HCNetSDK.NET_DVR_SetReconnect(10000, 1)
+
     def _login_device(self):
         """登录设备"""
-        # 设备信息结构体
-        SERIALNO_LEN = 48
-
-        class NET_DVR_DEVICEINFO_V30(Structure):
-            _fields_ = [
-                ("sSerialNumber", c_byte * SERIALNO_LEN),
-                ("byAlarmInPortNum", c_byte),
-                ("byAlarmOutPortNum", c_byte),
-                ("byDiskNum", c_byte),
-                ("byDVRType", c_byte),
-                ("byChanNum", c_byte),
-                ("byStartChan", c_byte),
-                ("byAudioChanNum", c_byte),
-                ("byIPChanNum", c_byte),
-                ("byZeroChanNum", c_byte),
-                ("byMainProto", c_byte),
-                ("bySubProto", c_byte),
-                ("bySupport", c_byte),
-                ("bySupport1", c_byte),
-                ("bySupport2", c_byte),
-                ("wDevType", c_ushort),
-                ("bySupport3", c_byte),
-                ("byMultiStreamProto", c_byte),
-                ("byStartDChan", c_byte),
-                ("byStartDTalkChan", c_byte),
-                ("byHighDChanNum", c_byte),
-                ("bySupport4", c_byte),
-                ("byLanguageType", c_byte),
-                ("byVoiceInChanNum", c_byte),
-                ("byStartVoiceInChanNo", c_byte),
-                ("byRes3", c_byte * 2),
-                ("byMirrorChanNum", c_byte),
-                ("wStartMirrorChanNo", c_ushort),
-                ("byRes2", c_byte * 2)
-            ]
-
-        DeviceInfo = NET_DVR_DEVICEINFO_V30()
-        self.lUserID = self.HCNetSDK.NET_DVR_Login_V30(
-            self.device_ip,
-            self.device_port,
-            self.username,
-            self.password,
-            byref(DeviceInfo)
-        )
-
-        # 判断是否登录成功
-        if self.lUserID < 0:
-            error_code = self.HCNetSDK.NET_DVR_GetLastError()
-            print(f"登录设备失败，错误码：{error_code}")
+        self.device_info = NET_DVR_DEVICEINFO_V30()
+        try:
+            self.lUserID = self.HCNetSDK.check_handle(
+                'NET_DVR_Login_V30',
+                self.device_ip,
+                self.device_port,
+                self.username,
+                self.password,
+                byref(self.device_info)
+            )
+        except HCNetSDKError as e:
+            # 判断是否登录成功
+            print(f"登录设备失败: {e}")
             self.HCNetSDK.NET_DVR_Cleanup()
-            raise Exception(f"登录设备失败，错误码：{error_code}")
-        else:
-            print("登录设备成功，用户ID:", self.lUserID)
+            self.HCNetSDK = None
+            raise
+        print("登录设备成功，用户ID:", self.lUserID)
 
-    def download_video(self, lChannel, start_time, end_time, base_save_path="record", filename=None):
+    def download_video(self, lChannel, start_time, end_time, base_save_path="record", filename=None,
+                       cancel_token=None):
         """
         下载指定时间段的视频
 
@@ -127,110 +116,245 @@ class VideoDownloader:
         end_time (datetime): 录像结束时间
         base_save_path (str): 保存文件的基础目录
         filename (str): 文件名，用于创建专属文件夹
+        cancel_token (CancelToken): 取消令牌，取消时立即停止正在进行的下载
 
         返回:
-        bool: 是否下载成功
+        bool: 是否下载成功（被取消时返回 False，视频文件保留未完成标记）
         """
+        if cancel_token is not None and cancel_token.cancelled:
+            return False
+
         # 创建文件专属保存目录
         if filename:
             file_save_path = os.path.join(base_save_path, filename)
         else:
             file_save_path = base_save_path
 
-        if not os.path.exists(file_save_path):
-            os.makedirs(file_save_path)
-
-        # 定义时间结构体
-        class NET_DVR_TIME(Structure):
-            _fields_ = [
-                ("dwYear", c_ulong),
-                ("dwMonth", c_ulong),
-                ("dwDay", c_ulong),
-                ("dwHour", c_ulong),
-                ("dwMinute", c_ulong),
-                ("dwSecond", c_ulong),
-            ]
+        # 多个工作进程可能同时下载同一任务的不同通道
+        os.makedirs(file_save_path, exist_ok=True)
+
+        # 查询设备录像分布，跳过没有录像的时间段
+        if self.record_index is not None:
+            footage = self.available_footage(lChannel, start_time, end_time)
+            if footage is not None:
+                if not footage:
+                    print(f"通道 {lChannel} 在 {start_time} - {end_time} 内没有录像，跳过下载")
+                    return False
+                if len(footage) > 1:
+                    gaps = ", ".join(
+                        f"{datetime.fromtimestamp(prev_end)} - {datetime.fromtimestamp(next_start)}"
+                        for (_, prev_end), (next_start, _) in zip(footage, footage[1:])
+                    )
+                    print(f"通道 {lChannel} 录像存在 {len(footage) - 1} 处中断（{gaps}），下载失败")
+                    return False
+                trimmed_start = datetime.fromtimestamp(footage[0][0])
+                trimmed_end = datetime.fromtimestamp(footage[-1][1])
+                if trimmed_start != start_time or trimmed_end != end_time:
+                    print(f"通道 {lChannel} 下载时间段裁剪为 {trimmed_start} - {trimmed_end}")
+                start_time, end_time = trimmed_start, trimmed_end
 
         # 转换时间
-        start = NET_DVR_TIME(
-            dwYear=start_time.year,
-            dwMonth=start_time.month,
-            dwDay=start_time.day,
-            dwHour=start_time.hour,
-            dwMinute=start_time.minute,
-            dwSecond=start_time.second
-        )
-
-        end = NET_DVR_TIME(
-            dwYear=end_time.year,
-            dwMonth=end_time.month,
-            dwDay=end_time.day,
-            dwHour=end_time.hour,
-            dwMinute=end_time.minute,
-            dwSecond=end_time.second
-        )
+        start = _to_dvr_time(start_time)
+        end = _to_dvr_time(end_time)
 
         # 根据时间生成文件名
-        video_filename = "{}_{}{:02d}{:02d}_{:02d}{:02d}{:02d}_{:02d}{:02d}{:02d}.mp4".format(
-            lChannel,
-            start.dwYear, start.dwMonth, start.dwDay,
-            start.dwHour, start.dwMinute, start.dwSecond,
-            end.dwHour, end.dwMinute, end.dwSecond
-        )
-        save_path = os.path.join(file_save_path, video_filename)
-
-        # 检查文件是否已存在
-        if os.path.exists(save_path):
+        save_path = os.path.join(file_save_path, clip_filename(lChannel, start_time, end_time))
+
+        # 检查文件是否已存在（带未完成标记的文件需要重新下载）
+        marker_path = save_path + PARTIAL_SUFFIX
+        if os.path.exists(marker_path):
+            print(f"发现未完成的下载，重新下载: {save_path}")
+            for path in (save_path, marker_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        elif os.path.exists(save_path):
             print(f"文件已存在，跳过下载: {save_path}")
             return True
 
-        # 转换保存路径为适合C接口的字符串格式
-        sSavedFileName = create_string_buffer(save_path.encode('utf-8'))
+        # 写入未完成标记，下载完成后删除；中途取消或程序退出时据此重新下载
+        with open(marker_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'channel': lChannel,
+                'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                'end_time': end_time.strftime('%Y-%m-%d %H:%M:%S'),
+            }, f, ensure_ascii=False)
 
         # 调用接口下载录像
-        download_handle = self.HCNetSDK.NET_DVR_GetFileByTime(
-            self.lUserID,
-            lChannel,
-            byref(start),
-            byref(end),
-            sSavedFileName
-        )
-
-        if download_handle < 0:
-            error_code = self.HCNetSDK.NET_DVR_GetLastError()
-            print(f"下载录像失败，错误码：{error_code}")
+        try:
+            download_handle = self.HCNetSDK.check_handle(
+                'NET_DVR_GetFileByTime',
+                self.lUserID,
+                lChannel,
+                byref(start),
+                byref(end),
+                save_path.encode('utf-8')
+            )
+        except HCNetSDKError as e:
+            print(f"下载录像失败: {e}")
             return False
 
         # 开始下载
-        NET_DVR_PLAYSTART = 1
-        if not self.HCNetSDK.NET_DVR_PlayBackControl(download_handle, NET_DVR_PLAYSTART, 0, None):
-            error_code = self.HCNetSDK.NET_DVR_GetLastError()
-            print(f"启动下载失败，错误码：{error_code}")
+        try:
+            self.HCNetSDK.check('NET_DVR_PlayBackControl', download_handle, NET_DVR_PLAYSTART, 0, None)
+        except HCNetSDKError as e:
+            print(f"启动下载失败: {e}")
             self.HCNetSDK.NET_DVR_StopGetFile(download_handle)
             return False
 
-        # 检查下载进度
-        status = 0
-        while status != 100 and status != -1:
-            status = self.HCNetSDK.NET_DVR_GetDownloadPos(download_handle)
-            print(f"下载进度: {status}%")
-            time.sleep(1)
+        # 取消时由调用 cancel() 的线程立即停止下载句柄
+        stop_handle = self._handle_stopper(self.HCNetSDK, download_handle)
+        unregister = cancel_token.register(stop_handle) if cancel_token is not None else None
 
-        # 关闭下载句柄
-        self.HCNetSDK.NET_DVR_StopGetFile(download_handle)
+        # 检查下载进度
+        transfer_key = (self.device_key, lChannel, download_handle)
+        if self.governor is not None:
+            self.governor.register(transfer_key, self.device_key)
+        try:
+            status = 0
+            while status != 100 and status != -1:
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
+                status = self.HCNetSDK.NET_DVR_GetDownloadPos(download_handle)
+                print(f"下载进度: {status}%")
+                if self.governor is not None:
+                    self._apply_speed_limit(download_handle, transfer_key, save_path)
+                if cancel_token is not None:
+                    cancel_token.wait(1)
+                else:
+                    time.sleep(1)
+        finally:
+            if self.governor is not None:
+                self.governor.unregister(transfer_key)
+            if unregister is not None:
+                unregister()
+            # 关闭下载句柄
+            stop_handle()
+
+        if cancel_token is not None and cancel_token.cancelled:
+            print(f"下载已取消，保留未完成标记: {save_path}")
+            return False
 
         if status == 100:
+            os.remove(marker_path)
             print(f"下载完成: {save_path}")
             return True
         else:
-            error_code = self.HCNetSDK.NET_DVR_GetLastError()
-            print(f"下载失败，错误码：{error_code}")
+            print(f"下载失败: {self.HCNetSDK.error('NET_DVR_GetDownloadPos')}")
             return False
 
+    @staticmethod
+    def _handle_stopper(sdk, download_handle):
+        """返回只会调用一次 NET_DVR_StopGetFile 的函数（可能由界面线程和下载线程同时调用）"""
+        lock = threading.Lock()
+        stopped = [False]
+
+        def stop():
+            with lock:
+                if stopped[0]:
+                    return
+                stopped[0] = True
+            sdk.NET_DVR_StopGetFile(download_handle)
+
+        return stop
+
+    def _apply_speed_limit(self, download_handle, transfer_key, save_path):
+        """按下载文件的增长量上报速率，并按带宽控制器的分配调整下载速度"""
+        try:
+            downloaded = os.path.getsize(save_path)
+        except OSError:
+            downloaded = 0
+        speed = self.governor.report(transfer_key, downloaded)
+        if speed is None:
+            return
+        try:
+            self.HCNetSDK.check('NET_DVR_PlayBackControl', download_handle, NET_DVR_SETSPEED, speed, None)
+            print(f"通道 {transfer_key[1]} 下载速度调整为 {speed} kbps")
+        except HCNetSDKError as e:
+            print(f"调整下载速度失败: {e}")
+
+    def available_footage(self, lChannel, start_time, end_time):
+        """
+        获取时间段内设备上实际存在的录像段
+
+        先查询录像索引中尚未覆盖的范围并写入索引，再从索引中取结果。
+
+        返回:
+        list: [(start_epoch, end_epoch), ...]；查询失败时返回 None
+        """
+        start_ts = start_time.timestamp()
+        end_ts = end_time.timestamp()
+        try:
+            missing = self.record_index.missing(lChannel, start_ts, end_ts)
+            for query_start, query_end in missing:
+                segments = self.search_recordings(
+                    lChannel,
+                    datetime.fromtimestamp(query_start),
+                    datetime.fromtimestamp(query_end)
+                )
+                self.record_index.update(lChannel, query_start, query_end, segments)
+            if missing:
+                self.record_index.save()
+        except Exception as e:
+            print(f"查询通道 {lChannel} 录像分布失败，直接下载: {e}")
+            return None
+        return self.record_index.footage(lChannel, start_ts, end_ts)
+
+    def search_recordings(self, lChannel, start_time, end_time, timeout=30):
+        """
+        通过 SDK 文件查找接口查询设备上的录像段
+
+        返回:
+        list: [(start_epoch, end_epoch), ...]
+        """
+        cond = NET_DVR_FILECOND(
+            lChannel=lChannel,
+            dwFileType=0xff,  # 全部类型
+            dwIsLocked=0xff,  # 全部文件
+            dwUseCardNo=0,
+            struStartTime=_to_dvr_time(start_time),
+            struStopTime=_to_dvr_time(end_time)
+        )
+        find_handle = self.HCNetSDK.check_handle('NET_DVR_FindFile_V30', self.lUserID, byref(cond))
+
+        segments = []
+        deadline = time.time() + timeout
+        try:
+            find_data = NET_DVR_FINDDATA_V30()
+            while True:
+                result = self.HCNetSDK.NET_DVR_FindNextFile_V30(find_handle, byref(find_data))
+                if result == NET_DVR_FILE_SUCCESS:
+                    segments.append((
+                        _from_dvr_time(find_data.struStartTime).timestamp(),
+                        _from_dvr_time(find_data.struStopTime).timestamp()
+                    ))
+                elif result == NET_DVR_ISFINDING:
+                    if time.time() > deadline:
+                        raise Exception("查找录像文件超时")
+                    time.sleep(0.05)
+                elif result in (NET_DVR_FILE_NOFIND, NET_DVR_NOMOREFILE):
+                    break
+                else:
+                    raise self.HCNetSDK.error('NET_DVR_FindNextFile_V30')
+        finally:
+            self.HCNetSDK.NET_DVR_FindClose_V30(find_handle)
+
+        print(f"通道 {lChannel} 在 {start_time} - {end_time} 内找到 {len(segments)} 个录像段")
+        return segments
+
+    def close(self):
+        """注销设备并释放SDK资源，可重复调用"""
+        sdk = getattr(self, 'HCNetSDK', None)
+        if sdk is None:
+            return
+        if self.lUserID >= 0:
+            sdk.NET_DVR_Logout(self.lUserID)
+            self.lUserID = -1
+        sdk.NET_DVR_Cleanup()
+        self.HCNetSDK = None
+        if self.tracer is not None:
+            print(self.tracer.report())
+        print("已释放海康威视SDK资源")
+
     def __del__(self):
-        """析构函数，释放资源"""
-        if hasattr(self, 'lUserID') and self.lUserID >= 0:
-            self.HCNetSDK.NET_DVR_Logout(self.lUserID)
-        if hasattr(self, 'HCNetSDK'):
-            self.HCNetSDK.NET_DVR_Cleanup()
-        print("已释放海康威视SDK资源") 
\ No newline at end of file
+        """析构函数，释放资源（正常退出时应显式调用 close）"""
+        self.close() 
\ No newline at end of file
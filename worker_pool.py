@@ -0,0 +1,484 @@
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+from bandwidth import BandwidthGovernor
+
+# 等待子进程消息的最长时间（秒），同时也是健康检查的周期
+POLL_SECONDS = 0.5
+# 协调线程按每个工作进程预取的子任务数（含正在执行的）从 DownloadManager 取任务，其余任务留在其队列中
+PREFETCH_PER_WORKER = 2
+# 工作进程启动失败或崩溃后重新启动的等待时间（秒），按失败次数指数增长
+RESPAWN_BASE_SECONDS = 2
+RESPAWN_MAX_SECONDS = 60
+# 与单进程模式一致：每个通道下载完成后等待一小段时间再开始下一个
+CHANNEL_GAP_SECONDS = 2
+
+
+def worker_main(worker_id, conn, options):
+    """
+    工作进程入口
+
+    每个工作进程独立加载 SDK 并登录设备，按协调进程发来的子任务依次下载各通道。
+    读取线程负责接收任务 / 取消 / 停止命令，心跳线程定时发送心跳；下载在主线程中进行，
+    取消时通过 CancelToken 立即停止正在进行的传输。协调进程退出（管道关闭）时工作进程随之退出。
+    """
+    from cancellation import CancelToken
+    from bandwidth import RemoteGovernor
+
+    send_lock = threading.Lock()
+    stop_event = threading.Event()
+    jobs = queue.Queue()
+    tokens = {}  # 子任务 ID -> CancelToken
+
+    def send(*message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, EOFError, ValueError):
+                stop_event.set()
+
+    def heartbeat():
+        while not stop_event.wait(options['heartbeat_seconds']):
+            send('heartbeat', worker_id)
+
+    def reader():
+        while True:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                message = ('stop',)
+            kind = message[0]
+            if kind == 'job':
+                job = message[1]
+                # 先创建令牌再排队，保证紧随其后的取消命令不会丢失
+                tokens[job['id']] = CancelToken()
+                jobs.put(job)
+            elif kind == 'rate':
+                if governor is not None:
+                    governor.set_rate(message[1], message[2])
+            elif kind == 'cancel':
+                token = tokens.get(message[1])
+                if token is not None:
+                    token.cancel(message[2] if len(message) > 2 else "cancelled")
+            elif kind == 'stop':
+                stop_event.set()
+                for token in list(tokens.values()):
+                    token.cancel("stop")
+                jobs.put(None)
+                return
+
+    # 带宽由协调进程在所有工作进程的传输之间统一分配
+    governor = RemoteGovernor(send) if options['bandwidth'] else None
+    threading.Thread(target=heartbeat, name=f"Heartbeat-{worker_id}", daemon=True).start()
+    threading.Thread(target=reader, name=f"Reader-{worker_id}", daemon=True).start()
+
+    try:
+        if options.get('downloader_factory'):
+            # 模拟设备等替代下载器（workload_replay.py 回放时使用）
+            downloader = options['downloader_factory']()
+        else:
+            from video_downloader import VideoDownloader
+            from record_index import RecordIndex
+            from sdk_binding import CallTracer
+            downloader = VideoDownloader(
+                record_index=RecordIndex(options['record_index_path']),
+                governor=governor,
+                tracer=CallTracer.from_settings(options['sdk'])
+            )
+    except Exception as e:
+        send('login_failed', worker_id, str(e))
+        stop_event.set()
+        return
+    send('ready', worker_id)
+
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            token = tokens[job['id']]
+            for channel in job['channels']:
+                if token.cancelled:
+                    break
+                send('started', job['id'], channel)
+                error = None
+                try:
+                    success = downloader.download_video(
+                        channel, job['start_time'], job['end_time'],
+                        options['record_root'], job['filename'], cancel_token=token)
+                except Exception as e:
+                    print(f"工作进程 {worker_id} 下载出错: {e}")
+                    success, error = False, str(e)
+                send('channel_done', job['id'], channel, success, error, token.cancelled)
+                if token.wait(options.get('channel_gap_seconds', CHANNEL_GAP_SECONDS)):
+                    break
+            send('job_done', job['id'], token.cancelled)
+            tokens.pop(job['id'], None)
+    finally:
+        stop_event.set()
+        downloader.close()
+
+
+class WorkerHandle:
+    """协调进程中的一个工作进程及其待执行的子任务"""
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.ready = False
+        self.last_seen = 0
+        self.job = None          # 正在执行的子任务
+        self.failures = 0
+        self.respawn_at = 0
+        self.error = None
+
+    def send(self, *message):
+        with self.send_lock:
+            if self.conn is None:
+                return False
+            try:
+                self.conn.send(message)
+                return True
+            except (OSError, EOFError, ValueError):
+                return False
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class WorkerPool:
+    """
+    多进程下载：协调线程 + N 个工作进程
+
+    DownloadManager 的队列仍是唯一的任务来源。协调线程把任务按通道拆成子任务放入共享的待分配队列，
+    哪个工作进程已登录且空闲就分配给哪个（登录失败或反复崩溃的进程不会积压子任务）；
+    子任务通过 multiprocessing.Pipe 下发，结果回到协调线程后调用 DownloadManager 的 mark_channel_completed / finish_task，
+    与单进程模式共用同一套记录与信号。
+
+    工作进程定时发送心跳；进程退出或心跳超时时终止并重新启动，正在执行的子任务
+    按“被取消”处理放回队列（同一任务反复导致崩溃超过 max_crash_retries 次后按失败处理）。
+    """
+
+    def __init__(self, manager, count=2, heartbeat_seconds=2, heartbeat_timeout=20,
+                 max_crash_retries=2, record_root="record", downloader_factory=None,
+                 channel_gap_seconds=CHANNEL_GAP_SECONDS):
+        self.manager = manager
+        self.count = max(1, int(count))
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_crash_retries = max_crash_retries
+        settings = manager.settings
+        # 所有工作进程的传输共用一个带宽控制器，按全局 / 单设备预算统一分配
+        self.governor = BandwidthGovernor.from_settings(settings['bandwidth'])
+        self.options = {
+            'heartbeat_seconds': heartbeat_seconds,
+            'record_root': record_root,
+            'bandwidth': self.governor is not None,
+            'sdk': settings['sdk'],
+            # 可序列化的无参可调用对象，在工作进程中创建下载器；为 None 时使用 VideoDownloader
+            'downloader_factory': downloader_factory,
+            'channel_gap_seconds': channel_gap_seconds,
+        }
+        self.workers = [WorkerHandle(i) for i in range(self.count)]
+        self._groups = {}       # 任务组 ID -> {'task', 'remaining', 'cancelled'}
+        self._jobs = {}         # 子任务 ID -> 子任务
+        self._pending = deque()  # 尚未分配给工作进程的子任务
+        self._next_id = 0
+        self._commands = queue.SimpleQueue()
+        self._wake_recv, self._wake_send = multiprocessing.Pipe(duplex=False)
+        self._wake_lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._running = False
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls, settings, manager):
+        """根据 settings['workers'] 创建，未启用时返回 None"""
+        if not settings.get('enabled'):
+            return None
+        return cls(manager, settings.get('count', 2),
+                   settings.get('heartbeat_seconds', 2), settings.get('heartbeat_timeout', 20),
+                   settings.get('max_crash_retries', 2))
+
+    # ---------- 供 DownloadManager 调用（任意线程） ----------
+
+    def start(self):
+        """启动工作进程（各自登录设备）与协调线程"""
+        if self._running:
+            return
+        self._running = True
+        for worker in self.workers:
+            self._spawn(worker)
+        self._thread = threading.Thread(target=self._run, name="WorkerPool", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """有新任务或状态变化时唤醒协调线程"""
+        with self._wake_lock:
+            try:
+                self._wake_send.send(None)
+            except (OSError, ValueError):
+                pass
+
+    def cancel_all(self, reason="pause"):
+        """取消所有正在执行和已分配的子任务，任务放回 DownloadManager 队列"""
+        # 先直接通知工作进程，使正在进行的传输立即停止
+        for worker in self.workers:
+            job = worker.job
+            if job is not None:
+                worker.send('cancel', job['id'], reason)
+        self._commands.put(('cancel', reason))
+        self.wake()
+
+    def wait_idle(self, timeout):
+        """等待所有已分配的子任务结束，返回是否在 timeout 秒内结束"""
+        return self._idle.wait(timeout)
+
+    def respawn_failed(self):
+        """立即重新启动登录失败或已退出的工作进程"""
+        self._commands.put(('respawn',))
+        self.wake()
+
+    def shutdown(self, deadline=5):
+        """停止协调线程和全部工作进程"""
+        if not self._running:
+            return
+        self.cancel_all("stop")
+        self._running = False
+        self.wake()
+        if self._thread:
+            self._thread.join(deadline)
+        for worker in self.workers:
+            worker.send('stop')
+        end = time.monotonic() + deadline
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(max(0, end - time.monotonic()))
+                if worker.process.is_alive():
+                    print(f"工作进程 {worker.worker_id} 未能在 {deadline} 秒内退出，强制结束")
+                    worker.process.terminate()
+                    worker.process.join(1)
+            if worker.conn is not None:
+                worker.conn.close()
+                worker.conn = None
+
+    # ---------- 协调线程 ----------
+
+    def _run(self):
+        while self._running:
+            readers = [self._wake_recv] + [w.conn for w in self.workers if w.conn is not None]
+            for conn in wait(readers, POLL_SECONDS):
+                if conn is self._wake_recv:
+                    while self._wake_recv.poll():
+                        self._wake_recv.recv()
+                    continue
+                worker = next(w for w in self.workers if w.conn is conn)
+                try:
+                    message = conn.recv()
+                except (OSError, EOFError):
+                    self._handle_crash(worker, "管道已关闭")
+                    continue
+                worker.last_seen = time.monotonic()
+                self._handle_message(worker, message)
+            self._handle_commands()
+            self._check_health()
+            self._dispatch()
+            self._update_idle()
+
+    def _handle_commands(self):
+        while True:
+            try:
+                command = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if command[0] == 'cancel':
+                while self._pending:
+                    self._finish_job(self._pending.popleft(), cancelled=True)
+            elif command[0] == 'respawn':
+                for worker in self.workers:
+                    if not worker.alive:
+                        worker.respawn_at = 0
+
+    def _handle_message(self, worker, message):
+        kind = message[0]
+        manager = self.manager
+        if kind == 'ready':
+            worker.ready = True
+            worker.failures = 0
+            worker.error = None
+            print(f"工作进程 {worker.worker_id} 已登录设备")
+            manager.set_device_status('connected', f"{self._ready_count()}/{self.count} 个工作进程已连接设备")
+        elif kind == 'login_failed':
+            worker.error = message[2]
+            print(f"工作进程 {worker.worker_id} 连接设备失败: {worker.error}")
+            if not self._ready_count():
+                manager.set_device_status('failed', worker.error)
+        elif kind == 'started':
+            job = self._jobs.get(message[1])
+            if job is not None:
+                task = job['task']
+                task['current_channel'] = message[2]
+                task['status'] = 'downloading'
+                manager.queue_updated.emit()
+                manager.progress_updated.emit(task['filename'], message[2], 0)
+        elif kind == 'channel_done':
+            _, job_id, channel, success, error, cancelled = message
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            filename = job['task']['filename']
+            if success:
+                manager.mark_channel_completed(filename, channel, job['task'])
+                manager.download_completed.emit(filename, channel)
+                manager.progress_updated.emit(filename, channel, 100)
+            elif not cancelled:
+                manager.download_failed.emit(filename, channel, error or "下载失败")
+        elif kind == 'job_done':
+            job = self._jobs.get(message[1])
+            if job is not None:
+                worker.job = None
+                self._finish_job(job, cancelled=message[2])
+        elif kind.startswith('bw_'):
+            self._handle_bandwidth(worker, message)
+
+    def _handle_bandwidth(self, worker, message):
+        """处理工作进程的带宽消息，传输键加上进程编号以区分不同进程"""
+        if self.governor is None:
+            return
+        kind, key = message[0], (worker.worker_id,) + tuple(message[1])
+        if kind == 'bw_register':
+            self.governor.register(key, message[2])
+        elif kind == 'bw_unregister':
+            self.governor.unregister(key)
+        elif kind == 'bw_report':
+            speed = self.governor.report(key, message[2])
+            if speed is not None:
+                worker.send('rate', message[1], speed)
+
+    def _release_bandwidth(self, worker):
+        """工作进程退出后移除其全部传输"""
+        if self.governor is None:
+            return
+        for key in [key for key in self.governor.transfers if key[0] == worker.worker_id]:
+            self.governor.unregister(key)
+
+    def _ready_count(self):
+        return sum(1 for w in self.workers if w.ready)
+
+    def _check_health(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None:
+                if self._running and now >= worker.respawn_at:
+                    self._spawn(worker)
+                continue
+            if not worker.process.is_alive():
+                self._handle_crash(worker, worker.error or f"进程已退出（退出码 {worker.process.exitcode}）")
+            elif now - worker.last_seen > self.heartbeat_timeout:
+                self._handle_crash(worker, f"{self.heartbeat_timeout} 秒内没有心跳")
+
+    def _handle_crash(self, worker, reason):
+        """结束异常的工作进程，正在执行的子任务放回队列，并安排重新启动"""
+        print(f"工作进程 {worker.worker_id} 异常: {reason}")
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(1)
+        if worker.conn is not None:
+            worker.conn.close()
+        worker.process = None
+        worker.conn = None
+        worker.ready = False
+        self._release_bandwidth(worker)
+        worker.failures += 1
+        worker.respawn_at = time.monotonic() + min(RESPAWN_MAX_SECONDS,
+                                                   RESPAWN_BASE_SECONDS * 2 ** (worker.failures - 1))
+        job, worker.job = worker.job, None
+        if job is not None:
+            task = job['task']
+            task['crash_retries'] = task.get('crash_retries', 0) + 1
+            # 反复导致崩溃的任务按失败处理，避免无限重试
+            self._finish_job(job, cancelled=task['crash_retries'] <= self.max_crash_retries)
+        if not self._ready_count():
+            self.manager.set_device_status('failed', f"工作进程异常: {reason}")
+
+    def _spawn(self, worker):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        options = dict(self.options, record_index_path=f"data/record_index.w{worker.worker_id}.json")
+        process = multiprocessing.Process(target=worker_main, args=(worker.worker_id, child_conn, options),
+                                          name=f"DownloadWorker-{worker.worker_id}", daemon=True)
+        process.start()
+        child_conn.close()
+        worker.process = process
+        worker.conn = parent_conn
+        worker.ready = False
+        worker.last_seen = time.monotonic()
+        print(f"已启动工作进程 {worker.worker_id}（PID {process.pid}）")
+
+    def _dispatch(self):
+        manager = self.manager
+        accepting = manager.is_running and not manager.is_paused and manager.state_ready
+        outstanding = len(self._pending) + sum(w.job is not None for w in self.workers)
+        while accepting and outstanding < self.count * PREFETCH_PER_WORKER:
+            task = manager.take_task()
+            if task is None:
+                break
+            # 预录缓冲覆盖的通道直接在本地截取，不分配给工作进程
+            for channel in list(task['channels']):
+                if manager.try_local_clip(task, channel):
+                    manager.mark_channel_completed(task['filename'], channel, task)
+                    manager.download_completed.emit(task['filename'], channel)
+            if not task['channels']:
+                manager.finish_task(task, False)
+                continue
+            # 每个通道一个子任务，由先空闲的工作进程领取
+            group_id = self._new_id()
+            self._groups[group_id] = {'task': task, 'remaining': len(task['channels']), 'cancelled': False}
+            for channel in task['channels']:
+                job = {
+                    'id': self._new_id(), 'group': group_id, 'task': task,
+                    'filename': task['filename'], 'channels': [channel],
+                    'start_time': task['start_time'], 'end_time': task['end_time'],
+                }
+                self._jobs[job['id']] = job
+                self._pending.append(job)
+                outstanding += 1
+
+        for worker in self.workers:
+            if not accepting or not self._pending:
+                break
+            if not worker.ready or worker.job is not None:
+                continue
+            job = self._pending.popleft()
+            payload = {key: job[key] for key in ('id', 'filename', 'channels', 'start_time', 'end_time')}
+            if worker.send('job', payload):
+                worker.job = job
+            else:
+                self._pending.appendleft(job)
+
+    def _finish_job(self, job, cancelled):
+        self._jobs.pop(job['id'], None)
+        group = self._groups.get(job['group'])
+        if group is None:
+            return
+        group['cancelled'] |= cancelled
+        group['remaining'] -= 1
+        if group['remaining'] == 0:
+            del self._groups[job['group']]
+            self.manager.finish_task(group['task'], group['cancelled'])
+
+    def _update_idle(self):
+        if self._groups:
+            self._idle.clear()
+        else:
+            self._idle.set()
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
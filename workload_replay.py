@@ -0,0 +1,539 @@
+"""
+生产负载的采集与回放
+
+从 completed_files.json、data/dropdata.csv 和 logs/app.log 中提取历史触发时间线，
+按 1× / 10× / 100× 等倍速回放到 DownloadManager.add_task（或写入触发文件交给 FileMonitor），
+下载由模拟设备完成，比较不同下载配置下的队列长度与任务延迟。
+
+用法:
+    python workload_replay.py capture -o data/workload.json
+    python workload_replay.py replay data/workload.json --speed 10 100 \\
+        --engine single={} --engine 'workers4={"workers": {"enabled": true, "count": 4}}'
+
+回放在临时目录中进行（record、completed_files.json 等都写入临时目录），不影响本地记录。
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from functools import partial
+
+from history_store import TIME_FORMAT, CompletedHistory
+from trigger_rules import TriggerRules
+
+# 日志行：2025-06-18 14:57:25,717 - VideoDownloader - INFO - 程序启动
+LOG_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ - \S+ - (\w+) - (.*)$')
+# 程序启动 / 退出对应的日志内容
+LOG_SESSION_START = "程序启动"
+LOG_SESSION_END = ("程序退出", "程序运行出错", "初始化失败")
+
+# 回放过程中输出进度的间隔（墙钟秒）
+REPORT_SECONDS = 10
+# 未指定 --engine 时比较的下载配置
+DEFAULT_ENGINES = {
+    'single': {},
+    'workers2': {'workers': {'enabled': True, 'count': 2}},
+}
+# 回放时关闭的功能（与下载调度无关，且会访问真实设备或本机端口）
+REPLAY_SETTINGS = {
+    'api': {'enabled': False},
+    'prerecord': {'enabled': False},
+    'tiering': {'enabled': False},
+}
+
+
+def _percentile(values, q):
+    """最近秩百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def _summary(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': _percentile(values, 50),
+        'p90': _percentile(values, 90),
+        'p99': _percentile(values, 99),
+        'max': max(values),
+    }
+
+
+# ---------- 采集 ----------
+
+def read_sessions(log_path):
+    """
+    从 logs/app.log 中提取程序运行区间 [(开始, 结束)]（epoch 秒）
+
+    区间从“程序启动”开始，到“程序退出”/启动失败的错误日志结束；没有结束日志（进程被杀）时
+    以该区间内最后一行日志的时间作为结束。
+    """
+    sessions = []
+    start = last = None
+    if not os.path.exists(log_path):
+        return sessions
+    with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            match = LOG_LINE.match(line)
+            if match is None:
+                continue
+            timestamp = datetime.strptime(match.group(1), TIME_FORMAT).timestamp()
+            message = match.group(3)
+            if message.startswith(LOG_SESSION_START):
+                if start is not None:
+                    sessions.append((start, last))
+                start = last = timestamp
+                continue
+            if start is None:
+                continue
+            last = timestamp
+            if message.startswith(LOG_SESSION_END):
+                sessions.append((start, timestamp))
+                start = None
+    if start is not None:
+        sessions.append((start, last))
+    return sessions
+
+
+def downtime_windows(sessions):
+    """相邻运行区间之间的停机时段 [(开始, 结束)]"""
+    return [(previous[1], current[0]) for previous, current in zip(sessions, sessions[1:])
+            if current[0] > previous[1]]
+
+
+def _arrival(trigger_at, downtime):
+    """触发落在停机时段内时，程序在下次启动时才处理（启动时扫描已有的触发文件）"""
+    for start, end in downtime:
+        if start <= trigger_at < end:
+            return end
+    return trigger_at
+
+
+def _resolve(rules, name, fallback):
+    """用触发规则计算任务（没有触发文件内容，按文件名或 fallback 时间解析）"""
+    for rule in rules.rules:
+        file_info = rule.apply(name, None, fallback)
+        if file_info is not None:
+            return file_info
+    return None
+
+
+def capture(completed_path="completed_files.json", deleted_path="data/dropdata.csv",
+            log_path="logs/app.log", rules_path="config/trigger_rules.json"):
+    """
+    提取历史触发时间线
+
+    返回:
+    dict: {'events': [...], 'downtime': [[开始, 结束], ...]}；每个事件包含任务名、触发 / 到达时间、
+          下载时间段（相对触发时间的秒数）、通道、结果（completed / deleted）和完成时间
+    """
+    rules = TriggerRules.load(rules_path)
+    downtime = downtime_windows(read_sessions(log_path))
+    events = {}
+
+    def add(name, fallback, outcome, channels=None, completed_at=None):
+        if name in events:
+            return
+        file_info = _resolve(rules, name, fallback)
+        if file_info is None:
+            return
+        trigger_at = file_info['trigger_time'].timestamp()
+        events[name] = {
+            'name': name,
+            'trigger_at': trigger_at,
+            'arrival': _arrival(trigger_at, downtime),
+            'start_offset': (file_info['start_time'] - file_info['trigger_time']).total_seconds(),
+            'end_offset': (file_info['end_time'] - file_info['trigger_time']).total_seconds(),
+            'channels': list(channels or file_info['channels']),
+            'outcome': outcome,
+            'completed_at': completed_at,
+        }
+
+    history = CompletedHistory(completed_path)
+    for record in history:
+        completed_at = datetime.strptime(record['completion_time'], TIME_FORMAT).timestamp()
+        triggered_at = datetime.strptime(record['trigger_time'], TIME_FORMAT).timestamp()
+        add(record['filename'], triggered_at, 'completed', record['channels'], completed_at)
+
+    if os.path.exists(deleted_path):
+        with open(deleted_path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    deleted_at = datetime.strptime(row['deleted_time'], TIME_FORMAT).timestamp()
+                except (KeyError, TypeError, ValueError):
+                    continue
+                add(row['filename'], deleted_at, 'deleted')
+
+    return {
+        'events': sorted(events.values(), key=lambda event: (event['arrival'], event['name'])),
+        'downtime': [list(window) for window in downtime],
+    }
+
+
+def describe(workload):
+    """输出时间线概况：数量、时间跨度、突发程度与生产环境的延迟"""
+    events = workload['events']
+    if not events:
+        print("没有提取到任何触发")
+        return
+    first, last = events[0]['arrival'], events[-1]['arrival']
+    delayed = sum(1 for event in events if event['arrival'] > event['trigger_at'])
+    print(f"触发数: {len(events)}（已完成 {sum(e['outcome'] == 'completed' for e in events)}，"
+          f"已删除 {sum(e['outcome'] == 'deleted' for e in events)}）")
+    print(f"时间范围: {datetime.fromtimestamp(first)} - {datetime.fromtimestamp(last)}")
+    print(f"停机时段: {len(workload['downtime'])} 个，{delayed} 个触发在程序重新启动后才处理")
+    per_hour = {}
+    for event in events:
+        hour = int(event['arrival'] // 3600)
+        per_hour[hour] = per_hour.get(hour, 0) + 1
+    busiest = max(per_hour.items(), key=lambda item: item[1])
+    print(f"每小时触发数: 平均 {len(events) / len(per_hour):.1f}（有触发的小时），"
+          f"最多 {busiest[1]}（{datetime.fromtimestamp(busiest[0] * 3600):%Y-%m-%d %H:00}）")
+    latency = [event['completed_at'] - event['arrival'] for event in events
+               if event['completed_at'] and event['completed_at'] >= event['arrival']]
+    stats = _summary(latency)
+    if stats['count']:
+        print(f"生产环境延迟（到达 → 完成）: p50 {stats['p50']:.0f}s，p90 {stats['p90']:.0f}s，"
+              f"p99 {stats['p99']:.0f}s，最大 {stats['max']:.0f}s（{stats['count']} 个任务）")
+
+
+def schedule(events, max_gap=None):
+    """
+    计算每个事件相对回放开始的时间（秒），超过 max_gap 的空闲间隔缩短为 max_gap
+
+    返回:
+    list: [(偏移秒数, 事件)]
+    """
+    result = []
+    offset = 0.0
+    previous = None
+    for event in events:
+        if previous is not None:
+            gap = event['arrival'] - previous
+            offset += gap if max_gap is None else min(gap, max_gap)
+        previous = event['arrival']
+        result.append((offset, event))
+    return result
+
+
+# ---------- 模拟设备 ----------
+
+class SimulatedDevice:
+    """
+    模拟设备：代替 VideoDownloader 下载视频
+
+    每个通道的下载耗时 = setup_seconds + 视频时长 / playback_rate，按回放倍速 speed 缩短；
+    下载完成后在 record/<任务名>/ 下写入一个很小的视频文件。可被取消令牌立即中断。
+    """
+
+    def __init__(self, playback_rate=8.0, setup_seconds=1.0, speed=1.0):
+        self.playback_rate = playback_rate
+        self.setup_seconds = setup_seconds
+        self.speed = speed
+
+    def download_video(self, lChannel, start_time, end_time, base_save_path="record", filename=None,
+                       cancel_token=None):
+        duration = (end_time - start_time).total_seconds()
+        seconds = (self.setup_seconds + duration / self.playback_rate) / self.speed
+        if cancel_token is not None:
+            if cancel_token.wait(seconds):
+                return False
+        else:
+            time.sleep(seconds)
+        folder_path = os.path.join(base_save_path, filename or "unnamed")
+        os.makedirs(folder_path, exist_ok=True)
+        save_path = os.path.join(folder_path, "{}_{}.mp4".format(lChannel, start_time.strftime('%Y%m%d_%H%M%S')))
+        with open(save_path, 'wb') as f:
+            f.write(b'\0' * 1024)
+        return True
+
+    def close(self):
+        pass
+
+
+# ---------- 回放 ----------
+
+def _task_info(event):
+    """回放时的任务信息：保持原始的时间段长度与通道"""
+    trigger_time = datetime.fromtimestamp(event['trigger_at'])
+    return {
+        'filename': event['name'],
+        'start_time': trigger_time + timedelta(seconds=event['start_offset']),
+        'end_time': trigger_time + timedelta(seconds=event['end_offset']),
+        'channels': event['channels'],
+        'trigger_time': trigger_time,
+    }
+
+
+def _write_config(engine_settings, rules_path):
+    os.makedirs("config", exist_ok=True)
+    from settings import _merge
+    with open(os.path.join("config", "settings.json"), 'w', encoding='utf-8') as f:
+        json.dump(_merge(engine_settings, REPLAY_SETTINGS), f, ensure_ascii=False, indent=2)
+    if os.path.exists(rules_path):
+        shutil.copyfile(rules_path, os.path.join("config", "trigger_rules.json"))
+
+
+def replay(workload, engine_name, engine_settings, speed=10, mode='task', max_gap=None, playback_rate=8.0,
+           setup_seconds=1.0, sample_seconds=10, drain_seconds=86400, verbose=False, keep_dir=False):
+    """
+    按 speed 倍速回放时间线，返回队列长度与延迟统计
+
+    时间（延迟、采样间隔、drain_seconds）都以回放前的“真实时间”计，即墙钟时间 × speed。
+    mode 为 task 时直接调用 DownloadManager.add_task；为 file 时在临时监控目录中创建触发文件，
+    经 FileMonitor 与触发规则生成任务。
+    """
+    rules_path = os.path.abspath(os.path.join("config", "trigger_rules.json"))
+    events = schedule(workload['events'], max_gap)
+    work_dir = tempfile.mkdtemp(prefix="replay_")
+    cwd = os.getcwd()
+    output = sys.stdout
+    log = io.StringIO()
+    result = {'engine': engine_name, 'speed': speed, 'mode': mode, 'injected': 0}
+    os.chdir(work_dir)
+    try:
+        _write_config(engine_settings, rules_path)
+        with contextlib.redirect_stdout(sys.stdout if verbose else log):
+            result.update(_run(events, speed, mode, playback_rate, setup_seconds, sample_seconds,
+                               drain_seconds, output))
+    finally:
+        os.chdir(cwd)
+        if keep_dir:
+            print(f"回放目录: {work_dir}", file=output)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def _run(events, speed, mode, playback_rate, setup_seconds, sample_seconds, drain_seconds, output):
+    from PySide6.QtCore import QCoreApplication
+    import download_manager
+    from download_manager import DownloadManager, DEVICE_CONNECTED
+    from worker_pool import WorkerPool
+
+    app = QCoreApplication.instance() or QCoreApplication([])
+    # 通道之间的固定等待同样按倍速缩短
+    gap_seconds = download_manager.CHANNEL_GAP_SECONDS
+    download_manager.CHANNEL_GAP_SECONDS = gap_seconds / speed
+    device = partial(SimulatedDevice, playback_rate, setup_seconds, speed)
+    manager = DownloadManager()
+    monitor = None
+    try:
+        manager.load_state()
+        workers = manager.settings['workers']
+        if workers.get('enabled'):
+            manager.worker_pool = WorkerPool(
+                manager, workers.get('count', 2),
+                workers.get('heartbeat_seconds', 2), workers.get('heartbeat_timeout', 20),
+                workers.get('max_crash_retries', 2), downloader_factory=device,
+                channel_gap_seconds=gap_seconds / speed)
+            manager.worker_pool.start()
+        else:
+            manager.downloader = device()
+            manager.set_device_status(DEVICE_CONNECTED, "模拟设备")
+        if mode == 'file':
+            from file_monitor import FileMonitor
+            os.makedirs("triggers", exist_ok=True)
+            monitor = FileMonitor("triggers")
+            monitor.new_file_detected.connect(manager.add_task)
+            monitor.start()
+        manager.start()
+        return _drive(app, manager, events, speed, mode, sample_seconds, drain_seconds, output)
+    finally:
+        manager.shutdown()
+        if monitor:
+            monitor.stop()
+            monitor.wait(5000)
+        download_manager.CHANNEL_GAP_SECONDS = gap_seconds
+
+
+def _drive(app, manager, events, speed, mode, sample_seconds, drain_seconds, output):
+    """注入事件并采样队列长度，直到全部任务结束或超过 drain_seconds"""
+    tick = max(0.01, min(0.2, sample_seconds / speed))
+    origin = time.monotonic()
+    injected = {}     # 任务名 -> 注入时间（回放时间，秒）
+    seen = set()      # 出现在队列中的任务
+    latency = []      # [(注入时间, 延迟)]
+    failed = []
+    depth_curve = []  # [(回放时间, 队列长度)]
+    next_sample = 0.0
+    next_report = time.monotonic()
+    index = 0
+    drain_deadline = None
+    while True:
+        now = (time.monotonic() - origin) * speed
+        while index < len(events) and events[index][0] <= now:
+            offset, event = events[index]
+            index += 1
+            injected[event['name']] = now
+            if mode == 'file':
+                with open(os.path.join("triggers", event['name'] + ".txt"), 'w', encoding='utf-8'):
+                    pass
+            else:
+                manager.add_task(_task_info(event))
+        app.processEvents()
+
+        active, queue = manager.queue_snapshot()
+        outstanding = {task['filename'] for task in active} | {task['filename'] for task in queue}
+        seen |= outstanding & injected.keys()
+        for name in [name for name in injected if name not in outstanding]:
+            if name in manager.completed_files:
+                latency.append((injected[name], now - injected[name]))
+            elif name in seen:
+                failed.append(name)
+            else:
+                continue  # 尚未进入队列（监控目录的事件还未处理）
+            del injected[name]
+
+        if now >= next_sample:
+            depth_curve.append((round(now, 1), len(outstanding)))
+            next_sample = now + sample_seconds
+        if time.monotonic() >= next_report:
+            print(f"  {now:8.0f}s 已注入 {index}/{len(events)}，队列 {len(outstanding)}，完成 {len(latency)}",
+                  file=output)
+            next_report = time.monotonic() + REPORT_SECONDS
+
+        if index == len(events):
+            if not injected:
+                break
+            if drain_deadline is None:
+                drain_deadline = now + drain_seconds
+            elif now >= drain_deadline:
+                break
+        wait = tick if index == len(events) else min(tick, max(0.0, (events[index][0] - now) / speed))
+        time.sleep(wait)
+
+    depths = [depth for _, depth in depth_curve]
+    return {
+        'injected': len(events),
+        'completed': len(latency),
+        'failed': len(failed),
+        'unfinished': len(injected),
+        'wall_seconds': time.monotonic() - origin,
+        'latency': _summary([value for _, value in latency]),
+        'queue_depth': {'max': max(depths, default=0), 'mean': sum(depths) / len(depths) if depths else 0},
+        'depth_curve': depth_curve,
+        'latency_curve': [(round(at, 1), round(value, 1)) for at, value in latency],
+    }
+
+
+def _format(value):
+    return "-" if value is None else f"{value:.0f}"
+
+
+def print_results(results):
+    print(f"{'配置':<12}{'倍速':>6}{'完成':>7}{'失败':>6}{'未完成':>7}{'队列最大':>9}{'队列平均':>9}"
+          f"{'p50':>8}{'p90':>8}{'p99':>8}{'最大':>8}{'耗时':>8}")
+    for result in results:
+        latency = result['latency']
+        print(f"{result['engine']:<12}{result['speed']:>6g}{result['completed']:>7}{result['failed']:>6}"
+              f"{result['unfinished']:>7}{result['queue_depth']['max']:>9}{result['queue_depth']['mean']:>9.1f}"
+              f"{_format(latency.get('p50')):>8}{_format(latency.get('p90')):>8}{_format(latency.get('p99')):>8}"
+              f"{_format(latency.get('max')):>8}{result['wall_seconds']:>7.0f}s")
+    print("延迟与队列长度按回放前的时间（秒）计；曲线数据见 -o 输出的 JSON")
+
+
+def _parse_engine(text):
+    """--engine 名称=JSON 或 名称=JSON 文件路径"""
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"格式应为 名称=JSON: {text}")
+    if os.path.exists(value):
+        with open(value, 'r', encoding='utf-8') as f:
+            return name, json.load(f)
+    try:
+        return name, json.loads(value or '{}')
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"配置 {name} 不是有效的 JSON: {e}")
+
+
+def _parse_date(text):
+    return datetime.strptime(text, '%Y-%m-%d').timestamp()
+
+
+def _select(events, start=None, end=None, limit=None):
+    events = [event for event in events
+              if (start is None or event['arrival'] >= start) and (end is None or event['arrival'] < end)]
+    return events[:limit] if limit else events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生产负载的采集与回放")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    capture_parser = commands.add_parser('capture', help="从本地记录与日志提取触发时间线")
+    capture_parser.add_argument('--completed', default="completed_files.json")
+    capture_parser.add_argument('--deleted', default="data/dropdata.csv")
+    capture_parser.add_argument('--log', default="logs/app.log")
+    capture_parser.add_argument('-o', '--output', default="data/workload.json")
+
+    replay_parser = commands.add_parser('replay', help="按倍速回放时间线并比较下载配置")
+    replay_parser.add_argument('workload', nargs='?', help="capture 生成的文件；省略时直接从本地记录提取")
+    replay_parser.add_argument('--speed', type=float, nargs='+', default=[10])
+    replay_parser.add_argument('--engine', type=_parse_engine, action='append',
+                               help="名称=配置覆盖（JSON 或 JSON 文件），可重复；默认比较 single 与 workers2")
+    replay_parser.add_argument('--mode', choices=('task', 'file'), default='task',
+                               help="task：直接调用 add_task；file：写入触发文件经 FileMonitor 处理")
+    replay_parser.add_argument('--start', type=_parse_date, help="只回放该日期（YYYY-MM-DD）之后的触发")
+    replay_parser.add_argument('--end', type=_parse_date, help="只回放该日期之前的触发")
+    replay_parser.add_argument('--limit', type=int, help="最多回放的触发数")
+    replay_parser.add_argument('--max-gap', type=float, default=3600,
+                               help="空闲间隔超过该秒数时缩短，0 表示保持原始间隔")
+    replay_parser.add_argument('--playback-rate', type=float, default=8.0, help="模拟设备的回放下载倍速")
+    replay_parser.add_argument('--setup-seconds', type=float, default=1.0, help="模拟设备每个通道的准备时间")
+    replay_parser.add_argument('--sample-seconds', type=float, default=10)
+    replay_parser.add_argument('--drain-seconds', type=float, default=86400,
+                               help="全部注入后等待任务完成的最长时间")
+    replay_parser.add_argument('-o', '--output', help="保存统计与曲线的 JSON 文件")
+    replay_parser.add_argument('--verbose', action='store_true', help="显示下载管理器的输出")
+    replay_parser.add_argument('--keep', action='store_true', help="保留临时回放目录")
+
+    args = parser.parse_args(argv)
+    if args.command == 'capture':
+        workload = capture(args.completed, args.deleted, args.log)
+        describe(workload)
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(workload, f, ensure_ascii=False)
+        print(f"已保存到 {args.output}")
+        return
+
+    if args.workload:
+        with open(args.workload, 'r', encoding='utf-8') as f:
+            workload = json.load(f)
+    else:
+        workload = capture()
+    workload = dict(workload, events=_select(workload['events'], args.start, args.end, args.limit))
+    describe(workload)
+    engines = args.engine or list(DEFAULT_ENGINES.items())
+    results = []
+    for name, engine_settings in engines:
+        for speed in args.speed:
+            print(f"回放 {name}，{speed:g}×")
+            results.append(replay(workload, name, engine_settings, speed, args.mode, args.max_gap or None,
+                                  args.playback_rate, args.setup_seconds, args.sample_seconds,
+                                  args.drain_seconds, args.verbose, args.keep))
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False)
+        print(f"已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()